@@ -0,0 +1,99 @@
+import os
+import pickle
+import numpy as np
+import wfdb
+from concurrent.futures import ThreadPoolExecutor
+from rpeakdetection.Utility import Utility
+from rpeakdetection.Record import Record, db_fs
+
+ut = Utility()
+rd = Record()
+index_path = 'data/index/'
+db_paths = {'mitdb': 'data/ecg/mitdb/', 'incartdb': 'data/ecg/incartdb/'}
+
+
+class BeatIndex:
+    """
+    Two level index of the annotated beats of a Physionet database.
+    The first level is a per-database manifest, built once and cached on disk, containing for each record the beat
+    locations, the beat symbols and the signal length. The second level is computed on the fly from the manifest for a
+    given list of records and beat window: the number of beats of each record and their offsets in the dataset arrays.
+    """
+
+    def __init__(self):
+        self.manifests = dict()
+
+    def manifest(self, db='mitdb', names=None, rebuild=False, n_jobs=None):
+        """
+        :param db: string identifier for the Physionet DB, 'mitdb' or 'incartdb'
+        :param names: records that must be in the manifest. If None, all the records of the database
+        :param rebuild: whether to ignore the cached manifest and read again all the annotations
+        :param n_jobs: number of threads used to read the missing annotations
+        :return: dict[signal_name, dict] with keys 'peaks', 'symbols', 'sig_len' and 'fs'
+        """
+        if names is None:
+            names = wfdb.get_record_list(db)
+        manifest = self.manifests.get(db)
+        cache_name = index_path + db + '.pkl'
+        if manifest is None and not rebuild and os.path.isfile(cache_name):
+            with open(cache_name, 'rb') as fid:
+                manifest = pickle.load(fid)
+        if manifest is None or rebuild:
+            manifest = dict()
+        missing = [name for name in names if name not in manifest]
+        if len(missing) > 0:
+            if n_jobs is None or n_jobs == 1:
+                entries = map(lambda name: self.read_entry(db, name), missing)
+            else:
+                with ThreadPoolExecutor(max_workers=n_jobs if n_jobs > 0 else os.cpu_count()) as pool:
+                    entries = list(pool.map(lambda name: self.read_entry(db, name), missing))
+            for name, entry in zip(missing, entries):
+                manifest[name] = entry
+            os.makedirs(index_path, exist_ok=True)
+            with open(cache_name, 'wb') as fid:
+                pickle.dump(manifest, fid)
+        self.manifests[db] = manifest
+        return manifest
+
+    def read_entry(self, db, name):
+        path = db_paths[db] + name
+        peaks, symbols = ut.remove_non_beat(path, False)
+        header = wfdb.rdheader(path)
+        return {'peaks': np.asarray(peaks, dtype=np.int64), 'symbols': np.asarray(symbols), 'sig_len': header.sig_len,
+                'fs': header.fs}
+
+    def entry(self, db, name, fs=None):
+        """
+        :param fs: sampling frequency of the returned peaks and sig_len. If None, the one of the record
+        :return: dict with keys 'peaks', 'symbols', 'sig_len' and 'fs'
+        """
+        entry = self.manifest(db, [name])[name]
+        # manifests cached before the sampling frequency was stored
+        record_fs = entry.get('fs', db_fs[db])
+        if fs is None or fs == record_fs:
+            return dict(entry, fs=record_fs)
+        return {'peaks': rd.rescale(entry['peaks'], record_fs, fs), 'symbols': entry['symbols'],
+                'sig_len': rd.resampled_length(entry['sig_len'], record_fs, fs), 'fs': fs}
+
+    def counts(self, names, db='mitdb', window=None, left_window=70, right_window=100, fs=None):
+        """
+        :param fs: sampling frequency the records are read at, which the windows refer to
+        :return: numpy array with the number of beats of each record whose window fits in the signal
+        """
+        if window is not None:
+            left_window = int(window / 2)
+            right_window = left_window
+        self.manifest(db, names)
+        counts = np.zeros(len(names), dtype=np.int64)
+        for i, name in enumerate(names):
+            entry = self.entry(db, name, fs)
+            peaks = entry['peaks']
+            counts[i] = np.count_nonzero((peaks >= left_window) & (peaks < entry['sig_len'] - right_window))
+        return counts
+
+    def offsets(self, names, db='mitdb', window=None, left_window=70, right_window=100, fs=None):
+        """
+        :return: numpy array of size len(names) + 1. The beats of names[i] are stored in [offsets[i], offsets[i+1])
+        """
+        counts = self.counts(names, db, window=window, left_window=left_window, right_window=right_window, fs=fs)
+        return np.concatenate(([0], np.cumsum(counts)))
@@ -1,59 +1,63 @@
 from beatclassification.Preprocessing import Preprocessing
-from sklearn.model_selection import GridSearchCV
-from sklearn.neighbors import KNeighborsClassifier
+from rpeakdetection.ModelSelection import NeighborGridSearch
+from rpeakdetection.Profiler import profiler
 import numpy as np
-from sklearn import metrics
-from sklearn.metrics import precision_score, recall_score
-import scikitplot as splt
-import matplotlib.pyplot as plt
+from beatclassification.Metrics import ConfusionMatrix, macro_f1
+from rpeakdetection.Report import report
 from beatclassification.data_visualization import data_visualization
+from beatclassification.CrossValidation import CrossValidation
+from beatclassification.Resampling import Resampling
+from beatclassification import Datasets as ds
 
 prep = Preprocessing()
 dv = data_visualization()
+rs = Resampling()
 train_shape = (51011, 170)
 test_shape = (49701, 170)
 
 
 def score_func(y_true, pred):
-    return np.mean(metrics.f1_score(y_true, pred, average=None))
+    return macro_f1(y_true, pred)
 
 
-train_dataset = ['106', '112', '122', '201', '223', '230', "108", "109", "115", "116", "118", "119", "124",
-                 "205", "207", "208", "209", "215", '101', '114', '203', '220']
-test_dataset = ["100", "103", "105", "111", "113", "117", "121", "123", "200", "202", "210", "212", "213", "214", "219",
-                "221", "222", "228", "231", "232", "233", "234"]
+train_dataset = ds.DS1
+test_dataset = ds.DS2
 distribution = dv.data_distribution(train_dataset, aami=True)
 X_train, Y_train = prep.preprocess(train_dataset, train_shape, one_hot=False)
 augment_F = distribution['V']/distribution['F']
-X_train, Y_train = prep.augment_data(X_train, Y_train, ['N', 'S','V', 'F'], label='S', factor=2, one_hot=False)
-X_train, Y_train = prep.augment_data(X_train, Y_train, ['N', 'S','V', 'F'], label='F', factor=2, one_hot=False)
+patients = ds.beat_patients(train_dataset)
+# S and F beats repeated twice, each copy belongs to the patient of its beat so that it stays in its patient fold
+augmentation = {1: 2, 3: 2}
+augmented = rs.indices(Y_train, augmentation, one_hot=False)
+X_beats, Y_beats = X_train, Y_train
+X_train, Y_train, train_patients = X_train[augmented], Y_train[augmented], patients[augmented]
 X_test, Y_test = prep.preprocess(test_dataset, test_shape, one_hot=False)
-classifier = KNeighborsClassifier()
 parameters = {
     'n_neighbors': np.arange(1, 21, 2),
     'weights': ['uniform', 'distance'],
 }
 
-grid_search = GridSearchCV(classifier,
-                           parameters,
-                           scoring=metrics.make_scorer(score_func),
-                           cv=5,
-                           n_jobs=-1,
-                           verbose=20)
+grid_search = NeighborGridSearch(score_func, cv=5, n_jobs=-1)
 print("training")
-grid_search.fit(X_train, Y_train)
-model = grid_search.best_estimator_
-predicted = model.predict(X_test)
-splt.metrics.plot_confusion_matrix(Y_test, predicted)
+grid_search.fit(X_train, Y_train, patients=train_patients, **parameters)
+predicted = grid_search.predict(X_test)
+classes = ['N', 'S', 'V', 'F']
+# the best parameters cross validated over the patients of DS1, augmenting the training folds only
+cv = CrossValidation(classes=classes, ratios=augmentation)
+cv.summary(cv.evaluate(grid_search.best_estimator_, X_beats, Y_beats, patients))
+cm = ConfusionMatrix(len(classes)).update(Y_test, predicted)
+report.confusion(cm.matrix, classes, 'KNN')
 print("per class precision")
-precision = precision_score(Y_test, predicted, average=None)
+precision = cm.precision()
 print(precision)
 print("average precision")
 print(np.mean(precision))
 print('per class recall')
-recall = recall_score(Y_test, predicted, average=None)
+recall = cm.recall()
 print(recall)
 print('average recall')
 print(np.mean(recall))
-plt.show()
-plt.close()
+print(cm.aami(classes))
+profiler.export('classification')
+report.table('KNN', {'Se': recall, '+P': precision, 'FPR': cm.fpr()}, classes)
+report.render('classification')
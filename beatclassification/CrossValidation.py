@@ -0,0 +1,84 @@
+import warnings
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from beatclassification.Metrics import ConfusionMatrix, labels
+from beatclassification.Resampling import Resampling
+from rpeakdetection.ModelSelection import PatientKFold
+from rpeakdetection.Profiler import profile, profiler
+
+rs = Resampling()
+# per class scores of each fold
+metrics = ('recall', 'precision', 'fpr', 'f1')
+
+
+@profile('train')
+def fit_and_count( estimator, X, Y, train, test, n_classes, ratios ):
+    """fits estimator on the train rows, resampled by ratios, and counts its predictions on the test rows
+    :return: ConfusionMatrix
+    """
+    if ratios is not None:
+        train = train[ rs.indices(Y[ train ], ratios, one_hot=False) ]
+    model = clone(estimator).fit(X[ train ], Y[ train ])
+    return ConfusionMatrix(n_classes).update(Y[ test ], model.predict(X[ test ]))
+
+
+class CrossValidation:
+    """
+    Patient wise k-fold cross validation of a classifier on a beat dataset, e.g. the one of Preprocessing.preprocess
+    on Datasets.DS1 with the patients of Datasets.beat_patients. The fold indexes are built once per dataset by
+    PatientKFold, every fold is fitted and predicted in a worker process and reduced to its confusion matrix, from
+    which the scores of each fold, their mean and standard deviation are computed.
+    """
+
+    def __init__( self, n_splits=5, classes=None, n_jobs=-1, ratios=None ):
+        """
+        :param ratios: dict[label, ratio] the training beats of each fold are resampled by(see Resampling.indices),
+            so that augmented beats never leak in a test fold
+        """
+        self.classes = [ 'N', 'S', 'V', 'F' ] if classes is None else classes
+        self.n_jobs = n_jobs
+        self.ratios = ratios
+        self.kfold = PatientKFold(n_splits)
+
+    @profile('evaluate')
+    def evaluate( self, estimator, X, Y, patients ):
+        """
+        :param Y: class index, or one hot label, of each beat
+        :param patients: patient of each beat
+        :return: dict with the ConfusionMatrix of each fold('folds'), their sum('pooled') and, for each metric, the
+            scores of each fold('scores', NaN for the classes missing from a fold), their mean('mean') and standard
+            deviation('std') over the folds with the class
+        """
+        X = np.asarray(X)
+        Y = labels(Y, one_hot=np.ndim(Y) > 1)
+        # joblib memory maps X for the workers instead of copying it in each one
+        outputs = Parallel(n_jobs=self.n_jobs)(
+            delayed(profiler.remote(fit_and_count))(estimator, X, Y, train, test, len(self.classes), self.ratios)
+            for train, test in self.kfold.folds(patients))
+        folds = [ profiler.merged(output) for output in outputs ]
+        pooled = ConfusionMatrix(len(self.classes))
+        for cm in folds:
+            pooled.merge(cm)
+        # a class missing from a fold, e.g. F in a fold of patients without F beats, has no score in that fold
+        scores = {metric: np.array([ np.where(cm.present(), getattr(cm, metric)(), np.nan) for cm in folds ])
+                  for metric in metrics}
+        scores[ 'accuracy' ] = np.array([ cm.accuracy() for cm in folds ])
+        scores[ 'macro_f1' ] = np.array([ cm.macro('f1') for cm in folds ])
+        with warnings.catch_warnings():
+            # classes missing from every fold stay NaN
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            mean = {metric: np.nanmean(values, axis=0) for metric, values in scores.items()}
+            std = {metric: np.nanstd(values, axis=0) for metric, values in scores.items()}
+        return {'folds': folds, 'pooled': pooled, 'scores': scores, 'mean': mean, 'std': std}
+
+    def summary( self, results ):
+        """prints the mean and standard deviation over the folds of each score
+        """
+        print('{:d} patient folds'.format(len(results[ 'folds' ])))
+        for metric in results[ 'scores' ]:
+            mean = np.atleast_1d(results[ 'mean' ][ metric ])
+            std = np.atleast_1d(results[ 'std' ][ metric ])
+            names = self.classes if len(mean) == len(self.classes) else [ 'all' ]
+            print(metric + ': ' + ', '.join('{:s} {:.4f} +- {:.4f}'.format(name, m, s)
+                                            for name, m, s in zip(names, mean, std)))
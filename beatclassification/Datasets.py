@@ -0,0 +1,30 @@
+import numpy as np
+from beatclassification.BeatIndex import BeatIndex
+
+bi = BeatIndex()
+# inter patient split of mitdb by de Chazal et al., recommended by AAMI: DS1 to train, DS2 to test
+DS1 = [ '106', '112', '122', '201', '223', '230', '108', '109', '115', '116', '118', '119', '124', '205', '207', '208',
+        '209', '215', '101', '114', '203', '220' ]
+DS2 = [ '100', '103', '105', '111', '113', '117', '121', '123', '200', '202', '210', '212', '213', '214', '219', '221',
+        '222', '228', '231', '232', '233', '234' ]
+# records with paced beats, left out by AAMI
+paced = [ '102', '104', '107', '217' ]
+# the records of mitdb used by the intra patient splits
+mitdb = sorted(DS1 + DS2)
+# records of a patient recorded more than once, mapped to the first record of the patient
+same_patient = {'mitdb': {'202': '201'}}
+
+
+def patients( names, db='mitdb' ):
+    """
+    :return: list with the patient of each record, the record itself unless listed in same_patient
+    """
+    return [ db + '/' + same_patient.get(db, {}).get(name, name) for name in names ]
+
+
+def beat_patients( names, db='mitdb', window=None, left_window=70, right_window=100, fs=None ):
+    """
+    :return: numpy array with the patient of each beat of the dataset Preprocessing.preprocess builds from names
+    """
+    counts = bi.counts(names, db=db, window=window, left_window=left_window, right_window=right_window, fs=fs)
+    return np.repeat(patients(names, db), counts)
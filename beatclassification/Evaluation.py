@@ -1,81 +1,44 @@
-from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score, confusion_matrix
-import itertools
-import numpy as np
-import scikitplot as splt
-import matplotlib.pyplot as plt
+from beatclassification.Metrics import ConfusionMatrix
+from rpeakdetection.Profiler import profile
+from rpeakdetection.Report import report
 
 class Evaluation:
 
+    @profile('evaluate')
     def evaluate( self, predictions, Y_test,classes=None, title=None, one_hot=True, plot=True):
         if classes == None:
             classes = ['N', 'S', 'V', 'F']
-        if one_hot:
-            if len(classes) > 2:
-                predictions = list(map(lambda x: np.argmax(x), predictions))
-                Y_test = list(map(lambda x: np.argmax(x), Y_test))
-            else:
-                predictions = list(map(lambda x : 0 if x <0.5 else 1, predictions))
+        cm = ConfusionMatrix(len(classes)).update(Y_test, predictions, one_hot)
+        return self.scores(cm, classes, title, plot)
+
+    def scores( self, cm, classes=None, title=None, plot=True ):
+        '''
+        prints the scores of a confusion matrix, e.g. one accumulated batch by batch with ConfusionMatrix.update
+        :return: average f score
+        '''
+        if classes == None:
+            classes = ['N', 'S', 'V', 'F']
         if plot:
-            cm = confusion_matrix(Y_test, predictions)
-            self.plot_confusion_matrix(cm, classes, normalize=False, title=title)
-            plt.show()
-            plt.close()
-            self.plot_confusion_matrix(cm, classes, normalize=True, title='normalized ' +title)
-            plt.show()
-            plt.close()
+            print('Confusion matrix, without normalization')
+            print(cm.matrix)
+            # drawn with the other figures of the run by report.render
+            report.confusion(cm.matrix, classes, title='Confusion matrix' if title is None else title)
         print("average accuracy")
-        accuracy = accuracy_score(Y_test, predictions)
-        print(accuracy)
+        print(cm.accuracy())
         print("per class precision")
-        precision = precision_score(Y_test, predictions, average=None)
-        print(precision)
+        print(cm.precision())
         print("average precision")
-        av_precision = np.mean(precision)
-        print(av_precision)
+        print(cm.macro('precision'))
         print('per class recall')
-        recall = recall_score(Y_test, predictions, average=None)
-        print(recall)
+        print(cm.recall())
         print('average recall')
-        av_recall = np.mean(recall)
-        print(av_recall)
+        print(cm.macro('recall'))
         print('per class f score')
-        fscore = f1_score(Y_test, predictions, average=None)
-        print(fscore)
-        av_fscore = np.mean(fscore)
+        print(cm.f1())
+        av_fscore = cm.macro('f1')
         print('average fscore')
         print(av_fscore)
+        print('AAMI Se, +P, FPR')
+        for name, scores in cm.aami(classes).items():
+            print('{:s}: {:f}, {:f}, {:f}'.format(name, scores[ 'Se' ], scores[ '+P' ], scores[ 'FPR' ]))
         return av_fscore
-
-    def plot_confusion_matrix(self, cm, classes,
-                               normalize=False,
-                               title='Confusion matrix',
-                               cmap=plt.cm.Blues):
-        """
-        This function prints and plots the confusion matrix.
-        Normalization can be applied by setting `normalize=True`.
-        """
-        if normalize:
-            cm = cm.astype('float') / cm.sum(axis=1)[ :, np.newaxis ]
-            print("Normalized confusion matrix")
-        else:
-            print('Confusion matrix, without normalization')
-
-        print(cm)
-
-        plt.imshow(cm, interpolation='nearest', cmap=cmap)
-        plt.title(title)
-        plt.colorbar()
-        tick_marks = np.arange(len(classes))
-        plt.xticks(tick_marks, classes)
-        plt.yticks(tick_marks, classes)
-
-        fmt = '.2f' if normalize else 'd'
-        thresh = cm.max() / 2.
-        for i, j in itertools.product(range(cm.shape[ 0 ]), range(cm.shape[ 1 ])):
-            plt.text(j, i, format(cm[ i, j ], fmt),
-                     horizontalalignment="center",
-                     color="white" if cm[ i, j ] > thresh else "black")
-
-        plt.ylabel('True label')
-        plt.xlabel('Predicted label')
-        plt.tight_layout()
@@ -0,0 +1,130 @@
+import numpy as np
+
+
+def labels( y, one_hot=True ):
+    """
+    :param y: class indexes, or if one_hot, one hot rows or probabilities: the argmax of each row, thresholded at
+        0.5 for a single output
+    :return: int array of class indexes
+    """
+    y = np.asarray(y)
+    if one_hot and y.ndim == 2 and y.shape[ 1 ] > 1:
+        return np.argmax(y, axis=1)
+    y = y.reshape(len(y))
+    if one_hot and y.dtype.kind == 'f':
+        return (y >= 0.5).astype(np.int64)
+    return y.astype(np.int64)
+
+
+class ConfusionMatrix:
+    """
+    Confusion matrix of n_classes classes, true classes on the rows, built with a single bincount and accumulated
+    batch by batch with update(), so that a record, or a batch of a generator, is evaluated as soon as it is
+    predicted. All the per class scores are derived from the matrix:
+    - precision, the AAMI positive predictivity +P = TP / (TP + FP)
+    - recall, the AAMI sensitivity Se = TP / (TP + FN)
+    - fpr, the AAMI false positive rate FPR = FP / (FP + TN)
+    - f1, accuracy and specificity
+    A score whose denominator is zero is 0, like the ones of sklearn, and the macro averages leave out the classes
+    that are neither in the true nor in the predicted labels, like sklearn does.
+    """
+
+    def __init__( self, n_classes=4 ):
+        self.n_classes = n_classes
+        self.reset()
+
+    def reset( self ):
+        self.matrix = np.zeros((self.n_classes, self.n_classes), dtype=np.int64)
+
+    def update( self, y_true, y_pred, one_hot=False ):
+        """adds the predictions of a batch
+        :param one_hot: whether y_true and y_pred are converted with labels()
+        :return: self
+        """
+        y_true = labels(y_true, one_hot)
+        y_pred = labels(y_pred, one_hot)
+        self.matrix += np.bincount(y_true * self.n_classes + y_pred,
+                                   minlength=self.n_classes ** 2).reshape(self.n_classes, self.n_classes)
+        return self
+
+    def merge( self, other ):
+        """adds the counts of other, e.g. of another fold or worker
+        :return: self
+        """
+        self.matrix += other.matrix
+        return self
+
+    def tp( self ):
+        return np.diag(self.matrix)
+
+    def fp( self ):
+        return self.matrix.sum(axis=0) - self.tp()
+
+    def fn( self ):
+        return self.matrix.sum(axis=1) - self.tp()
+
+    def tn( self ):
+        return self.matrix.sum() - self.tp() - self.fp() - self.fn()
+
+    def accuracy( self ):
+        return float(divide(self.tp().sum(), self.matrix.sum()))
+
+    def precision( self ):
+        return divide(self.tp(), self.tp() + self.fp())
+
+    def recall( self ):
+        return divide(self.tp(), self.tp() + self.fn())
+
+    def specificity( self ):
+        return divide(self.tn(), self.tn() + self.fp())
+
+    def fpr( self ):
+        return divide(self.fp(), self.fp() + self.tn())
+
+    def f1( self ):
+        return divide(2 * self.tp(), 2 * self.tp() + self.fp() + self.fn())
+
+    def present( self ):
+        """
+        :return: boolean mask of the classes in the true or in the predicted labels
+        """
+        return (self.matrix.sum(axis=0) + self.matrix.sum(axis=1)) > 0
+
+    def macro( self, metric, present_only=True ):
+        """
+        :param metric: name of a per class score, e.g. 'f1'
+        :param present_only: whether to average over the present classes only, like
+            np.mean(f1_score(y_true, y_pred, average=None)), or over all the n_classes
+        :return: unweighted mean of the score over the classes, 0 if there is none
+        """
+        scores = getattr(self, metric)()
+        if present_only:
+            scores = scores[ self.present() ]
+        return float(np.mean(scores)) if len(scores) > 0 else 0.
+
+    def aami( self, classes=None ):
+        """
+        :param classes: names of the classes, the indexes if None
+        :return: dict[class, dict] with the Se, +P and FPR of each class
+        """
+        classes = range(self.n_classes) if classes is None else classes
+        scores = zip(self.recall(), self.precision(), self.fpr())
+        return {name: {'Se': se, '+P': p, 'FPR': fpr} for name, (se, p, fpr) in zip(classes, scores)}
+
+
+def divide( numerator, denominator ):
+    """
+    :return: numerator / denominator, 0 where the denominator is 0
+    """
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+
+
+def macro_f1( y_true, y_pred ):
+    """
+    :return: mean of the per class f1 scores over the classes in y_true or y_pred, like
+        np.mean(f1_score(y_true, y_pred, average=None))
+    """
+    present, y = np.unique(np.concatenate((labels(y_true, False), labels(y_pred, False))), return_inverse=True)
+    return ConfusionMatrix(len(present)).update(y[ :len(y_true) ], y[ len(y_true): ]).macro('f1')
@@ -0,0 +1,84 @@
+import numpy as np
+from keras.utils import Sequence
+from beatclassification.Preprocessing import Preprocessing
+from beatclassification.Resampling import Resampling
+
+prep = Preprocessing()
+rs = Resampling()
+
+
+class BatchGenerator(Sequence):
+    """
+    Streams mini-batches of beats to Keras without materializing augmented or windowed copies of the dataset.
+    Over and undersampling are applied to an index array of the beats that is redrawn at every epoch, and the
+    timesteps windows are gathered from the beats array when a batch is requested.
+    """
+
+    def __init__( self, X, Y, batch_size=32, timesteps=None, classes=None, augment=None, reduce=None, shuffle=True,
+                  seed=42, lengths=None ):
+        """
+        :param X: numpy array of beats, one row per beat, in record order
+        :param Y: numpy array of labels, one hot or integer, aligned with X
+        :param timesteps: number of consecutive beats in each sample. The label of a sample is the one of its last beat
+        :param classes: list of class names, needed to interpret augment and reduce
+        :param augment: dict[class, factor]. Beats of the class are drawn factor times per epoch
+        :param reduce: dict[class, factor]. Only 1/factor of the beats of the class are drawn per epoch
+        :param shuffle: whether to shuffle the samples at every epoch. If False the samples are in record order
+        :param seed: seed of the random generator, the sampling of epoch i uses seed + i
+        :param lengths: number of beats of each record in X. If given, windows never span two records
+        """
+        self.X = X
+        self.Y = Y
+        self.batch_size = batch_size
+        self.timesteps = timesteps
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        if classes is None:
+            classes = [ 'N', 'S', 'V', 'F' ]
+        if Y.ndim > 1 and Y.shape[ 1 ] > 1:
+            labels = np.argmax(Y, axis=1)
+        else:
+            labels = Y.reshape(len(Y)).astype(np.int64)
+        # a sample is identified by the position of its last beat
+        if timesteps is None:
+            self.positions = np.arange(len(X))
+        elif lengths is None:
+            self.positions = np.arange(timesteps - 1, len(X))
+        else:
+            self.positions = prep.window_starts(lengths, timesteps) + timesteps - 1
+        self.labels = labels[ self.positions ]
+        self.factors = np.ones(max(len(classes), int(self.labels.max()) + 1))
+        if augment is not None:
+            for label in augment:
+                self.factors[ classes.index(label) ] *= augment[ label ]
+        if reduce is not None:
+            for label in reduce:
+                self.factors[ classes.index(label) ] /= reduce[ label ]
+        self.indices = self.sample_indices()
+
+    def sample_indices( self ):
+        if not self.shuffle:
+            return self.positions
+        indices = rs.indices(self.labels, self.factors, seed=self.seed + self.epoch, shuffle=True, one_hot=False)
+        return self.positions[ indices ]
+
+    def __len__( self ):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+
+    def __getitem__( self, index ):
+        batch = self.indices[ index * self.batch_size:(index + 1) * self.batch_size ]
+        if self.timesteps is None:
+            return self.X[ batch ], self.Y[ batch ]
+        window = np.arange(1 - self.timesteps, 1)
+        return self.X[ batch[ :, np.newaxis ] + window ], self.Y[ batch ]
+
+    def on_epoch_end( self ):
+        self.epoch += 1
+        self.indices = self.sample_indices()
+
+    def targets( self ):
+        """
+        :return: labels of the samples of the current epoch, in the order in which they are generated
+        """
+        return self.Y[ self.indices ]
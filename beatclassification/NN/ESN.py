@@ -1,11 +1,11 @@
 from beatclassification.NN.Preprocessing import Preprocessing
-from sklearn.linear_model import LogisticRegression
+from beatclassification.NN.Reservoir import Reservoir
+from beatclassification.NN.OnlineLearning import OnlineLearning
 prep = Preprocessing()
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
+res = Reservoir()
 from collections import defaultdict
-import scikitplot as splt
-import matplotlib.pyplot as plt
+from beatclassification.Metrics import ConfusionMatrix
+from rpeakdetection.Report import report
 import numpy as np
 import math
 import pickle
@@ -25,19 +25,24 @@ def generate_ranmask(M,N):
     return np.vectorize(lambda x: -1 if x < 0.5 else 1)(rand)
 
 
-def reservoir(dataset, dataset_name, write=True):
+def reservoir(dataset, dataset_name, write=True, mask=None):
+    """scalar reference of Reservoir.states, one beat and one node at a time
+    :param mask: input mask of shape (170, 25) shared by all the beats. If None, a random one is generated
+    """
     if not write:
         return np.load(dataset_name + '.npy')
     N = 25
     M = 170
     #tau = 5
-    prev = 0
-    #state_vec = np.zeros(tau, dtype='float64')
-    state_vec = defaultdict(int)
+    if mask is None:
+        mask = generate_ranmask(M, N)
     D = list()
     for i, beat in enumerate(dataset):
         print(i)
-        mask = generate_ranmask(M, N)
+        # every beat starts from an empty reservoir, so that beats are independent of each other
+        prev = 0
+        #state_vec = np.zeros(tau, dtype='float64')
+        state_vec = defaultdict(int)
         S = list()
         for j, sample in enumerate(beat):
             input = sample * mask[j]
@@ -81,20 +86,29 @@ def mackeyglass_rk4(input, state_vec, prev, node):
     return x_t + k1/6 + k2/3 + k3/3 + k4/6
 
 
+def compute_states(dataset, dataset_name, write=True):
+    """reservoir states of the dataset, stored in dataset_name.npy
+    :param write: whether to compute the states. An interrupted computation is resumed from its last finished chunk,
+        a finished one is only reopened
+    :return: read only memmap of shape (n_beats, 170, 25)
+    """
+    if write:
+        res.transform(dataset, dataset_name + '.npy', resume=True)
+    return np.load(dataset_name + '.npy', mmap_mode='r')
+
+
 X_train, Y_train, X_test, Y_test = prep.preprocess(one_hot=False)
 assert X_train.shape[0] == Y_train.shape[0]
-X_train = reservoir(X_train, 'train', write=False)
-shape = X_train.shape
-X_train = X_train.reshape(shape[0], shape[1]*shape[2])
-X_test = reservoir(X_test, 'test', write=False)
-shape = X_test.shape
-X_test = X_test.reshape((shape[0], shape[1]*shape[2]))
-lr = LogisticRegression(penalty='l1', verbose=1, solver='saga', n_jobs=8, max_iter=100000, tol=0.000001)
+# the states stay on disk, the classifier reads them one batch at a time
+X_train = compute_states(X_train, 'train')
+X_test = compute_states(X_test, 'test')
+lr = OnlineLearning(penalty='l1')
 lr.fit(X_train, Y_train)
 pred = lr.predict(X_test)
-splt.metrics.plot_confusion_matrix(Y_test, pred)
+cm = ConfusionMatrix(4).update(Y_test, pred)
+report.confusion(cm.matrix, ['N', 'S', 'V', 'F'], 'ESN')
 with open('logistic_regression.pkl', 'wb') as fid:
     pickle.dump(lr, fid)
-print(precision_score(Y_test, pred, average=None))
-print(recall_score(Y_test, pred,average=None))
-plt.show()
+print(cm.precision())
+print(cm.recall())
+report.render('esn')
@@ -0,0 +1,150 @@
+import os
+import time
+import numpy as np
+
+
+class Export:
+    """
+    Converts the Keras models saved by NN (e.g. best.h5) in TensorFlow Lite flatbuffers, which can be run on CPU with
+    the standalone tflite_runtime interpreter instead of a full Keras session.
+    """
+
+    def to_tflite( self, model_path, out_path=None, quantize=False, representative_data=None, n_calibration=500,
+                   batch_size=32 ):
+        """
+        :param model_path: path of a Keras .h5 model
+        :param out_path: path of the .tflite file. Defaults to model_path with the .tflite extension
+        :param quantize: whether to apply post training quantization. With representative_data the weights and the
+            activations are quantized to int8, otherwise, and always for LSTM models, only the weights are
+        :param representative_data: numpy array of model inputs, e.g. training beats, used to calibrate activations
+        :param n_calibration: number of samples of representative_data used for calibration
+        :param batch_size: batch size of the exported model. TFLite can only lower the LSTM layers to builtin ops with
+            a static batch dimension, TFLiteModel pads the last batch of each prediction
+        :return: path of the .tflite file
+        """
+        import tensorflow as tf
+        if out_path is None:
+            out_path = os.path.splitext(model_path)[ 0 ] + '.tflite'
+        model = tf.keras.models.load_model(model_path, compile=False)
+        input_spec = tf.TensorSpec([ batch_size ] + model.inputs[ 0 ].shape.as_list()[ 1: ], model.inputs[ 0 ].dtype)
+        concrete_function = tf.function(lambda x: model(x)).get_concrete_function(input_spec)
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([ concrete_function ], model)
+        if quantize:
+            converter.optimizations = [ tf.lite.Optimize.DEFAULT ]
+            recurrent = any(isinstance(layer, tf.keras.layers.RNN) for layer in model.layers)
+            if recurrent and representative_data is not None:
+                # the calibration of the fused LSTM ops crashes the converter, the LSTM models keep float activations
+                print('recurrent model: only the weights are quantized')
+            elif representative_data is not None:
+                n_samples = min(n_calibration, len(representative_data))
+                if n_samples == 0:
+                    raise ValueError('no calibration samples in representative_data')
+
+                def representative_dataset():
+                    for start in range(0, n_samples, batch_size):
+                        # the last batch, or a single one smaller than batch_size, is completed with the first
+                        # samples, so that the calibration never gets an empty or a zero padded batch
+                        rows = np.arange(start, start + batch_size) % n_samples
+                        yield [ np.asarray(representative_data[ rows ], dtype=np.float32) ]
+                converter.representative_dataset = representative_dataset
+        out_dir = os.path.dirname(out_path)
+        if out_dir != '':
+            os.makedirs(out_dir, exist_ok=True)
+        with open(out_path, 'wb') as f:
+            f.write(converter.convert())
+        print('model exported in ' + out_path)
+        return out_path
+
+    def benchmark( self, keras_model, tflite_models, X, repeats=20 ):
+        """compares latency and throughput of the Keras model and of its TensorFlow Lite exports
+        :param keras_model: loaded Keras model
+        :param tflite_models: dict[batch_size, TFLiteModel exported with that batch size], so that no batch is
+            padded to the batch size of the export, e.g. the one of export_batch_sizes
+        :param X: numpy array of model inputs
+        :return: dict[batch_size, dict] with the median latency per batch(ms), the throughput(beats/s) of both models
+            and the largest absolute difference between their probabilities
+        """
+        results = dict()
+        for batch_size, tflite_model in sorted(tflite_models.items()):
+            if tflite_model.batch_size != batch_size:
+                raise ValueError('the model of batch size {:d} is exported with batch size {:d}'.format(
+                    batch_size, tflite_model.batch_size))
+            batch = np.asarray(X[ :batch_size ], dtype=np.float32)
+            keras_times = self.time_calls(lambda: keras_model.predict(batch, batch_size=batch_size), repeats)
+            tflite_times = self.time_calls(lambda: tflite_model.predict(batch, batch_size=batch_size), repeats)
+            difference = np.max(np.abs(keras_model.predict(batch, batch_size=batch_size) -
+                                       tflite_model.predict(batch, batch_size=batch_size)))
+            results[ batch_size ] = {
+                'keras_latency_ms': 1000 * np.median(keras_times),
+                'tflite_latency_ms': 1000 * np.median(tflite_times),
+                'keras_throughput': len(batch) / np.median(keras_times),
+                'tflite_throughput': len(batch) / np.median(tflite_times),
+                'max_abs_difference': float(difference)
+            }
+            print(batch_size, results[ batch_size ])
+        return results
+
+    def export_batch_sizes( self, model_path, batch_sizes=(1, 32, 256), **kwargs ):
+        """exports the model once per batch size, for benchmark
+        :param kwargs: arguments of to_tflite, e.g. quantize and representative_data
+        :return: dict[batch_size, TFLiteModel]
+        """
+        base = os.path.splitext(model_path)[ 0 ]
+        return {batch_size: TFLiteModel(self.to_tflite(model_path, out_path=base + '_b{:d}.tflite'.format(batch_size),
+                                                       batch_size=batch_size, **kwargs))
+                for batch_size in batch_sizes}
+
+    def time_calls( self, function, repeats ):
+        # the first call includes allocations and graph tracing, it is not measured
+        function()
+        times = list()
+        for i in range(repeats):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return times
+
+
+class TFLiteModel:
+    """
+    CPU runtime for the exported models. Takes a batch of beats(or of timesteps windows) and returns the class
+    probabilities, quantizing the input and dequantizing the output when the model is fully int8.
+    """
+
+    def __init__( self, model_path, num_threads=None ):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[ 0 ]
+        self.output_detail = self.interpreter.get_output_details()[ 0 ]
+        # the batch size is fixed at export time
+        self.batch_size = self.input_detail[ 'shape' ][ 0 ]
+
+    def predict( self, X, batch_size=None ):
+        """
+        :param X: numpy array of model inputs
+        :param batch_size: unused, the batch size of the exported model is used. Kept for compatibility with Keras
+        :return: numpy array of class probabilities
+        """
+        predictions = list()
+        for start in range(0, len(X), self.batch_size):
+            batch = np.asarray(X[ start:start + self.batch_size ], dtype=np.float32)
+            n_samples = len(batch)
+            if n_samples < self.batch_size:
+                padding = np.zeros((self.batch_size - n_samples,) + batch.shape[ 1: ], dtype=np.float32)
+                batch = np.concatenate((batch, padding))
+            scale, zero_point = self.input_detail[ 'quantization' ]
+            if self.input_detail[ 'dtype' ] != np.float32:
+                batch = np.round(batch / scale + zero_point).astype(self.input_detail[ 'dtype' ])
+            self.interpreter.set_tensor(self.input_detail[ 'index' ], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_detail[ 'index' ])[ :n_samples ]
+            scale, zero_point = self.output_detail[ 'quantization' ]
+            if self.output_detail[ 'dtype' ] != np.float32:
+                output = (output.astype(np.float32) - zero_point) * scale
+            predictions.append(output)
+        return np.concatenate(predictions)
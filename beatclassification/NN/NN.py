@@ -1,34 +1,34 @@
-from keras.optimizers import Adam, SGD
-from keras.layers import LSTM, Dense, BatchNormalization, Dropout, Conv2D, Flatten, Embedding
-from keras.models import Sequential
-from keras import backend as K
-import numpy as np
-import tensorflow as tf
 from sklearn.utils import shuffle
-import matplotlib.pyplot as plt
-import wfdb
-import scikitplot as splt
 from time import time
 from beatclassification.data_visualization import data_visualization
-from tensorflow.python.tools import freeze_graph, optimize_for_inference_lib
-from keras.callbacks import Callback, EarlyStopping, TensorBoard
-from sklearn.metrics import f1_score, precision_score, recall_score
 from beatclassification.Preprocessing import Preprocessing
 from beatclassification.Evaluation import Evaluation
-from keras.models import load_model
+from beatclassification.Metrics import ConfusionMatrix
+from beatclassification.NN.Export import Export
+import os
+from rpeakdetection.Profiler import profile, profiler
+from rpeakdetection.Report import report
 
 
 dv = data_visualization()
 prep = Preprocessing()
 eval = Evaluation()
+ex = Export()
 
 
 # noinspection PyTypeChecker
 class NN:
+    """
+    Keras models of the beats. Keras, and TensorFlow with it, is imported by the methods that build or train a model,
+    so importing this module is cheap
+    """
 
     def create_LSTM_model( self, X_train, X_val, Y_train, Y_val, aami_classes, callbacks, n_LSTM_layers, n_dense_layers,
                            batch_size,
-                           activation, timesteps, n_neurons, optimizer, batch_normalization, epochs, dropout ):
+                           activation, timesteps, n_neurons, optimizer, batch_normalization, epochs, dropout,
+                           train_generator=None, val_generator=None, workers=1 ):
+        from keras.models import Sequential
+        from keras.layers import LSTM, Dense, BatchNormalization, Dropout
         model = Sequential()
         input_shape = (timesteps, X_train.shape[ 2 ])
         if len(aami_classes) == 2:
@@ -68,12 +68,16 @@ class NN:
         optimizer = optimizer
         model.compile(loss=loss,
                       optimizer=optimizer)
-        model.fit(X_train, Y_train, epochs=epochs, batch_size=batch_size, validation_data=(X_val, Y_val),
-                  callbacks=callbacks, sample_weight=None)
+        self.fit(model, X_train, X_val, Y_train, Y_val, callbacks, batch_size, epochs, train_generator=train_generator,
+                 val_generator=val_generator, workers=workers)
         return model
 
     def create_CNN_model( self, X_train, X_val, Y_train, Y_val, aami_classes, callbacks, n_dense_layers, batch_size,
-                          activation, width, n_neurons, optimizer, batch_normalization, epochs ):
+                          activation, width, n_neurons, optimizer, batch_normalization, epochs,
+                          train_generator=None, val_generator=None, workers=1 ):
+        from keras.models import Sequential
+        from keras.layers import Dense, BatchNormalization, Conv2D, Flatten
+        from keras.callbacks import TensorBoard
         input_shape = (2, 170, 1)
         model = Sequential()
         model.add(Conv2D(n_neurons, (2, width), input_shape=input_shape, activation=activation))
@@ -87,52 +91,100 @@ class NN:
                     model.add(BatchNormalization())
         model.add(Dense(len(aami_classes), activation='softmax'))
         optimizer = optimizer
+        # histograms need validation data in memory
         tensorboard = TensorBoard(log_dir="beatclassification/NN/logs/{}".format(time()), write_grads=True,
-                                  histogram_freq=1)
+                                  histogram_freq=1 if train_generator is None else 0)
         callbacks.append(tensorboard)
         model.compile(loss='categorical_crossentropy',
                       optimizer=optimizer)
-        model.fit(X_train, Y_train, epochs=epochs, batch_size=batch_size, validation_data=(X_val, Y_val),
-                  callbacks=callbacks)
+        self.fit(model, X_train, X_val, Y_train, Y_val, callbacks, batch_size, epochs, train_generator=train_generator,
+                 val_generator=val_generator, workers=workers)
         return model
 
+    @profile('train')
+    def fit( self, model, X_train, X_val, Y_train, Y_val, callbacks, batch_size, epochs, train_generator=None,
+             val_generator=None, workers=1 ):
+        if train_generator is None:
+            model.fit(X_train, Y_train, epochs=epochs, batch_size=batch_size, validation_data=(X_val, Y_val),
+                      callbacks=callbacks)
+        else:
+            # batches are prepared by worker threads while the model trains on the previous ones
+            model.fit_generator(train_generator, epochs=epochs, validation_data=val_generator, callbacks=callbacks,
+                                workers=workers, use_multiprocessing=False, max_queue_size=2 * workers)
+
     def beat_classification( self, classes=None, aami=True, augment=None, reduce=None, train_size=0.5, channels=None,
                              n_dense_layers=1, batch_size=32, standardize=True, multiclass=True, activation='relu',
                              timesteps=5, n_neurons=128, filtered=False, model=None, model_name='LSTM', epochs=100, train_db='mitdb',
                              dropout=0.5, vertical=True, n_LSTM_layers=1, window=None, left_window=70, right_window= 100,
-                             callbacks=None, optimizer=None, batch_normalization=True, width=2, patience=10, validation=False):
+                             callbacks=None, optimizer=None, batch_normalization=True, width=2, patience=10, validation=False,
+                             n_jobs=None, generator=False, workers=4, export=False, quantize=False, dataset=None):
+        """
+        :param generator: whether to train with a BatchGenerator. Augmentation, reduction and timesteps windows are
+            then computed batch by batch instead of being materialized, so memory does not grow with the factors
+        :param workers: number of threads preparing the batches when generator=True
+        :param export: whether to export the trained model for inference(see export_model)
+        :param quantize: whether to quantize the exported model to int8
+        :param dataset: X_train, Y_train, X_val, Y_val, X_test, Y_test and lengths as returned by the splits of
+            Preprocessing with timesteps=None and return_lengths=True, e.g. cached by Tuning. If given the split is skipped
+        """
+        from keras.callbacks import EarlyStopping, TensorBoard
+        from keras.optimizers import Adam
         if classes is None:
             classes = ['N', 'S', 'V', 'F']
         if callbacks is None:
             callbacks = [ EarlyStopping(patience=patience, restore_best_weights=True),
                           TensorBoard(log_dir="beatclassification/NN/logs/{}".format(time()),
-                                  histogram_freq=1)]
+                                  histogram_freq=0 if generator else 1)]
+        # with a generator the windows are built on the fly from the beats
+        split_timesteps = None if generator else timesteps
         if optimizer is None:
             optimizer = Adam()
         if channels is None:
             channels = [0]
-        if vertical:
-            X_train, Y_train, X_val, Y_val, X_test, Y_test = prep.vertical_split(classes=classes,
-                                                                                   timesteps=timesteps,
-                                                                                   channels=channels,
-                                                                                   standardize=standardize, aami=aami,
-                                                                                   model=model_name, train_size=train_size,
-                                                                                   multiclass=multiclass,
-                                                                                   window=window,
-                                                                                   left_window=left_window,
-                                                                                   right_window=right_window)
+        if dataset is not None:
+            X_train, Y_train, X_val, Y_val, X_test, Y_test, lengths = dataset
+            if split_timesteps is not None:
+                X_train, Y_train = prep.compute_timesteps(X_train, Y_train, split_timesteps, lengths=lengths[ 0 ])
+                X_val, Y_val = prep.compute_timesteps(X_val, Y_val, split_timesteps, lengths=lengths[ 1 ])
+                X_test, Y_test = prep.compute_timesteps(X_test, Y_test, split_timesteps, lengths=lengths[ 2 ])
+            split = X_train, Y_train, X_val, Y_val, X_test, Y_test, lengths
+            if not generator:
+                split = split[ :-1 ]
+        elif vertical:
+            split = prep.vertical_split(classes=classes,
+                                        timesteps=split_timesteps,
+                                        channels=channels,
+                                        standardize=standardize, aami=aami,
+                                        model=model_name, train_size=train_size,
+                                        multiclass=multiclass,
+                                        window=window,
+                                        left_window=left_window,
+                                        right_window=right_window,
+                                        n_jobs=n_jobs,
+                                        return_lengths=generator)
         # De Chazal horizontal split
         else:
-            X_train, Y_train, X_val, Y_val, X_test, Y_test = prep.horizontal_split(classes=classes,
-                                                                                   timesteps=timesteps,
-                                                                                   channels=channels,
-                                                                                   standardize=standardize, aami=aami,
-                                                                                   model=model_name, train_db=train_db,
-                                                                                   multiclass=multiclass,
-                                                                                   window=window,
-                                                                                   left_window=left_window,
-                                                                                   right_window=right_window)
+            split = prep.horizontal_split(classes=classes,
+                                          timesteps=split_timesteps,
+                                          channels=channels,
+                                          standardize=standardize, aami=aami,
+                                          model=model_name, train_db=train_db,
+                                          multiclass=multiclass,
+                                          window=window,
+                                          left_window=left_window,
+                                          right_window=right_window,
+                                          n_jobs=n_jobs,
+                                          return_lengths=generator)
+        if generator:
+            X_train, Y_train, X_val, Y_val, X_test, Y_test, lengths = split
+        else:
+            X_train, Y_train, X_val, Y_val, X_test, Y_test = split
         dv.distribution(Y_train, classes=classes, multiclass=multiclass)
+        if generator:
+            return self.generator_classification(X_train, Y_train, X_val, Y_val, X_test, Y_test, lengths, classes,
+                                                 augment, reduce, timesteps, batch_size, model, model_name, callbacks,
+                                                 n_LSTM_layers, n_dense_layers, activation, n_neurons, optimizer,
+                                                 batch_normalization, epochs, dropout, width, validation, workers)
         if reduce is not None:
             for label in reduce:
                 reduction_factor = reduce[ label ]
@@ -168,58 +220,99 @@ class NN:
                                               optimizer=optimizer,
                                               epochs=epochs)
         if validation:
-            predictions = model.predict(X_val, batch_size=32)
+            with profiler.span('predict', 'NN.beat_classification'):
+                predictions = model.predict(X_val, batch_size=32)
             return eval.evaluate(predictions, Y_val, plot=False), model
         else:
-            predictions = model.predict(X_test, batch_size=32)
+            with profiler.span('predict', 'NN.beat_classification'):
+                predictions = model.predict(X_test, batch_size=32)
             eval.evaluate(predictions, Y_test, classes=classes,  plot=True, title='Confusion Matrix for LSTM network')
-        #self.export_model(tf.train.Saver(), [ model_name.lower() + '_1_input' ], 'dense_2/Softmax', model_name)
-
-    def export_model( self, saver, input_node_names, output_node_name, model_name ):
-        tf.train.write_graph(K.get_session().graph_def, 'out', model_name + '_graph.pbtxt')
-        saver.save(K.get_session(), 'out/' + model_name + '.chkp')
-        freeze_graph.freeze_graph('out/' + model_name + '_graph.pbtxt', None,
-                                  False, 'out/' + model_name + '.chkp', output_node_name,
-                                  'save/restore_all', 'save/Const:0',
-                                  'out/frozen_' + model_name + '.pb', True, '')
-        input_graph_def = tf.GraphDef()
-        with tf.gfile.Open('out/frozen_' + model_name + '.pb', 'rb') as f:
-            input_graph_def.ParseFromString(f.read())
-        output_graph_def = optimize_for_inference_lib.optimize_for_inference(input_graph_def, input_node_names,
-                                                                             [ output_node_name ],
-                                                                             tf.float32.as_datatype_enum)
-        with tf.gfile.FastGFile('out/opt_' + model_name + '.pb', 'wb') as f:
-            f.write(output_graph_def.SerializeToString())
-        print('graph saved!')
+            if export:
+                self.export_model(model, model_name, quantize=quantize, representative_data=X_train,
+                                  X_benchmark=X_test)
 
+    def generator_classification( self, X_train, Y_train, X_val, Y_val, X_test, Y_test, lengths, classes, augment, reduce,
+                                  timesteps, batch_size, model, model_name, callbacks, n_LSTM_layers, n_dense_layers,
+                                  activation, n_neurons, optimizer, batch_normalization, epochs, dropout, width,
+                                  validation, workers ):
+        from beatclassification.NN.BatchGenerator import BatchGenerator
+        if model_name != 'LSTM':
+            timesteps = None
+        train_generator = BatchGenerator(X_train, Y_train, batch_size=batch_size, timesteps=timesteps, classes=classes,
+                                         augment=augment, reduce=reduce, lengths=lengths[ 0 ])
+        val_generator = BatchGenerator(X_val, Y_val, batch_size=batch_size, timesteps=timesteps, shuffle=False,
+                                       lengths=lengths[ 1 ])
+        test_generator = BatchGenerator(X_test, Y_test, batch_size=batch_size, timesteps=timesteps, shuffle=False,
+                                        lengths=lengths[ 2 ])
+        print('train distribution')
+        print(dv.distribution(train_generator.targets(), classes))
+        if model is None:
+            # the first batch is only used to infer the input and output shapes
+            X_batch, Y_batch = train_generator[ 0 ]
+            if model_name == 'LSTM':
+                model = self.create_LSTM_model(X_batch, None, Y_batch, None, classes, callbacks, n_LSTM_layers,
+                                               n_dense_layers, batch_size, activation, timesteps, n_neurons, optimizer,
+                                               batch_normalization, epochs, dropout, train_generator=train_generator,
+                                               val_generator=val_generator, workers=workers)
+            else:
+                model = self.create_CNN_model(X_batch, None, Y_batch, None, aami_classes=classes,
+                                              n_dense_layers=n_dense_layers, batch_size=batch_size,
+                                              activation=activation, n_neurons=n_neurons,
+                                              batch_normalization=batch_normalization, callbacks=callbacks,
+                                              width=width, optimizer=optimizer, epochs=epochs,
+                                              train_generator=train_generator, val_generator=val_generator,
+                                              workers=workers)
+        if validation:
+            return eval.scores(self.stream_confusion(model, val_generator, classes), classes, plot=False), model
+        else:
+            eval.scores(self.stream_confusion(model, test_generator, classes), classes, plot=True,
+                        title='Confusion Matrix for LSTM network')
 
-if __name__ == '__main__':
-    lstm = NN()
-    augment = {'S':4, 'F':9}
-    best_score = 0
-    scores = list()
-    best_window = None
-    windows = [200, 300]
-    for window in windows:
-        score, model = lstm.beat_classification(window=window, augment=augment, validation=True, patience=10)
-        scores.append(score)
-        if score > best_score:
-            best_score = score
-            best_window = window
-            model.save('best.h5')
-        K.clear_session()
-    print('best')
-    print(best_window)
-    print(best_score)
-    model = load_model('best.h5')
-    lstm.beat_classification(window=best_window, augment=augment, model=model)
-    plt.close()
-    plt.plot(windows, scores)
-    plt.ylabel('F1 score')
-    plt.xlabel('window size(samples)')
-    plt.legend()
-    plt.show()
-
+    def stream_confusion( self, model, generator, classes ):
+        """
+        :return: ConfusionMatrix of the predictions of model, updated batch by batch so that neither the predictions
+            nor the targets of the whole set are materialized
+        """
+        cm = ConfusionMatrix(len(classes))
+        with profiler.span('predict', 'NN.stream_confusion'):
+            for index in range(len(generator)):
+                X_batch, Y_batch = generator[ index ]
+                cm.update(Y_batch, model.predict_on_batch(X_batch), one_hot=True)
+        return cm
 
+    def export_model( self, model, model_name, quantize=False, representative_data=None, X_benchmark=None ):
+        """saves the model and converts it in a TensorFlow Lite model in out/
+        :param X_benchmark: if given, inputs used to compare latency and throughput of the Keras and exported models
+        :return: path of the .tflite file
+        """
+        model_path = 'out/' + model_name.lower() + '.h5'
+        if not os.path.isdir('out'):
+            os.makedirs('out')
+        model.save(model_path)
+        tflite_path = ex.to_tflite(model_path, quantize=quantize, representative_data=representative_data)
+        if X_benchmark is not None:
+            tflite_models = ex.export_batch_sizes(model_path, quantize=quantize, representative_data=representative_data)
+            ex.benchmark(model, tflite_models, X_benchmark)
+        return tflite_path
 
 
+if __name__ == '__main__':
+    from beatclassification.NN.Tuning import Tuning, load_dataset
+    lstm = NN()
+    tuning = Tuning(workers=2)
+    space = {'window': [ 200, 300 ], 'timesteps': [ 3, 5 ], 'n_neurons': [ 64, 128 ], 'n_LSTM_layers': [ 1, 2 ],
+             'dropout': [ 0.2, 0.5 ], 'augment': [ {'S': 4, 'F': 9}, {'S': 2, 'F': 4} ]}
+    best = tuning.search(space, n_trials=16, patience=10)
+    if best is None:
+        # every trial was pruned or failed
+        print('no trial completed, see ' + tuning.log_path + ' for their states')
+    else:
+        print('best')
+        print(best[ 'params' ])
+        print(best[ 'score' ])
+        # the best checkpoint is evaluated on the test set, without training it again
+        model = tuning.best_model(best)
+        lstm.beat_classification(model=model, export=True, dataset=load_dataset(tuning.dataset(best[ 'params' ])),
+                                 **best[ 'params' ])
+    profiler.export('nn')
+    report.render('nn')
@@ -0,0 +1,184 @@
+import json
+import h5py
+import numpy as np
+
+
+def hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0, 1)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+activations = {'linear': lambda x: x, 'relu': lambda x: np.maximum(x, 0), 'tanh': np.tanh, 'sigmoid': sigmoid,
+               'hard_sigmoid': hard_sigmoid, 'softmax': softmax}
+
+
+class NumpyModel:
+    """
+    Inference of the networks built by NN.create_LSTM_model and NN.create_CNN_model with NumPy only.
+    The weights are read from the Keras .h5 file with h5py, so TensorFlow is never imported. Dropout layers are
+    dropped and BatchNormalization layers are folded into the adjacent Dense layer, so the forward pass is a short
+    list of batched matmuls.
+    Supported layers: LSTM, Dense, BatchNormalization, Dropout, Conv2D, Flatten, Activation.
+    """
+
+    def __init__( self, model_path, dtype=np.float32 ):
+        self.dtype = dtype
+        self.layers = self.fold_batch_normalization(self.read_layers(model_path))
+
+    def read_layers( self, model_path ):
+        layers = list()
+        with h5py.File(model_path, 'r') as f:
+            config = f.attrs[ 'model_config' ]
+            if isinstance(config, bytes):
+                config = config.decode('utf-8')
+            config = json.loads(config)[ 'config' ]
+            # old Keras versions store the list of layers directly
+            layers_config = config[ 'layers' ] if isinstance(config, dict) else config
+            weights_group = f[ 'model_weights' ] if 'model_weights' in f else f
+            for layer in layers_config:
+                kind = layer[ 'class_name' ]
+                config = layer[ 'config' ]
+                weights = self.read_weights(weights_group, config[ 'name' ])
+                if kind in ('InputLayer', 'Dropout'):
+                    continue
+                elif kind == 'Dense':
+                    layers.append({'kind': 'dense', 'kernel': weights[ 'kernel' ],
+                                   'bias': weights.get('bias', np.zeros(weights[ 'kernel' ].shape[ 1 ], self.dtype)),
+                                   'activation': config[ 'activation' ]})
+                elif kind == 'LSTM':
+                    units = config[ 'units' ]
+                    layers.append({'kind': 'lstm', 'kernel': weights[ 'kernel' ],
+                                   'recurrent_kernel': weights[ 'recurrent_kernel' ],
+                                   'bias': weights.get('bias', np.zeros(4 * units, self.dtype)), 'units': units,
+                                   'activation': config[ 'activation' ],
+                                   'recurrent_activation': config[ 'recurrent_activation' ],
+                                   'return_sequences': config[ 'return_sequences' ]})
+                elif kind == 'BatchNormalization':
+                    variance = weights[ 'moving_variance' ]
+                    scale = weights.get('gamma', np.ones_like(variance)) / np.sqrt(variance + config[ 'epsilon' ])
+                    shift = weights.get('beta', np.zeros_like(variance)) - weights[ 'moving_mean' ] * scale
+                    layers.append({'kind': 'affine', 'scale': scale.astype(self.dtype), 'shift': shift.astype(self.dtype)})
+                elif kind == 'Conv2D':
+                    if config.get('data_format', 'channels_last') != 'channels_last':
+                        raise ValueError('only channels_last Conv2D layers are supported')
+                    layers.append({'kind': 'conv2d', 'kernel': weights[ 'kernel' ],
+                                   'bias': weights.get('bias', np.zeros(weights[ 'kernel' ].shape[ -1 ], self.dtype)),
+                                   'strides': tuple(config[ 'strides' ]), 'padding': config[ 'padding' ],
+                                   'activation': config[ 'activation' ]})
+                elif kind == 'Flatten':
+                    layers.append({'kind': 'flatten'})
+                elif kind == 'Activation':
+                    layers.append({'kind': 'activation', 'activation': config[ 'activation' ]})
+                else:
+                    raise ValueError('unsupported layer ' + kind)
+        for layer in layers:
+            if 'activation' in layer and layer[ 'activation' ] not in activations:
+                raise ValueError('unsupported activation ' + layer[ 'activation' ])
+            if layer.get('recurrent_activation', 'sigmoid') not in activations:
+                raise ValueError('unsupported activation ' + layer[ 'recurrent_activation' ])
+        return layers
+
+    def read_weights( self, weights_group, layer_name ):
+        """
+        :return: dict[weight name, numpy array], e.g. 'kernel', 'bias', 'moving_mean'
+        """
+        weights = dict()
+        if layer_name not in weights_group:
+            return weights
+        group = weights_group[ layer_name ]
+        for weight_name in group.attrs.get('weight_names', [ ]):
+            if isinstance(weight_name, bytes):
+                weight_name = weight_name.decode('utf-8')
+            # e.g. lstm_1/kernel:0 -> kernel
+            short_name = weight_name.split('/')[ -1 ].split(':')[ 0 ]
+            weights[ short_name ] = np.asarray(group[ weight_name ], dtype=self.dtype)
+        return weights
+
+    def fold_batch_normalization( self, layers ):
+        folded = list()
+        for layer in layers:
+            previous = folded[ -1 ] if len(folded) > 0 else None
+            if previous is not None and previous[ 'kind' ] == 'affine' and layer[ 'kind' ] == 'dense':
+                # dense(scale * x + shift) = x (scale * W) + (shift W + b)
+                folded.pop()
+                layer = dict(layer, kernel=previous[ 'scale' ][ :, np.newaxis ] * layer[ 'kernel' ],
+                             bias=previous[ 'shift' ] @ layer[ 'kernel' ] + layer[ 'bias' ])
+            elif previous is not None and layer[ 'kind' ] == 'affine' and previous[ 'kind' ] == 'dense' and \
+                    previous[ 'activation' ] == 'linear':
+                # scale * (x W + b) + shift = x (W * scale) + (b * scale + shift)
+                folded.pop()
+                layer = dict(previous, kernel=previous[ 'kernel' ] * layer[ 'scale' ],
+                             bias=previous[ 'bias' ] * layer[ 'scale' ] + layer[ 'shift' ])
+            folded.append(layer)
+        return folded
+
+    def predict( self, X, batch_size=None ):
+        """
+        :param X: numpy array of beats, timesteps windows or images, as given to the Keras model
+        :param batch_size: number of samples per forward pass. If None, a single pass on the whole X
+        :return: numpy array of class probabilities
+        """
+        X = np.asarray(X, dtype=self.dtype)
+        if batch_size is None:
+            return self.forward(X)
+        return np.concatenate([ self.forward(X[ start:start + batch_size ]) for start in range(0, len(X), batch_size) ])
+
+    def forward( self, x ):
+        for layer in self.layers:
+            kind = layer[ 'kind' ]
+            if kind == 'dense':
+                x = activations[ layer[ 'activation' ] ](x @ layer[ 'kernel' ] + layer[ 'bias' ])
+            elif kind == 'lstm':
+                x = self.lstm(x, layer)
+            elif kind == 'affine':
+                x = x * layer[ 'scale' ] + layer[ 'shift' ]
+            elif kind == 'conv2d':
+                x = activations[ layer[ 'activation' ] ](self.conv2d(x, layer))
+            elif kind == 'flatten':
+                x = x.reshape(len(x), -1)
+            elif kind == 'activation':
+                x = activations[ layer[ 'activation' ] ](x)
+        return x
+
+    def lstm( self, x, layer ):
+        units = layer[ 'units' ]
+        activation = activations[ layer[ 'activation' ] ]
+        recurrent_activation = activations[ layer[ 'recurrent_activation' ] ]
+        # input contribution of every timestep in a single matmul, gates ordered as i, f, c, o
+        inputs = x @ layer[ 'kernel' ] + layer[ 'bias' ]
+        h = np.zeros((len(x), units), dtype=self.dtype)
+        c = np.zeros((len(x), units), dtype=self.dtype)
+        outputs = list()
+        for t in range(x.shape[ 1 ]):
+            z = inputs[ :, t ] + h @ layer[ 'recurrent_kernel' ]
+            i = recurrent_activation(z[ :, :units ])
+            f = recurrent_activation(z[ :, units:2 * units ])
+            o = recurrent_activation(z[ :, 3 * units: ])
+            c = f * c + i * activation(z[ :, 2 * units:3 * units ])
+            h = o * activation(c)
+            outputs.append(h)
+        if layer[ 'return_sequences' ]:
+            return np.stack(outputs, axis=1)
+        return h
+
+    def conv2d( self, x, layer ):
+        kernel = layer[ 'kernel' ]
+        kernel_h, kernel_w = kernel.shape[ :2 ]
+        stride_h, stride_w = layer[ 'strides' ]
+        if layer[ 'padding' ] == 'same':
+            pads = list()
+            for size, k, s in [ (x.shape[ 1 ], kernel_h, stride_h), (x.shape[ 2 ], kernel_w, stride_w) ]:
+                total = max((int(np.ceil(size / s)) - 1) * s + k - size, 0)
+                pads.append((total // 2, total - total // 2))
+            x = np.pad(x, [ (0, 0) ] + pads + [ (0, 0) ])
+        windows = np.lib.stride_tricks.sliding_window_view(x, (kernel_h, kernel_w), axis=(1, 2))
+        windows = windows[ :, ::stride_h, ::stride_w ]
+        return np.einsum('bhwcij,ijco->bhwo', windows, kernel, optimize=True) + layer[ 'bias' ]
@@ -0,0 +1,97 @@
+import copy
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+from beatclassification.Metrics import macro_f1
+
+
+class OnlineLearning:
+    """
+    Out of core training of a linear classifier on features that do not fit in memory, e.g. the memmapped reservoir
+    states. The features are read batch_size rows at a time and fed to SGDClassifier.partial_fit with a logistic
+    loss, so memory is bounded by the batch size and every epoch is a single sequential pass over the data.
+    One batch every int(1 / holdout) is held out and used for early stopping.
+    """
+
+    def __init__( self, batch_size=4096, epochs=50, patience=3, holdout=0.1, penalty='l1', alpha=1e-5, scale=True,
+                  seed=42 ):
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.patience = patience
+        self.holdout = holdout
+        self.penalty = penalty
+        self.alpha = alpha
+        self.scale = scale
+        self.seed = seed
+        self.scaler = None
+        self.model = None
+        self.best_score = None
+
+    def batch( self, X, start ):
+        # flattens the states of each beat, only the rows of the batch are loaded in memory
+        X_batch = np.asarray(X[ start:start + self.batch_size ], dtype=np.float64)
+        X_batch = X_batch.reshape(len(X_batch), -1)
+        if self.scaler is not None:
+            X_batch = self.scaler.transform(X_batch)
+        return X_batch
+
+    def fit( self, X, Y ):
+        """
+        :param X: array like of shape (n_beats, ...), typically a np.memmap
+        :param Y: integer labels of shape (n_beats,)
+        :raise ValueError: if X is not longer than a batch, since a batch is held out
+        :return: self, with the coefficients of the epoch that scored best on the held out batches
+        """
+        Y = np.asarray(Y).reshape(len(Y))
+        starts = np.arange(0, len(X), self.batch_size)
+        if len(starts) < 2:
+            # the held out batch would be the training one: no row to train on, early stopping on the training rows
+            raise ValueError('{:d} beats fit in a single batch of {:d}, use a batch_size smaller than half of the '
+                             'beats'.format(len(X), self.batch_size))
+        step = max(int(round(1 / self.holdout)), 2)
+        held_out = starts[ step - 1::step ] if len(starts) >= step else starts[ -1: ]
+        train = np.setdiff1d(starts, held_out)
+        train_mask = np.ones(len(Y), dtype=bool)
+        for start in held_out:
+            train_mask[ start:start + self.batch_size ] = False
+        classes = np.unique(Y)
+        # balanced class weights, computed on the training batches only
+        counts = np.array([ np.count_nonzero(Y[ train_mask ] == c) for c in classes ])
+        weights = {c: train_mask.sum() / (len(classes) * max(count, 1)) for c, count in zip(classes, counts)}
+        if self.scale:
+            self.scaler = None
+            scaler = StandardScaler()
+            for start in train:
+                scaler.partial_fit(self.batch(X, start))
+            self.scaler = scaler
+        self.model = SGDClassifier(loss='log_loss', penalty=self.penalty, alpha=self.alpha, class_weight=weights,
+                                   random_state=self.seed)
+        rng = np.random.RandomState(self.seed)
+        best = None
+        self.best_score = -1
+        waiting = 0
+        for epoch in range(self.epochs):
+            for start in rng.permutation(train):
+                self.model.partial_fit(self.batch(X, start), Y[ start:start + self.batch_size ], classes=classes)
+            predicted = np.concatenate([ self.model.predict(self.batch(X, start)) for start in held_out ])
+            target = np.concatenate([ Y[ start:start + self.batch_size ] for start in held_out ])
+            score = macro_f1(target, predicted)
+            print('epoch {:d}, held out f1 {:f}'.format(epoch, score))
+            if score > self.best_score:
+                self.best_score = score
+                best = copy.deepcopy(self.model)
+                waiting = 0
+            else:
+                waiting += 1
+                if waiting >= self.patience:
+                    break
+        self.model = best
+        return self
+
+    def predict( self, X ):
+        return np.concatenate([ self.model.predict(self.batch(X, start))
+                                for start in range(0, len(X), self.batch_size) ])
+
+    def predict_proba( self, X ):
+        return np.concatenate([ self.model.predict_proba(self.batch(X, start))
+                                for start in range(0, len(X), self.batch_size) ])
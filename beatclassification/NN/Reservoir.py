@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+
+class Reservoir:
+    """
+    Delay based reservoir with a Mackey-Glass non linearity, integrated with a Runge-Kutta 4 step.
+    The beats of a chunk are processed together: each node update is a vector operation over the beats, while the
+    samples of a beat and the nodes of the reservoir are visited in order, since every node is driven by the previous
+    one. The input mask is drawn once from the seed and shared by all the beats.
+    """
+
+    def __init__( self, n_nodes=25, beat_size=170, seed=42, dtype=np.float64, chunk_size=4096, theta=0.2, ni=0.8,
+                  gamma=0.5, p=7. ):
+        self.seed = seed
+        self.n_nodes = n_nodes
+        self.beat_size = beat_size
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.theta = theta
+        self.ni = ni
+        self.gamma = gamma
+        self.p = p
+        rand = np.random.RandomState(seed).random_sample((beat_size, n_nodes))
+        # matrix of 1, -1
+        self.mask = np.where(rand < 0.5, -1, 1).astype(self.dtype)
+
+    def drive( self, x_t_minus_tau, input ):
+        excitation = x_t_minus_tau + self.gamma * input
+        return (self.ni * excitation) / (1 + np.power(excitation, self.p))
+
+    def rk4( self, input, x_t, x_t_minus_tau ):
+        # the non linear term does not depend on x_t, so it is shared by the four slopes
+        drive = self.drive(x_t_minus_tau, input)
+        k1 = self.theta * (drive - x_t)
+        k2 = self.theta * (drive - (x_t + 0.5 * k1))
+        k3 = self.theta * (drive - (x_t + 0.5 * k2))
+        k4 = self.theta * (drive - (x_t + k3))
+        return x_t + k1 / 6 + k2 / 3 + k3 / 3 + k4 / 6
+
+    def states( self, beats ):
+        """
+        :param beats: numpy array of shape (n_beats, beat_size)
+        :return: numpy array of shape (n_beats, beat_size, n_nodes) with the response of each node to each sample
+        """
+        beats = np.asarray(beats, dtype=self.dtype)
+        n_beats = len(beats)
+        states = np.empty((n_beats, self.beat_size, self.n_nodes), dtype=self.dtype)
+        # response of the previous node and of each node at the previous sample
+        prev = np.zeros(n_beats, dtype=self.dtype)
+        delayed = np.zeros((n_beats, self.n_nodes), dtype=self.dtype)
+        for j in range(self.beat_size):
+            inputs = beats[ :, j, np.newaxis ] * self.mask[ j ]
+            for node in range(self.n_nodes):
+                prev = self.rk4(inputs[ :, node ], prev, delayed[ :, node ])
+                delayed[ :, node ] = prev
+            states[ :, j ] = delayed
+        if np.isinf(states).any():
+            raise Exception("found:Infinity! not suitable for classifiers")
+        if np.isnan(states).any():
+            raise Exception("found:Not a number! not suitable for classifiers")
+        return states
+
+    def transform( self, dataset, out_path=None, resume=True ):
+        """computes the reservoir states of the dataset, chunk_size beats at a time
+        :param dataset: numpy array of shape (n_beats, beat_size)
+        :param out_path: path of a .npy file. If given, the states are written in a memory mapped array, and the
+            number of finished beats is saved in out_path + '.progress' after every chunk
+        :param resume: whether to continue from the progress file of a previous, interrupted, run on the same output,
+            with the same hyperparameters and dataset
+        :return: numpy array, or memmap, of shape (n_beats, beat_size, n_nodes)
+        """
+        shape = (len(dataset), self.beat_size, self.n_nodes)
+        if out_path is None:
+            output = np.empty(shape, dtype=self.dtype)
+            for start in range(0, len(dataset), self.chunk_size):
+                end = min(start + self.chunk_size, len(dataset))
+                output[ start:end ] = self.states(dataset[ start:end ])
+            return output
+        progress = dict(self.params(), shape=list(shape), data=self.digest(dataset), done=0)
+        done = self.read_progress(out_path, progress) if resume else 0
+        if done > 0:
+            output = np.lib.format.open_memmap(out_path, mode='r+')
+        else:
+            output = np.lib.format.open_memmap(out_path, mode='w+', dtype=self.dtype, shape=shape)
+        for start in range(done, len(dataset), self.chunk_size):
+            end = min(start + self.chunk_size, len(dataset))
+            print('{:d}/{:d}'.format(end, len(dataset)))
+            output[ start:end ] = self.states(dataset[ start:end ])
+            output.flush()
+            progress[ 'done' ] = end
+            self.write_progress(out_path, progress)
+        return output
+
+    def params( self ):
+        """
+        :return: dict of the hyperparameters the states depend on
+        """
+        return {'n_nodes': self.n_nodes, 'beat_size': self.beat_size, 'seed': self.seed, 'dtype': self.dtype.str,
+                'theta': self.theta, 'ni': self.ni, 'gamma': self.gamma, 'p': self.p}
+
+    def digest( self, dataset ):
+        """
+        :return: sha1 of the shape and of the beats of dataset, read chunk_size beats at a time
+        """
+        digest = hashlib.sha1(repr(np.shape(dataset)).encode())
+        for start in range(0, len(dataset), self.chunk_size):
+            chunk = np.ascontiguousarray(dataset[ start:start + self.chunk_size ], dtype=self.dtype)
+            digest.update(chunk.view(np.uint8).reshape(-1))
+        return digest.hexdigest()
+
+    def read_progress( self, out_path, progress ):
+        """
+        :return: number of beats already written in out_path, 0 if the output does not belong to the same run
+        """
+        progress_path = out_path + '.progress'
+        if not os.path.isfile(out_path) or not os.path.isfile(progress_path):
+            return 0
+        with open(progress_path, 'r') as fid:
+            saved = json.load(fid)
+        if any(saved.get(key) != value for key, value in progress.items() if key != 'done'):
+            return 0
+        return saved[ 'done' ]
+
+    def write_progress( self, out_path, progress ):
+        # written aside and renamed, so that an interruption never leaves a truncated progress file
+        progress_path = out_path + '.progress'
+        with open(progress_path + '.tmp', 'w') as fid:
+            json.dump(progress, fid)
+        os.replace(progress_path + '.tmp', progress_path)
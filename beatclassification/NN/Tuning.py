@@ -0,0 +1,244 @@
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from keras.callbacks import Callback
+from beatclassification.Preprocessing import Preprocessing
+from rpeakdetection.Profiler import profiler
+
+prep = Preprocessing()
+
+# arguments of NN.beat_classification that change the preprocessed dataset. All the others only change the training
+data_keys = ('window', 'left_window', 'right_window', 'channels', 'classes', 'aami', 'multiclass', 'standardize',
+             'filtered', 'model_name', 'vertical', 'train_size', 'train_db')
+defaults = {'window': None, 'left_window': 70, 'right_window': 100, 'channels': [ 0 ], 'classes': [ 'N', 'S', 'V', 'F' ],
+            'aami': True, 'multiclass': True, 'standardize': True, 'filtered': False, 'model_name': 'LSTM',
+            'vertical': True, 'train_size': 0.5, 'train_db': 'mitdb'}
+
+
+class MedianPruning(Callback):
+    """
+    Stops a trial at the end of an epoch if its validation loss is worse than the median of the losses that the
+    finished trials had at the same epoch. The finished trials are read from the trial log, so that trials running in
+    other processes are compared too.
+    """
+
+    def __init__( self, log_path, n_startup_trials=4, n_warmup_epochs=3, monitor='val_loss' ):
+        super().__init__()
+        self.log_path = log_path
+        self.n_startup_trials = n_startup_trials
+        self.n_warmup_epochs = n_warmup_epochs
+        self.monitor = monitor
+        self.history = list()
+        self.pruned = False
+
+    def on_epoch_end( self, epoch, logs=None ):
+        value = (logs or {}).get(self.monitor)
+        if value is None:
+            return
+        self.history.append(float(value))
+        if epoch < self.n_warmup_epochs:
+            return
+        others = [ trial[ 'history' ][ epoch ] for trial in read_log(self.log_path)
+                   if len(trial.get('history', [ ])) > epoch ]
+        if len(others) >= self.n_startup_trials and value > np.median(others):
+            print('trial pruned at epoch {:d}'.format(epoch))
+            self.pruned = True
+            self.model.stop_training = True
+
+
+def read_log( log_path ):
+    """
+    :return: list of the trials logged in log_path, one json object per line
+    """
+    if not os.path.isfile(log_path):
+        return list()
+    trials = list()
+    with open(log_path, 'r') as fid:
+        for line in fid:
+            if line.strip() != '':
+                trials.append(json.loads(line))
+    return trials
+
+
+def trial_key( params ):
+    return json.dumps(params, sort_keys=True)
+
+
+def limit_threads( threads ):
+    # read by TensorFlow when it is imported in the worker, so that the trials do not compete for all the cores
+    if threads is not None:
+        os.environ[ 'TF_NUM_INTRAOP_THREADS' ] = str(threads)
+        os.environ[ 'TF_NUM_INTEROP_THREADS' ] = '1'
+        os.environ[ 'OMP_NUM_THREADS' ] = str(threads)
+
+
+def run_trial( trial ):
+    """trains and validates one configuration, executed in a worker process
+    :param trial: dict with the trial id, the params, the fixed arguments of beat_classification, the path of the
+        cached dataset, of the checkpoint and of the trial log and the pruning settings
+    :return: the record of the trial written in the log
+    """
+    from keras import backend as K
+    from keras.callbacks import EarlyStopping, ModelCheckpoint
+    from beatclassification.NN.NN import NN
+    start = time.time()
+    arguments = dict(trial[ 'fixed' ], **trial[ 'params' ])
+    pruning = MedianPruning(trial[ 'log_path' ], **trial[ 'pruning' ])
+    callbacks = [ EarlyStopping(patience=arguments.pop('patience', 10), restore_best_weights=True),
+                  ModelCheckpoint(trial[ 'checkpoint' ], save_best_only=True), pruning ]
+    record = {'trial': trial[ 'trial' ], 'params': trial[ 'params' ], 'checkpoint': trial[ 'checkpoint' ]}
+    try:
+        score, model = NN().beat_classification(dataset=load_dataset(trial[ 'dataset_path' ]), validation=True,
+                                                callbacks=callbacks, **arguments)
+        record[ 'score' ] = float(score)
+        record[ 'state' ] = 'pruned' if pruning.pruned else 'complete'
+    except Exception as e:
+        record[ 'score' ] = None
+        record[ 'state' ] = 'failed'
+        record[ 'error' ] = repr(e)
+    record[ 'history' ] = pruning.history
+    record[ 'seconds' ] = time.time() - start
+    K.clear_session()
+    return record
+
+
+def load_dataset( dataset_path ):
+    """
+    :return: X_train, Y_train, X_val, Y_val, X_test, Y_test and the number of beats of each record of the three sets,
+        as returned by the splits of Preprocessing with return_lengths=True
+    """
+    with np.load(dataset_path) as data:
+        arrays = [ data[ name ] for name in [ 'X_train', 'Y_train', 'X_val', 'Y_val', 'X_test', 'Y_test' ] ]
+        lengths = tuple(list(data[ name ]) for name in [ 'lengths_train', 'lengths_val', 'lengths_test' ])
+    return tuple(arrays) + (lengths,)
+
+
+class Tuning:
+    """
+    Parallel search of the hyperparameters of NN.beat_classification.
+    The beats are extracted once per dataset configuration(window, channels, split...) and cached in cache_dir, the
+    timesteps windows are built from the cached beats by each trial. The trials run in worker processes, unpromising
+    ones are pruned by MedianPruning and every trial is appended to a json lines log, which is also used to skip the
+    trials already run. The best weights of each trial are checkpointed, so the best model is loaded, not retrained.
+    """
+
+    def __init__( self, out_dir='out/tuning', cache_dir='data/cache/nn', workers=2, threads=None, n_startup_trials=4,
+                  n_warmup_epochs=3, n_jobs=None ):
+        """
+        :param workers: number of trials trained at the same time
+        :param threads: number of threads of each trial. Defaults to the number of cores divided by workers
+        :param n_jobs: number of workers extracting the beats of a new dataset configuration(see Preprocessing)
+        """
+        self.out_dir = out_dir
+        self.cache_dir = cache_dir
+        self.workers = workers
+        if threads is None:
+            threads = max(multiprocessing.cpu_count() // workers, 1)
+        self.threads = threads
+        self.pruning = {'n_startup_trials': n_startup_trials, 'n_warmup_epochs': n_warmup_epochs}
+        self.n_jobs = n_jobs
+        self.log_path = os.path.join(out_dir, 'trials.jsonl')
+
+    def dataset_config( self, arguments ):
+        return {key: arguments.get(key, defaults[ key ]) for key in data_keys}
+
+    def dataset( self, arguments ):
+        """extracts, or reads from the cache, the beats of a dataset configuration, without timesteps windows
+        :param arguments: arguments of beat_classification, only the ones in data_keys are used
+        :return: path of the cached .npz file
+        """
+        config = self.dataset_config(arguments)
+        digest = hashlib.md5(trial_key(config).encode('utf-8')).hexdigest()[ :16 ]
+        dataset_path = os.path.join(self.cache_dir, digest + '.npz')
+        if os.path.isfile(dataset_path):
+            return dataset_path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        common = {'classes': config[ 'classes' ], 'timesteps': None, 'channels': config[ 'channels' ],
+                  'standardize': config[ 'standardize' ], 'aami': config[ 'aami' ], 'model': config[ 'model_name' ],
+                  'multiclass': config[ 'multiclass' ], 'window': config[ 'window' ],
+                  'left_window': config[ 'left_window' ], 'right_window': config[ 'right_window' ],
+                  'filtered': config[ 'filtered' ], 'n_jobs': self.n_jobs, 'return_lengths': True}
+        if config[ 'vertical' ]:
+            split = prep.vertical_split(train_size=config[ 'train_size' ], **common)
+        else:
+            split = prep.horizontal_split(train_db=config[ 'train_db' ], **common)
+        X_train, Y_train, X_val, Y_val, X_test, Y_test, lengths = split
+        # written aside and renamed, so that an interrupted write is never read as a cached dataset
+        tmp_path = dataset_path[ :-len('.npz') ] + '.tmp.npz'
+        np.savez(tmp_path, X_train=X_train, Y_train=Y_train, X_val=X_val, Y_val=Y_val, X_test=X_test, Y_test=Y_test,
+                 lengths_train=lengths[ 0 ], lengths_val=lengths[ 1 ], lengths_test=lengths[ 2 ])
+        os.replace(tmp_path, dataset_path)
+        with open(os.path.join(self.cache_dir, digest + '.json'), 'w') as fid:
+            json.dump(config, fid)
+        return dataset_path
+
+    def grid( self, space, n_trials=None, seed=42 ):
+        """
+        :param space: dict[argument of beat_classification, list of values]
+        :param n_trials: if given, number of configurations drawn at random from the grid
+        :return: list of dict[argument, value]
+        """
+        names = sorted(space)
+        grid = [ dict(zip(names, values)) for values in itertools.product(*[ space[ name ] for name in names ]) ]
+        if n_trials is not None and n_trials < len(grid):
+            chosen = np.random.RandomState(seed).choice(len(grid), n_trials, replace=False)
+            grid = [ grid[ i ] for i in sorted(chosen) ]
+        return grid
+
+    def search( self, space, n_trials=None, seed=42, **fixed ):
+        """
+        :param space: dict[argument of beat_classification, list of values], e.g. window, timesteps, n_neurons,
+            n_LSTM_layers, dropout, augment
+        :param n_trials: if given, number of configurations drawn at random from the grid
+        :param fixed: arguments of beat_classification shared by all the trials, e.g. epochs, patience
+        :return: record of the best trial, None if no trial completed
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        done = {trial_key(trial[ 'params' ]) for trial in read_log(self.log_path) if trial[ 'state' ] != 'failed'}
+        first_id = len(read_log(self.log_path))
+        trials = list()
+        for params in self.grid(space, n_trials, seed):
+            if trial_key(params) in done:
+                continue
+            arguments = dict(fixed, **params)
+            trial_id = first_id + len(trials)
+            trials.append({'trial': trial_id, 'params': params, 'fixed': fixed,
+                           'dataset_path': self.dataset(arguments), 'log_path': self.log_path,
+                           'checkpoint': os.path.join(self.out_dir, 'trial_{:d}.h5'.format(trial_id)),
+                           'pruning': self.pruning})
+        print('{:d} trials to run, {:d} already logged'.format(len(trials), len(done)))
+        # spawned workers start from a fresh interpreter instead of a fork of a process that may hold a TF runtime
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=limit_threads,
+                                 initargs=(self.threads,)) as executor:
+            futures = [ executor.submit(profiler.remote(run_trial), trial) for trial in trials ]
+            # only this process writes the log, one line per finished trial
+            for future in as_completed(futures):
+                record = profiler.merged(future.result())
+                with open(self.log_path, 'a') as fid:
+                    fid.write(json.dumps(record) + '\n')
+                print(record[ 'trial' ], record[ 'state' ], record[ 'score' ], record[ 'params' ])
+        return self.best()
+
+    def best( self ):
+        """
+        :return: record of the completed trial with the highest validation score, None if there is none
+        """
+        completed = [ trial for trial in read_log(self.log_path) if trial[ 'state' ] == 'complete' ]
+        if len(completed) == 0:
+            return None
+        return max(completed, key=lambda trial: trial[ 'score' ])
+
+    def best_model( self, record=None ):
+        """
+        :return: the Keras model of the best trial, loaded from its checkpoint
+        """
+        from keras.models import load_model
+        if record is None:
+            record = self.best()
+        return load_model(record[ 'checkpoint' ])
@@ -1,18 +1,19 @@
-import pywt
 import wfdb
 from rpeakdetection.Utility import Utility
+from rpeakdetection.Record import Record, ms2samples
+from rpeakdetection.ChunkedFilter import ChunkedFilter
 import numpy as np
-from collections import defaultdict
-import random
-from sklearn.decomposition import PCA
-from scipy import signal
-from scipy.signal import medfilt
-from collections import defaultdict
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split
-from beatclassification.SVM_weighted.FeatureExtraction import FeatureExtraction
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import os
+from beatclassification.BeatIndex import BeatIndex
+from beatclassification.Resampling import Resampling
+from beatclassification import Datasets as ds
+from rpeakdetection.Profiler import profile, profiler
 
-fe = FeatureExtraction()
+bi = BeatIndex()
+rs = Resampling()
+rd = Record()
 ut = Utility()
 ecg_path = 'data/ecg/mitdb/'
 # classes = ['N', 'L', 'R', 'e', 'j', 'A', 'a', 'J', 'S', 'V', 'E', 'F', '/', 'f', 'Q']
@@ -27,35 +28,64 @@ sig_len = 650000
 
 class Preprocessing():
 
+    def __init__( self, engine=None ):
+        """
+        :param engine: ChunkedFilter running the baseline filter, e.g. chunk by chunk on a memory mapped Holter record.
+            By default the whole record is filtered at once
+        """
+        self.engine = engine if engine is not None else ChunkedFilter()
+
     def preprocess( self, dataset_names, channels, model, classes=None, aami=True, one_hot=True, timesteps=None,
-                    filtered=False, train_db='mitdb', fs=360 ):
+                    filtered=False, train_db='mitdb', fs=360, window=None, left_window=70, right_window=100,
+                    n_jobs=None ):
         if classes is None:
             classes = [ 'N', 'S', 'V', 'F' ]
-        # duration of a beat(s)
-        time_len = 0.422
-        beat_size = int(fs * time_len)
-        X_shape = self.compute_shape(dataset_names)
-        X_shape = (X_shape, beat_size * len(channels))
-        X = np.empty(X_shape)
-        if one_hot:
-            Y = np.empty((X_shape[ 0 ], len(classes)))
-        else:
-            Y = np.empty(X_shape[ 0 ], dtype='int8')
-        count = 0
-        for name in dataset_names:
-            beats, labels, peaks = self.extract_labeled_beats(aami, classes, name, one_hot, model=model,
-                                                              channels=channels,
-                                                              filtered=filtered, train_db=train_db)
-            X[ count:count + len(peaks) ] = beats
-            Y[ count:count + len(peaks) ] = labels
-            count += len(peaks)
-        X = np.array(X)
-        Y = np.array(Y)
+        # the manifest gives the position of each record in the dataset, so no counting pass is needed
+        offsets = bi.offsets(dataset_names, db=train_db, window=window, left_window=left_window,
+                             right_window=right_window, fs=fs)
+        X = None
+        Y = None
+        extract = partial(self.extract_labeled_beats, aami, classes, one_hot=one_hot, model=model, channels=channels,
+                          filtered=filtered, train_db=train_db, window=window, left_window=left_window,
+                          right_window=right_window, fs=fs)
+        records = self.map_records(extract, dataset_names, n_jobs=n_jobs, processes=filtered)
+        for i, (beats, labels, peaks) in enumerate(records):
+            if X is None:
+                X = np.empty((offsets[ -1 ],) + beats.shape[ 1: ], dtype=beats.dtype)
+                Y = np.empty((offsets[ -1 ],) + labels.shape[ 1: ], dtype=labels.dtype)
+            X[ offsets[ i ]:offsets[ i + 1 ] ] = beats
+            Y[ offsets[ i ]:offsets[ i + 1 ] ] = labels
         if timesteps is not None:
-            X, Y = self.compute_timesteps(X, Y, timesteps)
+            X, Y = self.compute_timesteps(X, Y, timesteps, lengths=np.diff(offsets))
         return X, Y
 
+    def map_records( self, function, names, n_jobs=None, processes=False ):
+        """applies function to each record name, concurrently if n_jobs allows it
+        :param function: picklable callable taking a record name as its only positional argument
+        :param names: list of record names
+        :param n_jobs: number of workers. None or 1 runs serially, -1 uses all the available cores
+        :param processes: whether to use a process pool(CPU bound work such as filtering) instead of a thread pool(I/O)
+        :return: generator of the results in the same order of names, so that splits stay reproducible
+        """
+        if n_jobs is None or n_jobs == 1 or len(names) <= 1:
+            for name in names:
+                yield function(name)
+            return
+        if n_jobs < 0:
+            n_jobs = os.cpu_count()
+        if not processes:
+            with ThreadPoolExecutor(max_workers=min(n_jobs, len(names))) as pool:
+                yield from pool.map(function, names)
+            return
+        # the spans of the workers come back with their results
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(names))) as pool:
+            for output in pool.map(profiler.remote(function), names):
+                yield profiler.merged(output)
+
     def extract_features( self, beats, peaks ):
+        # the SVM features pull in pywt and scipy.stats, only needed here
+        from beatclassification.SVM_weighted.FeatureExtraction import FeatureExtraction
+        fe = FeatureExtraction()
         rr_intervals = np.diff(peaks)
         rr_mean = np.mean(rr_intervals)
         features = list()
@@ -67,7 +97,13 @@ class Preprocessing():
         return features
 
     def extract_labeled_beats( self, aami, classes, name, one_hot, filtered=False, channels=None, model=None,
-                               train_db='mitdb', multiclass=True, window=None, left_window=70, right_window=100 ):
+                               train_db='mitdb', multiclass=True, window=None, left_window=70, right_window=100, fs=360,
+                               quality=None ):
+        """
+        :param fs: sampling frequency the record is read at, resampling it if needed. The windows are in samples at fs
+        :param quality: SignalQuality. If given, the beats in the unusable windows of the record are dropped and
+            reported, so the number of beats may differ from the one of the BeatIndex
+        """
         if train_db == 'incartdb':
             ecg_path = 'data/ecg/incartdb/'
         else:
@@ -76,15 +112,24 @@ class Preprocessing():
             channels = [0]
         print(name)
         if name != '114' and len(channels) == 1:
-            record = wfdb.rdrecord(ecg_path + name, channels=[ 0 ])
+            record = rd.read(ecg_path + name, channels=[ 0 ], fs=fs)
         else:
-            record = wfdb.rdrecord(ecg_path + name, channels=channels)
-        peaks, symbols = ut.remove_non_beat(ecg_path + name, False)
-        record = np.transpose(record.p_signal)
+            record = rd.read(ecg_path + name, channels=channels, fs=fs)
+        entry = bi.entry(train_db, name, fs)
+        peaks, symbols = entry[ 'peaks' ], entry[ 'symbols' ]
+        if quality is not None:
+            # scored on the signal as read, in mV like the thresholds of quality
+            usable = quality.mask(record, fs)
+            quality.report(usable, fs, name)
         if filtered:
             for id in range(len(record)):
-                record[ id ] = self.filter(record[ id ])
-        peaks, symbols = self.exclude_out_of_range(peaks, symbols, window=window, left_window=left_window, right_window=right_window)
+                filtered = self.filter(record[ id ], fs)
+                record[ id ] = filtered
+                self.engine.release(filtered)
+        peaks, symbols = self.exclude_out_of_range(peaks, symbols, window=window, left_window=left_window,
+                                                   right_window=right_window, sig_len=record.shape[ 1 ])
+        if quality is not None:
+            peaks, symbols = self.exclude_unusable(peaks, symbols, quality, usable, fs)
         labels = self.extract_labels(aami, classes, one_hot, symbols, multiclass)
         if model == 'LSTM':
             beats = self.extract_beats(channels, peaks, record, window=window, left_window=left_window, right_window=right_window)
@@ -92,13 +137,14 @@ class Preprocessing():
             beats = self.image_beats(peaks, record)
         return beats, labels, peaks
 
+    @profile('features')
     def extract_beats( self, channels, peaks, record, window=None, left_window=70, right_window=100 ):
         if window is not None:
             left_window = int(window/2)
             right_window = left_window
         beat_len = (left_window + right_window) * len(channels)
         beats_shape = (len(peaks), beat_len)
-        beats = np.zeros(beats_shape)
+        beats = np.zeros(beats_shape, dtype=record.dtype)
         for i, p in enumerate(peaks):
             beat = list()
             for id in range(len(record)):
@@ -106,17 +152,36 @@ class Preprocessing():
             beats[ i ] = beat
         return beats
 
-    def compute_timesteps( self, X, Y, timesteps ):
-        end_beats = timesteps - 1
-        start_label = end_beats
-        windowed = np.zeros((X.shape[ 0 ] - end_beats, timesteps, X.shape[ 1 ]))
-        for i in range(len(X) - end_beats):
-            window = [ X[ w ] for w in range(i, i + timesteps) ]
-            windowed[ i ] = window
-        labels = Y[ start_label: ]
-        return windowed, labels
+    def compute_timesteps( self, X, Y, timesteps, lengths=None ):
+        """groups consecutive beats in windows of timesteps beats. Each window is labelled as its last beat
+        :param lengths: number of beats of each record in X, in order. If given, windows never span two records
+        :return: windows of shape (n_windows, timesteps) + X.shape[1:] and their labels. Without lengths the windows
+            are a read only view of X. With lengths they are gathered from the view, which copies timesteps beats per
+            window: BatchGenerator gathers the windows of each batch from window_starts instead
+        """
+        windowed = self.timestep_view(X, timesteps)
+        if lengths is None:
+            return windowed, Y[ timesteps - 1: ]
+        starts = self.window_starts(lengths, timesteps)
+        return windowed[ starts ], Y[ starts + timesteps - 1 ]
+
+    def timestep_view( self, X, timesteps ):
+        # sliding_window_view appends the window axis at the end, it is moved right after the windows axis
+        windowed = np.lib.stride_tricks.sliding_window_view(X, timesteps, axis=0)
+        return np.moveaxis(windowed, -1, 1)
+
+    def window_starts( self, lengths, timesteps ):
+        """
+        :param lengths: number of beats of each record, in order
+        :return: indexes of the first beat of every window of timesteps beats contained in a single record
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+        offsets = np.cumsum(lengths) - lengths
+        counts = np.maximum(lengths - timesteps + 1, 0)
+        firsts = np.cumsum(counts) - counts
+        return np.repeat(offsets - firsts, counts) + np.arange(counts.sum())
 
-    def exclude_out_of_range( self, peaks, symbols, window=None, left_window=70, right_window=100):
+    def exclude_out_of_range( self, peaks, symbols, window=None, left_window=70, right_window=100, sig_len=sig_len ):
         if window is not None:
             left_window = int(window/2)
             right_window = left_window
@@ -126,6 +191,16 @@ class Preprocessing():
         peaks, symbols = zip(*pairs)
         return peaks, symbols
 
+    def exclude_unusable( self, peaks, symbols, quality, mask, fs ):
+        """
+        :param mask: window mask of SignalQuality
+        :return: peaks and symbols of the beats in usable windows
+        """
+        peaks = np.asarray(peaks)
+        keep = quality.sample_mask(mask, fs, int(peaks.max()) + 1 if len(peaks) > 0 else 0)[ peaks ]
+        print('{:d} beats in unusable windows'.format(int(np.count_nonzero(~keep))))
+        return tuple(peaks[ keep ]), tuple(np.asarray(symbols)[ keep ])
+
     def extract_labels( self, aami, classes, one_hot, symbols, multiclass=True ):
         symbols = list(symbols)
         labels = np.zeros(len(symbols), dtype='int8')
@@ -183,37 +258,16 @@ class Preprocessing():
                             labels[ i ][ 0 ] = 1
         return labels
 
-    def subsample_data( self, X, Y, classes, label, factor, one_hot ):
-        if one_hot:
-            label_data = list(filter(lambda x: np.argmax(x[ 1 ]) == classes.index(label), zip(X, Y)))
-            other_data = list(filter(lambda x: np.argmax(x[ 1 ]) != classes.index(label), zip(X, Y)))
-        else:
-            label_data = list(filter(lambda x: x[ 1 ] == classes.index(label), zip(X, Y)))
-            other_data = list(filter(lambda x: x[ 1 ] != classes.index(label), zip(X, Y)))
-        label_X, label_Y = zip(*label_data)
-        X, Y = zip(*other_data)
-        sample_len = int(len(label_X) / factor)
-        label_X = random.sample(label_X, sample_len)
-        label_Y = label_Y[ :sample_len ]
-        X = np.concatenate((X, label_X))
-        Y = np.concatenate((Y, label_Y))
-        return X, Y
+    def subsample_data( self, X, Y, classes, label, factor, one_hot, seed=42 ):
+        # keeps a random 1/factor of the beats of label
+        return rs.resample(X, Y, {classes.index(label): 1 / factor}, seed=seed, one_hot=one_hot)
 
     def augment_data( self, X, Y, classes, label, factor, one_hot=True ):
-        if one_hot:
-            label_data = list(filter(lambda x: np.argmax(x[ 1 ]) == classes.index(label), zip(X, Y)))
-        else:
-            classe = classes.index(label)
-            print(classe)
-            label_data = list(filter(lambda x: x[ 1 ] == classe, zip(X, Y)))
-        label_X, label_Y = zip(*label_data)
-        for i in range(factor - 1):
-            X = np.concatenate((X, label_X))
-            # X = np.concatenate((X, list(map(lambda x: x + random.random(), label_X))))
-            Y = np.concatenate((Y, label_Y))
-        return X, Y
+        # repeats factor times the beats of label
+        return rs.resample(X, Y, {classes.index(label): factor}, one_hot=one_hot)
 
-    def filter( self, channel ):
+    @profile('filter')
+    def filter( self, channel, fs=360 ):
         '''fs = 360
         # cutoff low frequency to get rid of baseline wonder
         f1 = 5
@@ -225,11 +279,14 @@ class Preprocessing():
         [a, b] = signal.butter(N, Wn, 'band')
         # filtering
         filtered = signal.filtfilt(a, b, channel)'''
-        baseline = medfilt(channel, 71)
-        baseline = medfilt(baseline, 215)
-        return np.subtract(channel, baseline)
+        # 200 ms and 600 ms median filters, 71 and 215 samples at 360 Hz. Kernel sizes must be odd
+        first = self.engine.medfilt(channel, ms2samples(197, fs) | 1)
+        baseline = self.engine.medfilt(first, ms2samples(597, fs) | 1)
+        self.engine.release(first)
+        # in place, so that a memory mapped baseline is not copied
+        return np.subtract(channel, baseline, out=baseline)
 
-    def read_image( self, train_size, classes=None, one_hot=True, aami=True ):
+    def read_image( self, train_size, classes=None, one_hot=True, aami=True, n_jobs=None ):
         if classes is None:
             classes = [ 'N', 'S', 'V', 'F' ]
         X_train = list()
@@ -238,21 +295,9 @@ class Preprocessing():
         Y_train = list()
         Y_val = list()
         Y_test = list()
-        names = list(
-            {'100', '101', '102', '103', '104', '105', '106', '107', '108', '109', '111', '112', '113', '114', '115',
-             '116', '117', '118', '119', '121', '122', '123', '124', '200', '201', '202', '203', '205', '207', '208',
-             '209', '210', '212', '213', '214', '215', '217', '219', '220', '221', '222', '223', '228', '230', '231',
-             '232', '233', '234'} - {'102', '104', '107', '217'})
-        for name in names:
-            print(name)
-            record = wfdb.rdrecord(ecg_path + name, channels=[ 0, 1 ])
-            record = np.transpose(record.p_signal)
-            # for i in range(len(record)):
-            # record[i] = self.remove_baseline(record[i])
-            peaks, symbols = ut.remove_non_beat(ecg_path + name, False)
-            peaks, symbols = self.exclude_out_of_range(peaks, symbols)
-            labels = self.extract_labels(aami=aami, classes=classes, one_hot=one_hot, symbols=symbols)
-            beats = self.image_beats(peaks, record)
+        names = ds.mitdb
+        read = partial(self.read_image_record, classes=classes, one_hot=one_hot, aami=aami)
+        for beats, labels, peaks in self.map_records(read, names, n_jobs=n_jobs):
             self.train_val_test_split(X_test, X_train, X_val, Y_test, Y_train, Y_val, beats, labels, peaks, train_size)
         print(len(X_train))
         print(len(X_val))
@@ -260,11 +305,23 @@ class Preprocessing():
         return np.array(X_train), np.array(Y_train), np.array(X_val), np.array(Y_val), np.array(X_test), np.array(
             Y_test)
 
+    def read_image_record( self, name, classes, one_hot=True, aami=True ):
+        print(name)
+        record = rd.read(ecg_path + name, channels=[ 0, 1 ])
+        # for i in range(len(record)):
+        # record[i] = self.remove_baseline(record[i])
+        peaks, symbols = ut.remove_non_beat(ecg_path + name, False)
+        peaks, symbols = self.exclude_out_of_range(peaks, symbols)
+        labels = self.extract_labels(aami=aami, classes=classes, one_hot=one_hot, symbols=symbols)
+        beats = self.image_beats(peaks, record)
+        return beats, labels, peaks
+
+    @profile('features')
     def image_beats( self, peaks, record ):
         beats_shape = (len(peaks), 2, 170, 1)
-        beats = np.zeros(beats_shape)
+        beats = np.zeros(beats_shape, dtype=record.dtype)
         for index, p in enumerate(peaks):
-            beat = np.zeros(beats_shape[ 1: ])
+            beat = np.zeros(beats_shape[ 1: ], dtype=record.dtype)
             for i in range(len(record)):
                 channel = record[ i ]
                 beat_data = channel[ p - 70:p + 100 ]
@@ -272,47 +329,48 @@ class Preprocessing():
             beats[ index ] = beat
         return beats
 
+    @profile('features')
     def standardize( self, X_train, X_val, X_test ):
+        from sklearn.preprocessing import StandardScaler
         scaler = StandardScaler().fit(X_train)
         X_train = scaler.transform(X_train)
         X_val = scaler.transform(X_val)
         X_test = scaler.transform(X_test)
         return X_train, X_val, X_test
 
-    def compute_shape( self, dataset_names ):
-        count = 0
-        for name in dataset_names:
-            peaks, symbols = ut.remove_non_beat(ecg_path + name, rule_based=False)
-            peaks, symbol = self.exclude_out_of_range(peaks, symbols)
-            count += len(peaks)
-        return count
+    def compute_shape( self, dataset_names, train_db='mitdb', window=None, left_window=70, right_window=100, fs=360 ):
+        return int(bi.offsets(dataset_names, db=train_db, window=window, left_window=left_window,
+                              right_window=right_window, fs=fs)[ -1 ])
 
     def vertical_split(self, train_size, timesteps, channels=None, standardize=True, classes=None, aami=True,
                           model=None,
-                          filtered=False, one_hot=True, multiclass=True, window=None, left_window=70, right_window=100 ):
+                          filtered=False, one_hot=True, multiclass=True, window=None, left_window=70, right_window=100,
+                          n_jobs=None, return_lengths=False, fs=360, quality=None ):
+        """
+        :param return_lengths: whether to return also the number of beats of each record in the train, validation and
+            test sets, needed to build timesteps windows later on
+        :param fs: sampling frequency all the records are read at. The windows are in samples at fs
+        :param quality: SignalQuality. If given, the beats in unusable windows are left out of the three sets
+        """
         if channels is None:
             channels = [ 0 ]
         if classes is None:
             classes = [ 'N', 'S', 'V', 'F' ]
-        names = list(
-            {'100', '101', '102', '103', '104', '105', '106', '107', '108', '109', '111', '112', '113', '114', '115',
-             '116', '117', '118', '119', '121', '122', '123', '124', '200', '201', '202', '203', '205', '207',
-             '208',
-             '209', '210', '212', '213', '214', '215', '217', '219', '220', '221', '222', '223', '228', '230', '231',
-             '232', '233', '234'} - {'102', '104', '107', '217'})
+        names = ds.mitdb
         X_train = list()
         Y_train = list()
         X_val = list()
         Y_val = list()
         X_test = list()
         Y_test = list()
-        for name in names:
-            beats, labels, peaks = self.extract_labeled_beats(aami=aami, classes=classes, name=name,
-                                                              one_hot=one_hot, channels=channels, model=model,
-                                                              filtered=filtered, multiclass=multiclass, window=window,
-                                                              left_window=left_window, right_window=right_window)
+        lengths = (list(), list(), list())
+        bi.manifest('mitdb', names, n_jobs=n_jobs)
+        extract = partial(self.extract_labeled_beats, aami, classes, one_hot=one_hot, channels=channels, model=model,
+                          filtered=filtered, multiclass=multiclass, window=window, left_window=left_window,
+                          right_window=right_window, fs=fs, quality=quality)
+        for beats, labels, peaks in self.map_records(extract, names, n_jobs=n_jobs, processes=filtered):
             self.train_val_test_split(X_test, X_train, X_val, Y_test, Y_train, Y_val,
-                                      beats, labels, peaks, train_size)
+                                      beats, labels, peaks, train_size, lengths=lengths)
         X_train = np.array(X_train)
         X_val = np.array(X_val)
         X_test = np.array(X_test)
@@ -322,60 +380,85 @@ class Preprocessing():
         if standardize:
             X_train, X_val, X_test = self.standardize(X_train, X_val, X_test)
         if timesteps is not None:
-            X_train, Y_train = self.compute_timesteps(X_train, Y_train, timesteps)
-            X_val, Y_val = self.compute_timesteps(X_val, Y_val, timesteps)
-            X_test, Y_test = self.compute_timesteps(X_test, Y_test, timesteps)
+            X_train, Y_train = self.compute_timesteps(X_train, Y_train, timesteps, lengths=lengths[ 0 ])
+            X_val, Y_val = self.compute_timesteps(X_val, Y_val, timesteps, lengths=lengths[ 1 ])
+            X_test, Y_test = self.compute_timesteps(X_test, Y_test, timesteps, lengths=lengths[ 2 ])
+        if return_lengths:
+            return X_train, Y_train, X_val, Y_val, X_test, Y_test, lengths
         return X_train, Y_train, X_val, Y_val, X_test, Y_test
 
     def horizontal_split( self, classes=None, timesteps=None, window=None, left_window=70, right_window=100, train_db='mitdb',
-                          multiclass=True, aami=True, one_hot=True, model=None, standardize=True, channels=None):
+                          multiclass=True, aami=True, one_hot=True, model=None, standardize=True, channels=None,
+                          filtered=False, n_jobs=None, return_lengths=False, fs=360, quality=None ):
+        """
+        :param return_lengths: whether to return also the number of beats of each record in the train, validation and
+            test sets, needed to build timesteps windows later on
+        :param fs: sampling frequency all the records are read at, so that incartdb(257 Hz) training beats have the
+            same duration of the mitdb(360 Hz) test beats. The windows are in samples at fs
+        :param quality: SignalQuality. If given, the beats in unusable windows are left out of the three sets
+        """
         if channels == None:
             channels = [0]
+        if classes is None:
+            classes = [ 'N', 'S', 'V', 'F' ]
         if train_db == 'mitdb':
-            train_dataset = [ '106', '112', '122', '201', '223', '230', "108", "109", "115", "116", "118", "119", "124",
-                              "205", "207", "208", "209", "215", '101', '114', '203', '220' ]
+            train_dataset = ds.DS1
         else:
             train_dataset = wfdb.get_record_list('incartdb')
-        test_dataset = [ "100", "103", "105", "111", "113", "117", "121", "123", "200", "202", "210", "212", "213",
-                         "214", "219",
-                         "221", "222", "228", "231", "232", "233", "234" ]
+        test_dataset = ds.DS2
         X_train = list()
         Y_train = list()
+        X_val = list()
+        Y_val = list()
         X_test = list()
         Y_test = list()
-        for name in train_dataset:
-            beats, labels, peaks = self.extract_labeled_beats(name=name, aami=aami, classes=classes, one_hot=one_hot,
-                                                              model=model, train_db=train_db, multiclass=multiclass,
-                                                              window=window,
-                                                              left_window=left_window, right_window=right_window,
-                                                              channels=channels)
+        lengths = (list(), list(), list())
+        bi.manifest(train_db, train_dataset, n_jobs=n_jobs)
+        bi.manifest('mitdb', test_dataset, n_jobs=n_jobs)
+        extract = partial(self.extract_labeled_beats, aami, classes, one_hot=one_hot, model=model, train_db=train_db,
+                          multiclass=multiclass, window=window, left_window=left_window, right_window=right_window,
+                          channels=channels, filtered=filtered, fs=fs, quality=quality)
+        for beats, labels, peaks in self.map_records(extract, train_dataset, n_jobs=n_jobs, processes=filtered):
             X_train.extend(beats)
             Y_train.extend(labels)
-        for name in test_dataset:
-            beats, labels, peaks = self.extract_labeled_beats(name=name, aami=aami, classes=classes, one_hot=one_hot,
-                                                              model=model, train_db=train_db,
-                                                              multiclass=multiclass, window=window, left_window=left_window,
-                                                              right_window=right_window)
-            X_test.extend(beats)
-            Y_train.extend(labels)
+            lengths[ 0 ].append(len(peaks))
+        # the test set is always DS2 of mitdb, also when training on incartdb
+        extract = partial(extract, train_db='mitdb')
+        # the last 10% of each test record is used for validation, so that records stay contiguous
+        for beats, labels, peaks in self.map_records(extract, test_dataset, n_jobs=n_jobs, processes=filtered):
+            val_index = len(peaks) - int(len(peaks) * 0.1)
+            X_test.extend(beats[ :val_index ])
+            Y_test.extend(labels[ :val_index ])
+            X_val.extend(beats[ val_index: ])
+            Y_val.extend(labels[ val_index: ])
+            lengths[ 2 ].append(val_index)
+            lengths[ 1 ].append(len(peaks) - val_index)
         X_train = np.array(X_train)
+        X_val = np.array(X_val)
         X_test = np.array(X_test)
         Y_train = np.array(Y_train)
+        Y_val = np.array(Y_val)
         Y_test = np.array(Y_test)
-        X_test, X_val, Y_test, Y_val = train_test_split(X_test, Y_test, test_size=0.1)
         if standardize:
             X_train, X_val, X_test = self.standardize(X_train, X_val, X_test)
         if timesteps is not None:
-            X_train, Y_train = self.compute_timesteps(X_train, Y_train, timesteps)
-            X_val, Y_val = self.compute_timesteps(X_val, Y_val, timesteps)
-            X_test, Y_test = self.compute_timesteps(X_test, Y_test, timesteps)
-        return X_train, X_test, Y_train, Y_test
+            X_train, Y_train = self.compute_timesteps(X_train, Y_train, timesteps, lengths=lengths[ 0 ])
+            X_val, Y_val = self.compute_timesteps(X_val, Y_val, timesteps, lengths=lengths[ 1 ])
+            X_test, Y_test = self.compute_timesteps(X_test, Y_test, timesteps, lengths=lengths[ 2 ])
+        if return_lengths:
+            return X_train, Y_train, X_val, Y_val, X_test, Y_test, lengths
+        return X_train, Y_train, X_val, Y_val, X_test, Y_test
 
-    def train_val_test_split( self, X_test, X_train, X_val, Y_test, Y_train, Y_val, beats, labels, peaks, train_size ):
+    def train_val_test_split( self, X_test, X_train, X_val, Y_test, Y_train, Y_val, beats, labels, peaks, train_size,
+                              lengths=None ):
         val_size = 0.1
         train_index = int(len(peaks) * train_size)
         val_index = int(len(peaks) * val_size)
         val_index = train_index + val_index
+        if lengths is not None:
+            lengths[ 0 ].append(train_index)
+            lengths[ 1 ].append(val_index - train_index)
+            lengths[ 2 ].append(len(peaks) - val_index)
         X_train.extend(beats[ :train_index ])
         Y_train.extend(labels[ :train_index ])
         X_val.extend(beats[ train_index: val_index ])
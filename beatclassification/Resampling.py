@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class Resampling:
+    """
+    Class rebalancing by index arrays. The resampled dataset is described by the indexes of the original samples to
+    keep, repeated when oversampling, so it can be applied with a single gather or used lazily by a batch generator.
+    """
+
+    def labels( self, Y, one_hot=None ):
+        """
+        :param Y: numpy array of labels, integer or one hot
+        :param one_hot: whether Y is one hot. If None it is inferred from the shape of Y
+        :return: integer label of each sample
+        """
+        Y = np.asarray(Y)
+        if one_hot is None:
+            one_hot = Y.ndim > 1
+        if one_hot and Y.shape[ 1 ] > 1:
+            return np.argmax(Y, axis=1)
+        # binary labels are stored in a single column
+        return Y.reshape(len(Y)).astype(np.int64)
+
+    def ratios( self, scale_factors ):
+        """converts signed scale factors in sampling ratios
+        :param scale_factors: one factor per label. A factor f > 1 repeats the samples of the label f times, f < -1
+            keeps 1/|f| of them, -1 and 1 leave the label unchanged and 0 drops it
+        :return: numpy array with the fraction of samples to draw for each label
+        """
+        scale_factors = np.asarray(scale_factors, dtype=np.float64)
+        ratios = np.ones(len(scale_factors))
+        ratios[ scale_factors == 0 ] = 0
+        ratios[ scale_factors > 1 ] = scale_factors[ scale_factors > 1 ]
+        ratios[ scale_factors < -1 ] = 1 / -scale_factors[ scale_factors < -1 ]
+        return ratios
+
+    def indices( self, Y, ratios, seed=42, shuffle=False, one_hot=None ):
+        """
+        :param Y: numpy array of labels, integer or one hot
+        :param ratios: dict[label, ratio] or sequence with one ratio per label. The samples of a label are drawn
+            int(n_samples * ratio) times: whole multiples are repeated, the remainder is sampled without replacement
+        :param seed: seed of the random generator used for the remainders and the shuffling
+        :param shuffle: whether to shuffle the indexes. Otherwise they follow the order of the original samples
+        :return: numpy array with the indexes of the resampled dataset, empty if Y is
+        """
+        labels = self.labels(Y, one_hot)
+        if len(labels) == 0:
+            return np.empty(0, dtype=np.int64)
+        if not isinstance(ratios, dict):
+            ratios = dict(enumerate(ratios))
+        rng = np.random.RandomState(seed)
+        indices = list()
+        for label in np.unique(labels):
+            label_indices = np.flatnonzero(labels == label)
+            ratio = ratios.get(label, 1)
+            n_samples = int(len(label_indices) * ratio)
+            copies = n_samples // len(label_indices)
+            indices.append(np.repeat(label_indices, copies))
+            remainder = n_samples - copies * len(label_indices)
+            indices.append(rng.choice(label_indices, remainder, replace=False))
+        indices = np.concatenate(indices).astype(np.int64, copy=False)
+        if shuffle:
+            rng.shuffle(indices)
+        else:
+            indices.sort(kind='stable')
+        return indices
+
+    def resample( self, X, Y, ratios, seed=42, shuffle=False, one_hot=None ):
+        indices = self.indices(Y, ratios, seed=seed, shuffle=shuffle, one_hot=one_hot)
+        return np.asarray(X)[ indices ], np.asarray(Y)[ indices ]
@@ -5,10 +5,16 @@ from scipy.signal import medfilt
 
 import os
 from beatclassification.LabelsExtraction import LabelsExtraction
+from beatclassification.Resampling import Resampling
+from beatclassification import Datasets as ds
+from rpeakdetection.Record import Record
 import pywt
+from rpeakdetection.Profiler import profile
 
 
 le = LabelsExtraction()
+rs = Resampling()
+rd = Record()
 
 class FeatureExtraction:
     def __init__(self):
@@ -31,8 +37,9 @@ class FeatureExtraction:
             self.label2class[count] = classe
             count += 1
 
+    @profile('features')
     def extract(self, db_names, peaks, ann_path, features_group=['rr'], from_annot=True, left_window=70, right_window=100,
-                scale_factors=None, one_hot=False):
+                scale_factors=None, one_hot=False, return_patients=False):
         """
         :param features_group: list or numpy array containing the feature names to compute.
             available = 'rr', 'hos', 'wavelets', 'raw'
@@ -45,14 +52,17 @@ class FeatureExtraction:
         :param scale_factors: size=n_classes
             list or numpy array containing the reducing or augmenting factors for each class
         :param one_hot: whether to return labels in one hot format
+        :param return_patients: whether to return also the patient of each beat(see Datasets.patients)
         :return: features and labels arrays for the given database(train or test)
         """
         features = list()
         labels = list()
+        patients = list()
         symbols = le.extract(ann_path, from_annot=from_annot)
         for name in db_names:
             print(name)
             sig_peaks = peaks[name]
+            patient = ds.patients([name])[0]
             signal, sig_symbols = self.read_data(name, ann_path, symbols)
             rr_intervals = np.diff(sig_peaks)
             rr_mean = np.mean(rr_intervals)
@@ -81,9 +91,17 @@ class FeatureExtraction:
                         hot_lab[label] = 1
                         label = hot_lab
                     labels.append(label)
+                    patients.append(patient)
+        features = np.array(features)
+        labels = np.array(labels)
+        patients = np.array(patients)
         if scale_factors is not None:
-            features, labels = self.resample(features, labels, scale_factors=scale_factors)
-        return np.array(features), np.array(labels)
+            # the repeated beats belong to the patient of the beat they repeat
+            indices = self.resample_indices(labels, scale_factors)
+            features, labels, patients = features[indices], labels[indices], patients[indices]
+        if return_patients:
+            return features, labels, patients
+        return features, labels
 
     def rr_features(self, count, feature, rr_intervals, rr_mean):
         window = rr_intervals[count - 5: count + 5]
@@ -98,15 +116,13 @@ class FeatureExtraction:
 
     def read_data(self, name, ann_path, symbols):
         if name == '114':
-            record = wfdb.rdrecord(ann_path + name, channels=[1])
+            signal = rd.read_channel(ann_path + name, 1)
         else:
-            record = wfdb.rdrecord(ann_path + name, channels=[0])
-        signal = record.p_signal.flatten()
+            signal = rd.read_channel(ann_path + name, 0)
         # median_filter1D
         baseline = medfilt(signal, 71)
         baseline = medfilt(baseline, 215)
-        for i in range(0, len(signal)):
-            signal[i] = signal[i] - baseline[i]
+        signal -= baseline
         return signal, symbols[name]
 
     # takes a window of [-90,+90] around the Rpeak
@@ -134,25 +150,9 @@ class FeatureExtraction:
         feature.extend(fourth)
         return feature
 
-    def resample(self, X_train, Y_train, scale_factors):
-        count = 0
-        X = list()
-        Y = list()
-        for j in range(len(X_train)):
-            label = Y_train[j]
-            # undersampling
-            if scale_factors[label] < 0:
-                if count == abs(scale_factors[label]):
-                    X.append(X_train[j])
-                    Y.append(Y_train[j])
-                    count = 0
-                else:
-                    count += 1
-            # oversampling
-            else:
-                X.extend([X_train[j]]*scale_factors[label])
-                Y.extend([Y_train[j]]*scale_factors[label])
-        return X, Y
+    def resample_indices(self, Y_train, scale_factors):
+        # negative factors undersample the class, positive ones oversample it
+        return rs.indices(Y_train, rs.ratios(scale_factors), one_hot=False)
 
     def wavelets(self, qrs, feature):
         db1 = pywt.Wavelet('db1')
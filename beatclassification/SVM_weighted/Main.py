@@ -5,13 +5,11 @@ from sklearn.svm import SVC
 from sklearn.ensemble import BaggingClassifier
 import numpy as np
 from sklearn import metrics
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
-from sklearn.metrics import accuracy_score
-import matplotlib.pyplot as plt
-import scikitplot as splt
-from sklearn.metrics import f1_score
-from sklearn.model_selection import GridSearchCV
+from beatclassification.Metrics import ConfusionMatrix, macro_f1
+from beatclassification import Datasets as ds
+from rpeakdetection.ModelSelection import SuccessiveHalving
+from rpeakdetection.Profiler import profiler
+from rpeakdetection.Report import report
 import itertools
 import pickle
 ut = Utility()
@@ -19,11 +17,11 @@ fe = FeatureExtraction()
 
 
 
-train_dataset = ["101", "106", "108","109", "112", "114", "115", "116", "118", "119", "122", "124", "201", "203",
-                 "205", "207", "208", "209", "215", "220", "223", "230"]
-test_dataset = ["100", "103", "105", "111", "113", "117", "121", "123", "200", "202", "210", "212", "213","214", "219",
-                "221", "222", "228", "231", "232", "233", "234"]
+# in record order, like the folds of the previous runs
+train_dataset = sorted(ds.DS1)
+test_dataset = ds.DS2
 ann_path = 'data/ecg/mitdb/'
+classes = ['N', 'S', 'V', 'F']
 
 group_names = ['rr', 'hos', 'raw', 'wavelets']
 group_comb = list()
@@ -35,7 +33,7 @@ for i in range(len(group_names)):
 
 
 def score_func(y_true, pred):
-    return np.mean(metrics.f1_score(y_true, pred, average=None))
+    return macro_f1(y_true, pred)
 
 
 scale_factors = [-14, 4, 1, 10]
@@ -46,12 +44,16 @@ best_recall = 0
 best_f1 = 0
 Y_test = None
 best_pred = None
+best_cm = None
 best_model = None
 peaks = ut.remove_non_beat_for_all(ann_path)[0]
+# the folds are shared by all the feature groups, since they are computed on the same beats. They are folds of whole
+# patients, so that the repeated beats of a patient are never both trained and tested on
+grid_search = SuccessiveHalving(scoring=metrics.make_scorer(score_func), cv=5, n_jobs=-1, verbose=10)
 for feat_group in group_comb:
     print(feat_group)
-    X_train, Y_train = fe.extract(train_dataset,features_group=feat_group, ann_path=ann_path, peaks=peaks,
-                                  scale_factors=scale_factors,from_annot=True)
+    X_train, Y_train, patients = fe.extract(train_dataset,features_group=feat_group, ann_path=ann_path, peaks=peaks,
+                                            scale_factors=scale_factors,from_annot=True, return_patients=True)
     train = Y_train.tolist()
     weights = {q: 1/train.count(q) for q in range(0,4)}
     X_test, Y_test = fe.extract(test_dataset, features_group=feat_group, ann_path=ann_path, peaks=peaks, from_annot=True)
@@ -62,18 +64,18 @@ for feat_group in group_comb:
         'max_samples' : np.arange(0.5, 1.1, 0.1),
         'max_features': np.arange(0.5, 1.1, 0.1)
     }
-    grid_search = GridSearchCV(BaggingClassifier(), params, scoring=metrics.make_scorer(score_func),
-                           cv=5, n_jobs=-1, verbose=10)
-    grid_search.fit(X_train, Y_train)
+    grid_search.fit(BaggingClassifier(), params, X_train, Y_train, group='_'.join(feat_group), patients=patients)
     model = grid_search.best_estimator_
     print(model)
     predicted = grid_search.predict(X_test)
-    splt.metrics.plot_confusion_matrix(Y_test, predicted)
-    precision = precision_score(Y_test, predicted, average=None)
-    recall = recall_score(Y_test, predicted, average=None)
-    f1 = f1_score(Y_test, predicted, average=None)
+    cm = ConfusionMatrix(len(classes)).update(Y_test, predicted)
+    report.confusion(cm.matrix, classes, '_'.join(feat_group))
+    precision = cm.precision()
+    recall = cm.recall()
+    f1 = cm.f1()
     print(precision)
     print(recall)
+    print(cm.aami(classes))
     if np.mean(f1) > max:
         max = np.mean(f1)
         best_model = grid_search.best_estimator_
@@ -82,13 +84,16 @@ for feat_group in group_comb:
         best_f1 = f1
         best_group = feat_group
         best_pred = predicted
+        best_cm = cm
     print("best: model, precision, recall, f1, group")
     print(best_model)
     print(best_precision)
     print(best_recall)
     print(best_f1)
     print(best_group)
-splt.metrics.plot_confusion_matrix(Y_test, best_pred)
+report.confusion(best_cm.matrix, classes, 'best: ' + '_'.join(best_group))
+report.table('best: ' + '_'.join(best_group), {'Se': best_recall, '+P': best_precision, 'FPR': best_cm.fpr(),
+                                               'f1': best_f1}, classes)
 print("best: model, precision, recall, f1, group")
 print(best_model)
 print(best_precision)
@@ -97,7 +102,8 @@ print(best_f1)
 print(best_group)
 with open('ensemble.pkl', 'wb') as fid:
     pickle.dump(best_model, fid)
-plt.show()
+profiler.export('svm_weighted')
+report.render('svm_weighted')
 
 
 
@@ -1,10 +1,13 @@
 import wfdb
 import numpy as np
 from rpeakdetection.Utility import Utility
-import matplotlib.pyplot as plt
+from rpeakdetection.Record import Record
+from rpeakdetection.Report import report
+from beatclassification import Datasets as ds
 
 
 ut = Utility()
+rd = Record()
 ecg_path = 'data/ecg/mitdb/'
 class2symbols = {'N': ['N', 'L', 'R', 'e', 'j'],
                  'S': ['A', 'a', 'J', 'S'],
@@ -21,28 +24,23 @@ symbol2class = {"N": "N", "L": "N", "R": "N", "e": "N", "j": "N",
 class data_visualization():
 
     def plot_beats(self, label):
+        beats = list()
         for name in wfdb.get_record_list('mitdb'):
             print(name)
             # noinspection PyRedeclaration
-            record = wfdb.rdrecord(ecg_path + name)
-            record = np.transpose(record.p_signal)
+            record = rd.read(ecg_path + name)
             peaks, symbols = ut.remove_non_beat(ecg_path + name, False)
             s_pairs = list(filter(lambda x: x[1] == label, zip(peaks, symbols)))
             s_beats_first = [record[0][pair[0] - 70:pair[0] + 100] for pair in s_pairs]
-            if len(s_beats_first) > 0:
-                for beat in s_beats_first:
-                    plt.plot(beat)
-        plt.title(label)
-        plt.show()
+            beats.extend(s_beats_first)
+        report.lines(label, beats)
 
     def plot_beats_dataset(self, X, Y, dataset_name, label_index, one_hot=True):
         if one_hot:
             Y = list(map(lambda x : np.argmax(x), Y))
         s_pairs = list(filter(lambda x: x[1] == label_index, zip(X, Y)))
         s_beats, _ = zip(*s_pairs)
-        plt.plot(np.mean(s_beats, axis=0))
-        plt.savefig('beatclassification/beat_images/'+dataset_name+ ' average S beat.png')
-        plt.close()
+        report.lines(dataset_name + ' average S beat', [np.mean(s_beats, axis=0)])
 
     def data_distribution(self, dataset, aami):
         from collections import defaultdict
@@ -74,21 +72,13 @@ class data_visualization():
         print(len(s_wrong))
         _, _, wrong_beats = zip(*s_wrong)
         wrong_beats = list(map(lambda x: x[ -1 ], wrong_beats))
-        plt.close()
-        for beat in wrong_beats:
-            plt.plot(beat)
-        plt.title('wrong classified S beats')
-        plt.show()
-        plt.close()
+        report.lines('wrong classified S beats', wrong_beats)
 
 
 
 if __name__ == '__main__':
-    train_dataset = ['106', '112', '122', '201', '223', '230', "108", "109", "115", "116", "118", "119", "124",
-                     "205", "207", "208", "209", "215", '101', '114', '203', '220']
-    test_dataset = ["100", "103", "105", "111", "113", "117", "121", "123", "200", "202", "210", "212", "213", "214",
-                    "219",
-                    "221", "222", "228", "231", "232", "233", "234"]
+    train_dataset = ds.DS1
+    test_dataset = ds.DS2
     dv = data_visualization()
     dv.data_distribution(train_dataset)
     dv.data_distribution(test_dataset)
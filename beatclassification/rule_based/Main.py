@@ -2,9 +2,13 @@ import numpy as np
 import wfdb
 import os
 from beatclassification.rule_based.Evaluation import Evaluation
+from rpeakdetection.Record import db_fs
 
 
 class Main:
+    # sampling frequency of the RR intervals, set by find_beat_annotation from the database
+    fs = 360
+
     """
         Parameters
         ----------
@@ -17,9 +21,7 @@ class Main:
 
     """
     def time2sample(self, time):
-        # mitdb = 360
-        # incartdb = 257
-        return round(time * 360)
+        return round(time * self.fs)
 
     """
         Parameters
@@ -61,6 +63,8 @@ class Main:
     """
     def find_beat_annotation(self, rr_interval_file, patient, database, approach):
         print(patient)
+        # mitdb = 360, incartdb = 257
+        self.fs = db_fs[database]
         const1 = 1.15
         const2 = 1.8
         const3 = 1.2
@@ -0,0 +1,184 @@
+"""
+Command line entry point of the pipelines, run from the root of the repository:
+    python cli.py detect --algo pan --record data/ecg/mitdb/100
+    python cli.py evaluate --algo multilead --db incartdb --quality
+    python cli.py classify --model svm
+    python cli.py benchmark --algo pan --record data/ecg/mitdb/100
+Only the standard library is imported here: each command imports the modules it runs when it runs, so that detection
+never loads TensorFlow, sklearn or matplotlib.
+"""
+import argparse
+import os
+import runpy
+import sys
+import time
+
+ecg_dir = 'data/ecg/'
+# beat classification experiments, run as scripts
+classification_modules = {'svm': 'beatclassification.SVM_weighted.Main', 'knn': 'beatclassification.Classification',
+                          'rule': 'beatclassification.rule_based.Main'}
+
+
+def read( path, channels=None, fs=None, chunk_size=None ):
+    """
+    :param chunk_size: if given, the record is stored and memory mapped chunk by chunk(see Record.memmap)
+    :return: signal of shape (leads, samples) and its sampling frequency
+    """
+    from rpeakdetection.Record import Record
+    rd = Record()
+    if chunk_size is not None:
+        record = rd.memmap(path, channels=channels, fs=fs, chunk_size=chunk_size)
+    else:
+        record = rd.read(path, channels=channels, fs=fs)
+    return record, fs if fs is not None else rd.fs(path)
+
+
+def detector( args ):
+    """
+    :return: function(record, fs) returning the R peaks of a record of shape (leads, samples)
+    """
+    quality = None
+    if args.quality:
+        from rpeakdetection.SignalQuality import SignalQuality
+        quality = SignalQuality()
+    if args.algo == 'multilead':
+        from rpeakdetection.pan_tompkins.MultiLead import MultiLead
+        return MultiLead(args.fusion, quality=quality).detect
+    from rpeakdetection.pan_tompkins.pan import Pan
+    engine = None
+    if args.chunk_size is not None:
+        from rpeakdetection.ChunkedFilter import ChunkedFilter
+        engine = ChunkedFilter(chunk_size=args.chunk_size, out_dir=args.filter_dir)
+    pan = Pan(engine)
+
+    def detect( record, fs ):
+        mask = None
+        if quality is not None:
+            mask = quality.mask(record, fs)
+            quality.report(mask, fs)
+            mask = quality.sample_mask(mask, fs, record.shape[ 1 ])
+        return pan.pan_tompkin(record[ 0 ], fs, mask=mask)[ 1 ].astype(int)
+
+    return detect
+
+
+def channels( args ):
+    return None if args.algo == 'multilead' else [ args.channel ]
+
+
+def detect( args ):
+    import numpy as np
+    record, fs = read(args.record, channels(args), args.fs, args.chunk_size)
+    peaks = detector(args)(record, fs)
+    if args.out is not None:
+        np.savetxt(args.out, peaks, fmt='%d')
+    print('{:d} R peaks at {:d} Hz'.format(len(peaks), int(fs)))
+    return peaks
+
+
+def evaluate( args ):
+    import numpy as np
+    import wfdb
+    names = args.records if args.records else wfdb.get_record_list(args.db)
+    quality = None
+    if args.quality:
+        from rpeakdetection.SignalQuality import SignalQuality
+        quality = SignalQuality()
+    if args.algo == 'threshold':
+        from rpeakdetection.generics.peak_detector import PeakDetector
+        return PeakDetector().signals_evaluation(args.threshold, quality=quality)
+    if args.algo == 'knn':
+        from rpeakdetection.KNN.KNN import KNN
+        return KNN().rpeak_detection(names=names, quality=quality)
+    from rpeakdetection.Evaluation import Evaluation
+    from rpeakdetection.Record import ms2samples
+    rpeak = Evaluation()
+    find_peaks = detector(args)
+    scores = list()
+    for name in names:
+        path = os.path.join(ecg_dir, args.db, name)
+        record, fs = read(path, channels(args), args.fs, args.chunk_size)
+        recall, precision = rpeak.evaluate(find_peaks(record, fs), path, ms2samples(100, fs), rule_based=False, fs=fs)
+        print('{:s}, {:f}, {:f}'.format(name, recall, precision))
+        scores.append((recall, precision))
+    recall, precision = np.mean(scores, axis=0)
+    print('recall {:f}, precision {:f}'.format(recall, precision))
+    return recall, precision
+
+
+def classify( args ):
+    if args.model == 'nn':
+        from beatclassification.NN.NN import NN
+        return NN().beat_classification(model_name=args.nn_model, epochs=args.epochs, n_jobs=args.n_jobs)
+    runpy.run_module(classification_modules[ args.model ], run_name='__main__')
+
+
+def benchmark( args ):
+    import numpy as np
+    record, fs = read(args.record, channels(args), args.fs, args.chunk_size)
+    if args.algo == 'multilead':
+        from rpeakdetection.pan_tompkins.MultiLead import MultiLead
+        return MultiLead(args.fusion).benchmark(record, fs, repeats=args.repeats)
+    find_peaks = detector(args)
+    times = list()
+    for i in range(args.repeats):
+        start = time.perf_counter()
+        find_peaks(record, fs)
+        times.append(time.perf_counter() - start)
+    elapsed = np.median(times)
+    print('{:f} s, {:.0f} samples per second'.format(elapsed, record.shape[ 1 ] / elapsed))
+    return elapsed
+
+
+def parser():
+    main = argparse.ArgumentParser(description='R peak detection and beat classification')
+    main.add_argument('--profile', choices=[ 'time', 'memory' ], help='profile the stages of the command')
+    main.add_argument('--profile-dir', default='out/profile')
+    main.add_argument('--report-dir', default='out/report', help='directory of the figures of the command')
+    commands = main.add_subparsers(dest='command', required=True)
+    detection = argparse.ArgumentParser(add_help=False)
+    detection.add_argument('--algo', choices=[ 'pan', 'multilead' ], default='pan')
+    detection.add_argument('--fusion', choices=[ 'energy', 'vote' ], default='energy', help='multilead fusion')
+    detection.add_argument('--channel', type=int, default=0, help='lead of single lead detectors')
+    detection.add_argument('--fs', type=int, help='sampling frequency to resample the records to')
+    detection.add_argument('--quality', action='store_true', help='skip the windows of low signal quality')
+    detection.add_argument('--chunk-size', type=int, help='filter memory mapped records chunk by chunk')
+    detection.add_argument('--filter-dir', help='directory of the memory mapped filter outputs, deleted once read')
+    command = commands.add_parser('detect', parents=[ detection ], help='R peaks of a record')
+    command.add_argument('--record', required=True, help='record path without extension')
+    command.add_argument('--out', help='text file to write the peaks to')
+    # the detectors of the records of a database include the ones of the generic and KNN pipelines
+    command = commands.add_parser('evaluate', parents=[ detection ], conflict_handler='resolve',
+                                  help='recall and precision on a database')
+    command.add_argument('--algo', choices=[ 'pan', 'multilead', 'threshold', 'knn' ], default='pan')
+    command.add_argument('--db', choices=[ 'mitdb', 'incartdb' ], default='mitdb')
+    command.add_argument('--records', nargs='*', help='record names, all of the database by default')
+    command.add_argument('--threshold', type=float, default=0.3, help='threshold of the generic detector')
+    command = commands.add_parser('classify', help='beat classification experiments')
+    command.add_argument('--model', choices=[ 'nn' ] + sorted(classification_modules), default='nn')
+    command.add_argument('--nn-model', choices=[ 'LSTM', 'CNN' ], default='LSTM')
+    command.add_argument('--epochs', type=int, default=100)
+    command.add_argument('--n-jobs', type=int)
+    command = commands.add_parser('benchmark', parents=[ detection ], help='detection time of a record')
+    command.add_argument('--record', required=True, help='record path without extension')
+    command.add_argument('--repeats', type=int, default=3)
+    return main
+
+
+def main( argv=None ):
+    args = parser().parse_args(argv)
+    if args.profile is not None:
+        from rpeakdetection.Profiler import profiler
+        profiler.enable(memory=args.profile == 'memory')
+    result = {'detect': detect, 'evaluate': evaluate, 'classify': classify, 'benchmark': benchmark}[ args.command ](args)
+    if args.profile is not None:
+        profiler.export(args.command, out_dir=args.profile_dir)
+    # the figures collected by the command, if any
+    from rpeakdetection.Report import report
+    report.render(args.command, out_dir=args.report_dir)
+    return result
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -0,0 +1,182 @@
+import os
+import tempfile
+import numpy as np
+from scipy import signal
+
+
+class ChunkedFilter:
+    """
+    Filtering of signals longer than the memory, e.g. 24 h Holter records, along the last axis.
+    The signal, an array or a memory mapped .npy(see Record.memmap), is processed chunk_size samples at a time. Each
+    chunk is extended by a halo of the samples its outputs depend on, filtered and trimmed, so that:
+    - lfilter and convolve carry the filter state from a chunk to the next and match up to rounding
+    - medfilt reads kernel_size // 2 samples on both sides and is exact
+    - filtfilt reads the samples the impulse response takes to decay below tol on both sides and matches the whole
+      record filtering up to tol
+    The chunks containing the record edges are padded like the whole record is, so the edges match as well.
+    Outputs are written to memory mapped files in out_dir, or to arrays if out_dir is None. With chunk_size None the
+    whole record is a single chunk and the results are the ones of scipy.
+    The files in out_dir are scratch files of the engine: the caller hands back each output with release() once the
+    next stage has read it, and cleanup() deletes the ones left. A released file is unlinked at once, its mapping
+    stays readable and the disk space is freed when the last array using it is gone(POSIX semantics).
+    """
+
+    def __init__( self, chunk_size=None, out_dir=None, tol=1e-10 ):
+        """
+        :param chunk_size: samples filtered at a time, the whole signal if None
+        :param out_dir: directory of the memory mapped outputs, in memory if None
+        :param tol: relative amplitude below which the impulse response of an IIR filter is considered extinct
+        """
+        self.chunk_size = chunk_size
+        self.out_dir = out_dir
+        self.tol = tol
+        # paths of the scratch files not released yet
+        self.scratch = set()
+
+    def chunks( self, n_samples ):
+        """
+        :return: list of (start, end) of the chunks of n_samples samples
+        """
+        chunk_size = n_samples if self.chunk_size is None else self.chunk_size
+        return [ (start, min(start + chunk_size, n_samples)) for start in range(0, n_samples, max(chunk_size, 1)) ]
+
+    def output( self, shape, dtype, out=None ):
+        """
+        :param out: array or path of the .npy file to write. If None, a new file in out_dir or a new array
+        :return: array of shape and dtype the results are written to
+        """
+        if isinstance(out, str):
+            os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+            return np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape)
+        if out is not None:
+            return out
+        if self.out_dir is None:
+            return np.empty(shape, dtype=dtype)
+        os.makedirs(self.out_dir, exist_ok=True)
+        fid, path = tempfile.mkstemp(suffix='.npy', dir=self.out_dir)
+        os.close(fid)
+        self.scratch.add(os.path.abspath(path))
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def release( self, *arrays ):
+        """deletes the scratch files of arrays, the arrays not written by output() are left alone
+        """
+        for x in arrays:
+            path = getattr(x, 'filename', None)
+            path = os.path.abspath(path) if path is not None else None
+            if path in self.scratch:
+                self.scratch.discard(path)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def cleanup( self ):
+        """deletes the scratch files not released yet, e.g. after an interrupted run
+        """
+        for path in list(self.scratch):
+            if os.path.isfile(path):
+                os.remove(path)
+        self.scratch.clear()
+
+    def apply( self, function, x, halo=(0, 0), out=None, dtype=None ):
+        """
+        :param function: function(chunk) returning the filtered chunk, of the same length
+        :param halo: samples the output depends on before and after each sample
+        :param dtype: dtype of the output, the one returned by function if None
+        :return: function applied to x chunk by chunk
+        """
+        n_samples = x.shape[ -1 ]
+        for start, end in self.chunks(n_samples):
+            low = max(start - halo[ 0 ], 0)
+            high = min(end + halo[ 1 ], n_samples)
+            filtered = function(np.asarray(x[ ..., low:high ]))
+            if out is None or isinstance(out, str):
+                out = self.output(x.shape, filtered.dtype if dtype is None else dtype, out)
+            out[ ..., start:end ] = filtered[ ..., start - low:end - low ]
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+
+    def transient( self, b, a ):
+        """
+        :return: number of samples after which the impulse response of the filter b / a is below tol times its peak
+        """
+        a = np.atleast_1d(a)
+        if len(a) == 1:
+            return len(b) - 1
+        length = 1024
+        while True:
+            impulse = np.zeros(length)
+            impulse[ 0 ] = 1
+            response = np.abs(signal.lfilter(b, a, impulse))
+            above = np.flatnonzero(response > self.tol * response.max())
+            if above[ -1 ] < length // 2:
+                return int(above[ -1 ]) + 1
+            length *= 2
+
+    def filtfilt( self, b, a, x, out=None, **kwargs ):
+        """
+        :param kwargs: arguments of scipy.signal.filtfilt, e.g. padlen
+        """
+        reach = self.transient(b, a)
+        return self.apply(lambda chunk: signal.filtfilt(b, a, chunk, **kwargs), x, (reach, reach), out)
+
+    def lfilter( self, b, a, x, out=None, tail=0 ):
+        """
+        :param tail: zeros appended to x, e.g. len(b) - 1 to get a full convolution
+        :return: scipy.signal.lfilter of x, with the final state of each chunk as the initial state of the next
+        """
+        b = np.atleast_1d(b)
+        a = np.atleast_1d(a)
+        n_samples = x.shape[ -1 ]
+        state = np.zeros(x.shape[ :-1 ] + (max(len(a), len(b)) - 1,))
+        shape = x.shape[ :-1 ] + (n_samples + tail,)
+        for start, end in self.chunks(n_samples + tail):
+            chunk = np.asarray(x[ ..., start:min(end, n_samples) ])
+            if end > n_samples:
+                chunk = np.concatenate((chunk, np.zeros(x.shape[ :-1 ] + (end - max(start, n_samples),),
+                                                        dtype=chunk.dtype)), axis=-1)
+            filtered, state = signal.lfilter(b, a, chunk, zi=state)
+            if out is None or isinstance(out, str):
+                out = self.output(shape, filtered.dtype, out)
+            out[ ..., start:end ] = filtered
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+
+    def convolve( self, x, kernel, out=None ):
+        """
+        :return: full convolution of x and kernel, like np.convolve, of length x.shape[-1] + len(kernel) - 1
+        """
+        return self.lfilter(kernel, 1, x, out=out, tail=len(kernel) - 1)
+
+    def medfilt( self, x, kernel_size, out=None ):
+        """
+        :return: scipy.signal.medfilt of x along the last axis, zero padded at the edges
+        """
+        kernel = [ 1 ] * (x.ndim - 1) + [ kernel_size ]
+        half = kernel_size // 2
+        return self.apply(lambda chunk: signal.medfilt(chunk, kernel), x, (half, half), out)
+
+    def map( self, function, x, out=None, dtype=None ):
+        """
+        :param function: sample wise function, e.g. np.square. out=x writes the results in place
+        """
+        return self.apply(function, x, out=out, dtype=dtype)
+
+    def normalize( self, x, absolute=False ):
+        """
+        :return: x divided in place by the maximum, or maximum magnitude, of each lead
+        """
+        maximum = self.max(x, absolute)
+        return self.map(lambda chunk: chunk / maximum, x, out=x)
+
+    def max( self, x, absolute=False ):
+        """
+        :return: maximum, or maximum of the magnitude, of each lead, of shape x.shape[:-1] + (1,)
+        """
+        maximum = None
+        for start, end in self.chunks(x.shape[ -1 ]):
+            chunk = np.asarray(x[ ..., start:end ])
+            chunk_max = np.max(np.abs(chunk) if absolute else chunk, axis=-1, keepdims=True)
+            maximum = chunk_max if maximum is None else np.maximum(maximum, chunk_max)
+        return maximum
@@ -1,12 +1,21 @@
 from rpeakdetection.Utility import Utility
+from rpeakdetection.Record import Record
+from rpeakdetection.Profiler import profile
 
 util = Utility()
+rd = Record()
 
 
 class Evaluation:
 
-    def evaluate(self, rpeaks, name, evaluation_width, rule_based, test_index=None):
+    @profile('evaluate')
+    def evaluate(self, rpeaks, name, evaluation_width, rule_based, test_index=None, fs=None):
+        '''
+        :param fs: sampling frequency of rpeaks, test_index and evaluation_width, if not the one of the record
+        '''
         real_locations = util.remove_non_beat(name, rule_based)[0]
+        if fs is not None:
+            real_locations = rd.rescale(real_locations, rd.fs(name), fs).tolist()
         if test_index is not None:
             real_locations = list(filter(lambda x: x >= test_index, real_locations))
         window_size = int(evaluation_width / 2)
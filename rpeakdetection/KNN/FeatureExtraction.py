@@ -3,10 +3,26 @@ from scipy import signal
 import numpy as np
 from scipy.interpolate import interp1d
 import pickle
+from rpeakdetection.Record import Record, ms2samples
+from rpeakdetection.ChunkedFilter import ChunkedFilter
+from rpeakdetection.Profiler import profile
+
+rd = Record()
 
 class FeatureExtraction:
 
-    def extract_features(self,name, path, rpeak_locations, features_comb, window_size=None):
+    def __init__(self, engine=None):
+        '''
+        :param engine: ChunkedFilter running the filters, e.g. chunk by chunk on a memory mapped Holter record. By
+            default the whole record is filtered at once
+        '''
+        self.engine = engine if engine is not None else ChunkedFilter()
+
+    def extract_features(self,name, path, rpeak_locations, features_comb, window_size=None, fs=360):
+        '''
+        :param rpeak_locations: peaks, as samples at fs
+        :param fs: sampling frequency the record is read at, resampling it if needed
+        '''
         if 'KNN_w' in features_comb:
             window_size = window_size
         else:
@@ -19,19 +35,23 @@ class FeatureExtraction:
             channels = [0, 1]
         filtered = 'FS' in features_comb
         print("Extracting features for signal " + path + "...")
-        record = self.preprocess(channels, name, path)
+        record = self.preprocess(channels, name, path, fs)
         features_path = 'rpeakdetection/KNN/features/'
         if filtered:
             filtered_record = list()
             for i in range(len(channels)):
-                filtered_channel = self.filter(record[i], features_comb)
+                filtered_channel = self.filter(record[i], features_comb, fs)
                 filtered_record.append(filtered_channel)
             record = filtered_record
         comb_name = features_comb[0] + '_' + features_comb[1] + '_' + features_comb[2]
         feat_name = features_path + name + '_' + comb_name + '.pkl'
         labels_name = features_path + name + '_' + comb_name + '_labels.pkl'
         #if write:
-        features, labels = self.compute_features(record, rpeak_locations, comb=features_comb,window_size=window_size)
+        features, labels = self.compute_features(record, rpeak_locations, comb=features_comb,window_size=window_size,
+                                                 fs=fs)
+        if filtered:
+            # the filtered channels stay mapped, only their scratch files are deleted
+            self.engine.release(*record)
             #with open(feat_name, 'wb') as fid:
             #    pickle.dump(features, fid)
             #with open(labels_name, 'wb') as fid:
@@ -41,41 +61,46 @@ class FeatureExtraction:
             labels = pickle.load(open(labels_name, 'rb'))'''
         return record, features, labels
 
-    def preprocess(self, channels, name, path):
+    def preprocess(self, channels, name, path, fs=360):
         if name == '114':
             if channels == [[0]]:
-                record = wfdb.rdrecord(path, channels=[1])
+                record = rd.read(path, channels=[1], fs=fs)
             elif channels == [[1]]:
-                record = wfdb.rdrecord(path, channels=[0])
+                record = rd.read(path, channels=[0], fs=fs)
             else:
-                record = wfdb.rdrecord(path, channels=channels)
+                record = rd.read(path, channels=channels, fs=fs)
         else:
-            record = wfdb.rdrecord(path, channels=channels)
-        record = np.transpose(record.p_signal)
+            record = rd.read(path, channels=channels, fs=fs)
         return record
 
-    def compute_features(self, record, rpeak_locations,comb, window_size):
-        sig_len = len(record[0])
+    @profile('features')
+    def compute_features(self, record, rpeak_locations,comb, window_size, fs=360):
         n_channels = len(record)
-        n_regions = int(sig_len / window_size)
+        n_regions = len(record[0]) // window_size
+        # the samples after the last whole region are dropped
+        sig_len = n_regions * window_size
+        record = np.asarray(record)[:, :sig_len]
         # split record in regions of size window_size. If more then 1 channel, concatenates the regions
         features = np.concatenate(np.reshape(record,(n_channels,n_regions,window_size)), axis=1)
+        peaks = np.asarray(rpeak_locations, dtype=np.int64)
         if 'KNN_w' in comb:
-            indexes = np.split(np.arange(sig_len), n_regions)
-            labels = list(map(lambda x: int(len(set(x).intersection(set(rpeak_locations)))!=0), indexes))
+            # a region is labelled 1 if it contains at least one peak
+            peaks = peaks[(peaks >= 0) & (peaks < sig_len)]
+            labels = np.minimum(np.bincount(peaks // window_size, minlength=n_regions), 1).astype(np.int8)
         else:
-            half_qrs_width = 18
-            labels = np.zeros(sig_len, dtype=np.int8)
-            for peak in rpeak_locations:
-                for q in range(peak-half_qrs_width, peak+half_qrs_width):
-                    # avoids underflow and overflow
-                    if 0 <= q < sig_len:
-                        labels[q] = 1
+            # 18 samples at 360 Hz
+            half_qrs_width = ms2samples(50, fs)
+            # every sample in [peak - half_qrs_width, peak + half_qrs_width) is labelled 1: the intervals are marked
+            # in a difference array and dilated by its cumulative sum
+            bounds = np.zeros(sig_len + 1, dtype=np.int32)
+            np.add.at(bounds, np.clip(peaks - half_qrs_width, 0, sig_len), 1)
+            np.add.at(bounds, np.clip(peaks + half_qrs_width, 0, sig_len), -1)
+            labels = (np.cumsum(bounds[:sig_len]) > 0).astype(np.int8)
         return features, labels
 
 
-    def filter(self, record, comb):
-        fs = 360
+    @profile('filter')
+    def filter(self, record, comb, fs=360):
         # cutoff low frequency to get rid of baseline wonder
         f1 = 5
         # cutoff frequency to discard high frequency noise
@@ -85,23 +110,26 @@ class FeatureExtraction:
         # bandpass
         [a, b] = signal.butter(N, Wn, 'band')
         # filtering
-        filtered = signal.filtfilt(a, b, record)
+        filtered = self.engine.filtfilt(a, b, record)
         if 'KNN_s' in comb:
-            ecg_d = [0]
-            diff = np.diff(filtered)
-            ecg_d.extend(diff)
-            return ecg_d
+            # first difference, 0 for the first sample. Each chunk reads the last sample of the previous one
+            diff = self.engine.apply(lambda chunk: np.diff(chunk, prepend=chunk[..., :1]), filtered, halo=(1, 0),
+                                     dtype=record.dtype)
+            self.engine.release(filtered)
+            return diff
         else:
             vector = [1, 2, 0, -2, -1]
             int_c = 160 / fs
             # 5.1 since in signal 100 we must include 5
             b = interp1d(range(1, 6), [i * fs / 8 for i in vector])(np.arange(1, 5.1, int_c))
-            ecg_d = signal.filtfilt(b, 1, filtered)
+            ecg_d = self.engine.filtfilt(b, 1, filtered)
+            self.engine.release(filtered)
             # print(ecg_d[:5])
-            ecg_d = ecg_d / np.max(ecg_d)
+            ecg_d = self.engine.normalize(ecg_d)
             ''' Squaring nonlinearly enhance the dominant peaks '''
-            ecg_s = ecg_d ** 2
-            return ecg_s
+            squared = self.engine.map(np.square, ecg_d, dtype=record.dtype)
+            self.engine.release(ecg_d)
+            return squared
 
 
 
@@ -1,5 +1,4 @@
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.model_selection import GridSearchCV
+from rpeakdetection.ModelSelection import NeighborGridSearch
 from sklearn import metrics
 import numpy as np
 import pickle
@@ -7,45 +6,40 @@ import time
 
 class GridSearch:
 
-    def predict(self, X_train, X_test, y_train, name, comb):
-        classifier = KNeighborsClassifier()
+    def fit(self, X_train, y_train):
+        '''
+        :return: best parameters and best classifier, fitted on all of X_train
+        '''
         parameters = {
             'n_neighbors': np.arange(1,21, 2),
             'weights': ['uniform','distance'],
         }
-
-        grid_search = GridSearchCV(classifier,
-                                   parameters,
-                                   scoring=metrics.make_scorer(metrics.f1_score),
-                                   cv=5,
-                                   n_jobs=-1,
-                                   verbose=0)
+        # one neighbor search per fold for all the candidates
+        grid_search = NeighborGridSearch(metrics.f1_score, cv=5, n_jobs=-1)
         print("training")
-        grid_search.fit(X_train, y_train)
-        best_classifier = grid_search.best_estimator_
-        classifiers_path = 'rpeakdetection/KNN/classifiers/'
-        comb_name = comb[0] + '_' + comb[1] + '_' + comb[2]
-        class_name = classifiers_path + name + '_' + comb_name + '.pkl'
-        with open(class_name, 'wb') as fid:
-            pickle.dump(best_classifier, fid)
+        grid_search.fit(X_train, y_train, **parameters)
+        return grid_search.best_params_, grid_search.best_estimator_
+
+    def predict(self, X_train, X_test, y_train, key, train_fraction, cache):
+        '''
+        :param key: key of the per patient model in cache(see ModelCache.key)
+        :param cache: ModelCache the model is reloaded from, or extended, instead of being trained again
+        '''
+        best_classifier = cache.model(key, train_fraction, X_train, y_train, self.fit)
         start_time = time.time()
-        predicted = grid_search.predict(X_test)
+        predicted = best_classifier.predict(X_test)
         return start_time, predicted
 
     def SSK_train(self, X_train, y_train, comb):
-        classifier = KNeighborsClassifier()
         parameters = {
             'n_neighbors': np.arange(1, 11, 2),
+            'weights': ['uniform'],
             'p': [1, 2, 3],
         }
-        grid_search = GridSearchCV(classifier,
-                                   parameters,
-                                   scoring=metrics.make_scorer(metrics.accuracy_score),
-                                   cv=5,
-                                   n_jobs=-1,
-                                   verbose=0)
+        # one neighbor search per fold and p
+        grid_search = NeighborGridSearch(metrics.accuracy_score, cv=5, n_jobs=-1)
         print("training")
-        grid_search.fit(X_train, y_train)
+        grid_search.fit(X_train, y_train, **parameters)
         class_name = 'rpeakdetection/KNN/classifiers/SSK_'+comb[1]+'_'+comb[2]+'.pkl'
         best_classifier = grid_search.best_estimator_
         with open(class_name, 'wb') as fid:
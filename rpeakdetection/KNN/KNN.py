@@ -1,34 +1,44 @@
 import wfdb
 import numpy as np
 from rpeakdetection.KNN.GridSearch import GridSearch
+from rpeakdetection.KNN.ModelCache import ModelCache
 from rpeakdetection.KNN.FeatureExtraction import FeatureExtraction
 from rpeakdetection.Evaluation import Evaluation
 from rpeakdetection.Utility import Utility
-import matplotlib.pyplot as plt
-import pickle
+from rpeakdetection.Record import Record, ms2samples
 import itertools
 from collections import defaultdict
 from sklearn.model_selection import train_test_split
 import time
-import math
+from rpeakdetection.Profiler import profile, profiler
+from rpeakdetection.Report import report
 ut = Utility()
 eval = Evaluation()
 fe = FeatureExtraction()
 gs = GridSearch()
+rd = Record()
+cache = ModelCache()
 
 
 class KNN:
 
     DB = "mitdb"
+    # sampling frequency the records are read at, resampling them if needed
+    FS = 360
     # names = ['103', '115', '222', '203', '108', '113', '209', '212', '123', '214', '114', '109', '124', '105', '231', '100', '230', '201', '106', '111', '202', '107', '232', '112', '213', '101', '102', '104', '205', '200', '116', '233', '220', '210', '207', '228', '119', '221', '117', '122', '219', '234', '118', '223', '208', '121', '215', '217']
 
-    def rpeak_detection(self, window_size=None, test_size=None, names=None, combinations=None):
+    def rpeak_detection(self, window_size=None, test_size=None, names=None, combinations=None, quality=None):
+        '''
+        :param quality: SignalQuality. If given, the regions in unusable windows of the test records are not
+            classified and no peak is detected there
+        '''
         if window_size is None:
             window_size = 50
         if test_size is None:
             test_size = 0.97
-        min_dist = 72
-        evaluation_window_size = 36
+        # refractory period of 200 ms and evaluation window of 100 ms, 72 and 36 samples at 360 Hz
+        min_dist = ms2samples(200, self.FS)
+        evaluation_window_size = ms2samples(100, self.FS)
         approach_f = ['KNN_s', 'KNN_w']
         channels_f = ['1', '2', '12']
         filtered_f = ['FS', 'RS']
@@ -41,37 +51,34 @@ class KNN:
             print(comb)
             if 'KNN_w' in comb:
                 precisions, recalls, times = self.QRS_KNN(comb, min_dist, names, test_size, window_size,
-                                                          evaluation_window_size)
+                                                          evaluation_window_size, quality)
             else:
-                precisions, recalls, times = self.SSK(comb, names, evaluation_window_size)
+                precisions, recalls, times = self.SSK(comb, names, evaluation_window_size, quality)
             comb_name = comb[0] + '_' + comb[1] + '_' + comb[2]
             results[comb_name] = [np.mean(precisions), np.mean(recalls), np.mean(times)]
             print("{:s}, {:f}, {:f}, {:f}".format(comb_name, np.mean(precisions), np.mean(recalls), np.mean(times)))
         print(results)
         return results
 
-    def QRS_KNN(self, comb, min_dist, names, test_size, window_size, evaluation_window_size):
+    def QRS_KNN(self, comb, min_dist, names, test_size, window_size, evaluation_window_size, quality=None):
         recalls = list()
         precisions = list()
         times = list()
         for name in names:
             path = ("data/ecg/" + self.DB + "/" + name)
-            rpeak_locations = ut.remove_non_beat(path, rule_based=False)[0]
+            rpeak_locations = rd.rescale(ut.remove_non_beat(path, rule_based=False)[0], rd.fs(path), self.FS)
             record, X, Y = fe.extract_features(name=name, path=path, rpeak_locations=rpeak_locations,
-                                               features_comb=comb, window_size=window_size)
+                                               features_comb=comb, window_size=window_size, fs=self.FS)
             X_train, X_test, y_train, y_test = train_test_split(X, Y, shuffle=False,
                                                                     test_size=test_size)
-            #if train:
-            self.start_time, predicted = gs.predict(X_train, X_test, y_train, name, comb)
-            '''else:
-                class_name = comb[0] + '_' + comb[1] + '_' + comb[2]
-                loaded_model = pickle.load(
-                    open('rpeakdetection/KNN/classifiers/' + name + '_' + class_name + '.pkl', 'rb'))
-                self.start_time = time.time()
-                predicted = loaded_model.predict(X_test)'''
             test_index = len(X_train) * window_size
+            usable = self.usable(quality, path, name, window_size, len(X_test), test_index)
+            # reloaded, or extended from a smaller train fraction, if an earlier run trained it
+            key = cache.key(path, comb, window_size, self.FS)
+            self.start_time, predicted = gs.predict(X_train, X_test[usable], y_train, key, 1 - test_size, cache)
+            predicted = self.fill(predicted, usable)
             elapsed_time, peaks = self.get_peaks(predicted, window_size, record, test_index, min_dist)
-            recall, precision = eval.evaluate(peaks, path, evaluation_window_size, False, test_index)
+            recall, precision = eval.evaluate(peaks, path, evaluation_window_size, False, test_index, fs=self.FS)
             print(recall)
             print(precision)
             recalls.append(recall)
@@ -79,6 +86,28 @@ class KNN:
             times.append(elapsed_time)
         return precisions, recalls, times
 
+    def usable(self, quality, path, name, region_size, n_regions, start=0):
+        '''
+        :param quality: SignalQuality, or None
+        :return: boolean mask of the regions of region_size samples, from start, made only of usable samples. Every
+            region is usable if quality is None
+        '''
+        if quality is None:
+            return np.ones(n_regions, dtype=bool)
+        # all the leads, before any filtering
+        mask = quality.mask(rd.read(path, fs=self.FS), self.FS)
+        quality.report(mask, self.FS, name)
+        return quality.region_mask(mask, self.FS, region_size, n_regions, start)
+
+    def fill(self, predicted, usable):
+        '''
+        :return: labels of all the regions, the ones of the unusable regions are 0
+        '''
+        labels = np.zeros(len(usable), dtype=np.asarray(predicted).dtype)
+        labels[usable] = predicted
+        return labels
+
+    @profile('postprocess')
     def get_sample_peaks(self, predicted, record):
         predicted = np.where(predicted == 1)
         prev = 0
@@ -101,6 +130,7 @@ class KNN:
         peaks = [np.argmax(np.abs(signal[region[0]:region[-1]])) + region[0] for region in filtered_regions]
         return peaks
 
+    @profile('postprocess')
     def get_peaks(self, predicted_regions, window_size, record, test_index, min_dist):
         # we use always the first channel for taking the maximum in the qrs region
         signal = record[0]
@@ -121,15 +151,16 @@ class KNN:
         elapsed_time = elapsed_time/len(signal)
         return elapsed_time, Y_predicted
 
-    def SSK(self, comb, names, evaluation_window_size):
+    def SSK(self, comb, names, evaluation_window_size, quality=None):
         precisions= list()
         recalls = list()
         times = list()
         # training is performed on the whole signal 100
         train_path = ("data/ecg/" + self.DB + "/100")
-        train_rpeak_locations = ut.remove_non_beat(train_path, rule_based=False)[0]
+        train_rpeak_locations = rd.rescale(ut.remove_non_beat(train_path, rule_based=False)[0], rd.fs(train_path),
+                                           self.FS)
         record, X_train, y_train = fe.extract_features(name='100', path=train_path, rpeak_locations=train_rpeak_locations,
-                                           features_comb=comb)
+                                           features_comb=comb, fs=self.FS)
         #if train:
         model = gs.SSK_train(X_train, y_train, comb)
         #else:
@@ -137,16 +168,18 @@ class KNN:
         # testing is performed on all the other signals
         for name in names[1:]:
             path = ("data/ecg/" + self.DB +'/'+ name)
-            rpeak_locations = ut.remove_non_beat(path, rule_based=False)[0]
+            rpeak_locations = rd.rescale(ut.remove_non_beat(path, rule_based=False)[0], rd.fs(path), self.FS)
             record, X_test, Y_test = fe.extract_features(name=name, path=path, rpeak_locations=rpeak_locations,
-                                                 features_comb=comb)
+                                                 features_comb=comb, fs=self.FS)
+            usable = self.usable(quality, path, name, 1, len(X_test))
             start_time = time.time()
-            predicted = model.predict(X_test)
+            with profiler.span('predict', 'KNN.SSK'):
+                predicted = self.fill(model.predict(X_test[usable]), usable)
             print(sum(predicted))
             peaks = self.get_sample_peaks(predicted, record)
             elapsed_time = time.time() - start_time
             elapsed_time = elapsed_time / len(record[0])
-            recall, precision = eval.evaluate(peaks, path, evaluation_window_size, False)
+            recall, precision = eval.evaluate(peaks, path, evaluation_window_size, False, fs=self.FS)
             print(recall)
             print(precision)
             recalls.append(recall)
@@ -164,14 +197,9 @@ class KNN:
             precision, recall, times = result[comb_name]
             precisions.append(precision)
             recalls.append(recall)
-        plt.plot(sizes, precisions, label='precision')
-        plt.plot(sizes, recalls, label='recall')
-        plt.xlabel('window size(samples)')
-        plt.ylabel('score')
         best_size = sizes[int(np.argmax([x+y for x,y in zip(precisions, recalls)]))]
-        plt.plot([best_size, best_size], [0,1])
-        plt.legend()
-        plt.savefig('window_size_pr.png')
+        report.curve('window_size_pr', sizes, {'precision': precisions, 'recall': recalls},
+                     xlabel='window size(samples)', ylabel='score', vlines=[best_size])
 
     def compare_test_size(self, sizes):
         combinations = [['KNN_w'], ['1'], ['FS']]
@@ -184,12 +212,8 @@ class KNN:
             precisions.append(precision)
             recalls.append(recall)
         train_sizes=[int((1-s)*100) for s in sizes]
-        plt.plot(train_sizes, precisions, label='precision')
-        plt.plot(train_sizes, recalls, label='recall')
-        plt.xlabel('training size %')
-        plt.ylabel('score')
-        plt.legend()
-        plt.savefig('training_size_pr.png')
+        report.curve('training_size_pr', train_sizes, {'precision': precisions, 'recall': recalls},
+                     xlabel='training size %', ylabel='score')
 
 
 
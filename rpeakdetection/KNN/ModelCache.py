@@ -0,0 +1,97 @@
+import glob
+import hashlib
+import os
+import pickle
+from sklearn.base import clone
+
+# files a record is made of, the annotations give the labels of the windows
+record_extensions = ('.hea', '.dat', '.atr')
+
+
+class ModelCache:
+    """
+    Per patient models of KNN.QRS_KNN, stored in cache_dir so that repeated runs reload them instead of training them
+    again. A model is keyed by the content hash of its record files, the features combination, the window size, the
+    sampling frequency and the train fraction:
+    - a model with the same key is reloaded
+    - if only the train fraction grew, the model with the largest smaller fraction is extended: its training set is
+      a prefix of the new one(the windows are split in time order), so the new windows are added to it and the
+      neighbors refitted with the parameters already selected, without a new grid search
+    - otherwise the model is trained from scratch
+    """
+
+    def __init__( self, cache_dir='rpeakdetection/KNN/classifiers/', enabled=True ):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.hashes = dict()
+
+    def content_hash( self, path ):
+        """
+        :param path: record path without extension
+        :return: sha1 of the record files, computed once per path
+        """
+        if path not in self.hashes:
+            digest = hashlib.sha1()
+            for extension in record_extensions:
+                if os.path.isfile(path + extension):
+                    with open(path + extension, 'rb') as fid:
+                        for block in iter(lambda: fid.read(2 ** 20), b''):
+                            digest.update(block)
+            self.hashes[ path ] = digest.hexdigest()
+        return self.hashes[ path ]
+
+    def key( self, path, comb, window_size, fs ):
+        """
+        :return: key of the models of the record at path, for every train fraction
+        """
+        return '_'.join([ os.path.basename(path) ] + list(comb) +
+                        [ 'w' + str(window_size), 'fs' + str(fs), self.content_hash(path)[ :16 ] ])
+
+    def path( self, key, train_fraction ):
+        return os.path.join(self.cache_dir, key + '_t{:.4f}.pkl'.format(train_fraction))
+
+    def entries( self, key ):
+        """
+        :return: dict[train fraction, path] of the cached models of key
+        """
+        paths = glob.glob(os.path.join(glob.escape(self.cache_dir), glob.escape(key) + '_t*.pkl'))
+        return {float(path[ len(os.path.join(self.cache_dir, key)) + 2:-len('.pkl') ]): path for path in paths}
+
+    def load( self, path ):
+        with open(path, 'rb') as fid:
+            return pickle.load(fid)
+
+    def store( self, key, train_fraction, entry ):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key, train_fraction)
+        # written aside and renamed, so that an interrupted run never leaves a truncated model
+        with open(path + '.tmp', 'wb') as fid:
+            pickle.dump(entry, fid)
+        os.replace(path + '.tmp', path)
+
+    def model( self, key, train_fraction, X_train, y_train, train ):
+        """
+        :param X_train: training windows, in time order
+        :param train: function(X_train, y_train) returning the selected parameters and the fitted model, called when
+            no smaller model can be extended
+        :return: fitted model of the windows X_train
+        """
+        if not self.enabled:
+            return train(X_train, y_train)[ 1 ]
+        entries = self.entries(key)
+        exact = [ fraction for fraction in entries if abs(fraction - train_fraction) < 1e-4 ]
+        if len(exact) > 0:
+            entry = self.load(entries[ exact[ 0 ] ])
+            if entry[ 'n_train' ] == len(X_train):
+                print('reloaded ' + key)
+                return entry[ 'model' ]
+        smaller = [ fraction for fraction in entries if fraction < train_fraction - 1e-4 ]
+        entry = self.load(entries[ max(smaller) ]) if len(smaller) > 0 else None
+        if entry is not None and entry[ 'n_train' ] <= len(X_train):
+            print('extended {:s} from {:d} to {:d} windows'.format(key, entry[ 'n_train' ], len(X_train)))
+            params = entry[ 'params' ]
+            model = clone(entry[ 'model' ]).fit(X_train, y_train)
+        else:
+            params, model = train(X_train, y_train)
+        self.store(key, train_fraction, {'params': params, 'model': model, 'n_train': len(X_train)})
+        return model
@@ -0,0 +1,354 @@
+import hashlib
+import itertools
+import math
+import numbers
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+from sklearn.neighbors import KNeighborsClassifier, NearestNeighbors
+from rpeakdetection.Profiler import profile, profiler
+
+
+@profile('train')
+def fit_and_score( estimator, params, X, Y, train, test, scoring ):
+    """
+    :return: score of the estimator with params fitted on the train rows, -inf if they are fewer than its neighbors
+    """
+    if len(train) < n_neighbors(params):
+        return -np.inf
+    model = clone(estimator).set_params(**params)
+    model.fit(X[ train ], Y[ train ])
+    return scoring(model, X[ test ], Y[ test ])
+
+
+def same( a, b ):
+    """
+    :return: whether the arrays a and b, or None, are equal
+    """
+    if a is None or b is None:
+        return a is None and b is None
+    return len(a) == len(np.asarray(b)) and np.array_equal(a, b)
+
+
+def n_neighbors( params ):
+    """
+    :return: largest number of neighbors set by params, e.g. n_neighbors or knn__n_neighbors in a pipeline, 0 if none
+    """
+    return max([ value for name, value in params.items() if name.split('__')[ -1 ] == 'n_neighbors' and
+                 isinstance(value, numbers.Integral) ], default=0)
+
+
+def fingerprint( X ):
+    """
+    :return: sha1 of the shape, dtype and values of X
+    """
+    X = np.ascontiguousarray(X)
+    digest = hashlib.sha1(repr((X.shape, X.dtype.str)).encode())
+    digest.update(X.view(np.uint8).reshape(-1) if X.size > 0 else b'')
+    return digest.hexdigest()
+
+
+def params_key( params ):
+    # estimators are not hashable, their repr identifies them
+    return tuple((name, repr(params[ name ])) for name in sorted(params))
+
+
+class PatientKFold:
+    """
+    k folds of whole patients: all the beats of a patient are in the same test fold, so that no model is tested on a
+    patient it was trained on, unlike a k-fold over the beats. Patients are assigned, the ones with more beats first, to
+    the fold with fewer beats, so that the folds have about the same size. The fold indexes are computed once per
+    patients array.
+    Exposes split and get_n_splits, so it can be passed as cv to sklearn.
+    """
+
+    def __init__( self, n_splits=5 ):
+        self.n_splits = n_splits
+        self.patients = None
+        self.fold_index = None
+
+    def folds( self, patients ):
+        """
+        :param patients: patient of each beat, e.g. from Datasets.beat_patients
+        :return: list of (train, test) indexes. Recomputed only when patients changes
+        """
+        patients = np.asarray(patients)
+        if self.patients is not None and same(self.patients, patients):
+            return self.fold_index
+        names, inverse, counts = np.unique(patients, return_inverse=True, return_counts=True)
+        if len(names) < self.n_splits:
+            raise ValueError('{:d} patients cannot be split in {:d} folds'.format(len(names), self.n_splits))
+        patient_fold = np.empty(len(names), dtype=np.int64)
+        sizes = np.zeros(self.n_splits, dtype=np.int64)
+        for patient in np.argsort(-counts, kind='stable'):
+            patient_fold[ patient ] = np.argmin(sizes)
+            sizes[ patient_fold[ patient ] ] += counts[ patient ]
+        beat_fold = patient_fold[ inverse ]
+        self.fold_index = [ (np.flatnonzero(beat_fold != fold), np.flatnonzero(beat_fold == fold))
+                            for fold in range(self.n_splits) ]
+        self.patients = patients.copy()
+        return self.fold_index
+
+    def split( self, X=None, Y=None, groups=None ):
+        return iter(self.folds(groups))
+
+    def get_n_splits( self, X=None, Y=None, groups=None ):
+        return self.n_splits
+
+
+class SuccessiveHalving:
+    """
+    Grid search by successive halving over the training rows. All the candidates are cross validated on a small
+    subsample of each training fold, the best 1/factor are kept and evaluated on factor times more rows, and so on
+    until the last rung, which uses the whole folds. Test folds are always scored whole.
+    The folds are computed once and shared by every search with the same labels, e.g. the feature groups of a
+    dataset, and the score of each (features, estimator, params, fold, rows) is cached, so a candidate is never
+    fitted twice on the same data. The subsamples are prefixes of a stratified order of each fold, so they are nested
+    and keep the class proportions.
+    Exposes best_params_, best_score_, best_estimator_ and predict like GridSearchCV.
+    """
+
+    def __init__( self, scoring, cv=5, factor=3, min_resources=None, n_jobs=-1, seed=42, verbose=1 ):
+        """
+        :param scoring: scorer(estimator, X, y), e.g. built with metrics.make_scorer
+        :param cv: number of folds, stratified or of patients
+        :param factor: ratio between the rows, and between the candidates, of consecutive rungs
+        :param min_resources: rows of each training fold in the first rung. Defaults to the size that makes the last
+            rung use the whole folds. Never below the largest n_neighbors of the grid
+        """
+        self.scoring = scoring
+        self.cv = cv
+        self.factor = factor
+        self.min_resources = min_resources
+        self.n_jobs = n_jobs
+        self.seed = seed
+        self.verbose = verbose
+        self.cache = dict()
+        self.fold_index = None
+        self.labels = None
+        self.patients = None
+        self.n_fits = 0
+
+    def folds( self, Y, patients=None ):
+        """
+        :param patients: patient of each row. If given, the folds are PatientKFold folds, otherwise stratified
+        :return: list of (train, test) indexes, train in stratified order. Recomputed only when Y or patients change
+        """
+        Y = np.asarray(Y)
+        if self.labels is not None and len(self.labels) == len(Y) and np.array_equal(self.labels, Y) and \
+                same(self.patients, patients):
+            return self.fold_index
+        rng = np.random.RandomState(self.seed)
+        fold_index = list()
+        if patients is not None:
+            splits = PatientKFold(self.cv).folds(patients)
+        else:
+            splits = StratifiedKFold(self.cv, shuffle=True, random_state=self.seed).split(np.zeros(len(Y)), Y)
+        for train, test in splits:
+            train = train[ rng.permutation(len(train)) ]
+            # rank of each row inside its class, relative to the class size: any prefix of the sorted rows is
+            # stratified
+            _, inverse, counts = np.unique(Y[ train ], return_inverse=True, return_counts=True)
+            rank = np.empty(len(train))
+            for label in range(len(counts)):
+                rank[ inverse == label ] = np.arange(counts[ label ]) / counts[ label ]
+            fold_index.append((train[ np.argsort(rank, kind='stable') ], test))
+        self.labels = Y.copy()
+        self.patients = None if patients is None else np.array(patients)
+        self.fold_index = fold_index
+        # cached scores refer to the previous folds
+        self.cache = dict()
+        return fold_index
+
+    @profile('train')
+    def fit( self, estimator, param_grid, X, Y, group=None, patients=None ):
+        """
+        :param param_grid: dict[parameter name, list of values]
+        :param group: name of the features X is made of. The scores are cached by group, estimator and content of X,
+            so that a search on other features or with another estimator never reuses them
+        :param patients: patient of each row, to cross validate over patients instead of rows
+        :return: self, with best_estimator_ refitted on all the rows
+        """
+        X = np.asarray(X)
+        Y = np.asarray(Y)
+        fold_index = self.folds(Y, patients)
+        data_key = (group, type(estimator).__qualname__, params_key(estimator.get_params()), fingerprint(X))
+        names = sorted(param_grid)
+        candidates = [ dict(zip(names, values)) for values in
+                       itertools.product(*[ param_grid[ name ] for name in names ]) ]
+        max_resources = min(len(train) for train, _ in fold_index)
+        n_rungs = max(int(math.ceil(math.log(len(candidates), self.factor))), 0) + 1
+        min_resources = self.min_resources
+        if min_resources is None:
+            min_resources = max_resources // self.factor ** (n_rungs - 1)
+        # every rung needs some rows of each class, and as many rows as the neighbors of every candidate
+        min_resources = max(min_resources, 2 * len(np.unique(Y)), max(n_neighbors(params) for params in candidates))
+        self.results_ = list()
+        for rung in range(n_rungs):
+            n_resources = min(min_resources * self.factor ** rung, max_resources)
+            if rung == n_rungs - 1:
+                n_resources = max_resources
+            scores = self.cross_validate(estimator, candidates, X, Y, fold_index, n_resources, data_key)
+            for params, score in zip(candidates, scores):
+                self.results_.append({'rung': rung, 'n_resources': n_resources, 'params': params, 'score': score})
+            if self.verbose:
+                print('rung {:d}: {:d} candidates on {:d} rows, best {:f}'.format(rung, len(candidates), n_resources,
+                                                                                 np.max(scores)))
+            if rung < n_rungs - 1:
+                n_kept = max(int(math.ceil(len(candidates) / self.factor)), 1)
+                # stable, so that ties keep the grid order like GridSearchCV
+                order = np.argsort(-np.asarray(scores), kind='stable')[ :n_kept ]
+                candidates = [ candidates[ i ] for i in sorted(order) ]
+        best = int(np.argmax(scores))
+        self.best_params_ = candidates[ best ]
+        self.best_score_ = scores[ best ]
+        self.best_estimator_ = clone(estimator).set_params(**self.best_params_).fit(X, Y)
+        return self
+
+    def cross_validate( self, estimator, candidates, X, Y, fold_index, n_resources, group ):
+        """
+        :param group: key of the features and of the estimator in the score cache
+        :return: mean score over the folds of each candidate, fitted on the first n_resources rows of each fold
+        """
+        keys = [ (group, params_key(params), fold, n_resources) for params in candidates
+                 for fold in range(len(fold_index)) ]
+        missing = [ (params, fold) for params in candidates for fold in range(len(fold_index))
+                    if (group, params_key(params), fold, n_resources) not in self.cache ]
+        fitted = Parallel(n_jobs=self.n_jobs)(
+            delayed(profiler.remote(fit_and_score))(estimator, params, X, Y, fold_index[ fold ][ 0 ][ :n_resources ],
+                                   fold_index[ fold ][ 1 ], self.scoring) for params, fold in missing)
+        self.n_fits += len(missing)
+        for (params, fold), output in zip(missing, fitted):
+            self.cache[ (group, params_key(params), fold, n_resources) ] = profiler.merged(output)
+        scores = np.array([ self.cache[ key ] for key in keys ]).reshape(len(candidates), len(fold_index))
+        return scores.mean(axis=1)
+
+    @profile('predict')
+    def predict( self, X ):
+        return self.best_estimator_.predict(X)
+
+
+class NeighborGridSearch:
+    """
+    Exhaustive cross validation of KNeighborsClassifier over n_neighbors and weights from a single neighbor search
+    per fold: the max(n_neighbors) nearest training rows of every validation row are computed once, the votes of all
+    the k and weights are read from that table. The table of the test rows is computed once as well and reused by
+    every prediction on them. Votes and ties are resolved like KNeighborsClassifier.
+    Exposes best_params_, best_score_, best_estimator_ and predict like GridSearchCV.
+    """
+
+    def __init__( self, score_func, cv=5, algorithm='auto', n_jobs=-1, verbose=1 ):
+        """
+        :param score_func: score_func(y_true, y_pred), higher is better
+        :param cv: number of folds, stratified and unshuffled like GridSearchCV or of patients
+        :param algorithm: neighbor search algorithm of NearestNeighbors, 'auto' picks a tree index or brute force
+        """
+        self.score_func = score_func
+        self.cv = cv
+        self.algorithm = algorithm
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.tables = dict()
+
+    def kneighbors( self, X_train, X_query, k_max, p=2 ):
+        """
+        :return: distances and indexes of the k_max nearest training rows of each query row, nearest first
+        """
+        search = NearestNeighbors(n_neighbors=k_max, p=p, algorithm=self.algorithm, n_jobs=self.n_jobs)
+        return search.fit(X_train).kneighbors(X_query)
+
+    def votes( self, distances, labels, weights ):
+        """
+        :param distances: numpy array of shape (n_rows, k_max)
+        :param labels: class index of each neighbor, same shape
+        :return: numpy array of shape (k_max, n_rows, n_classes): the votes of the first k neighbors, for every k
+        """
+        if weights == 'uniform':
+            weight = np.ones(distances.shape)
+        else:
+            with np.errstate(divide='ignore'):
+                weight = 1 / distances
+            # rows with a neighbor at distance 0 are decided by those neighbors only. Neighbors are sorted, so if any
+            # of the first k is at distance 0 the first one is
+            exact = distances[ :, 0 ] == 0
+            weight[ exact ] = distances[ exact ] == 0
+        one_hot = np.zeros(distances.shape + (self.n_classes,))
+        np.put_along_axis(one_hot, labels[ ..., np.newaxis ], weight[ ..., np.newaxis ], axis=2)
+        return np.moveaxis(np.cumsum(one_hot, axis=1), 1, 0)
+
+    def predictions( self, distances, labels, n_neighbors, weights ):
+        """
+        :return: dict[(k, weights), class indexes predicted with the first k neighbors]
+        """
+        predicted = dict()
+        for weight in weights:
+            votes = self.votes(distances, labels, weight)
+            for k in n_neighbors:
+                # argmax returns the first class among ties, like KNeighborsClassifier
+                predicted[ (k, weight) ] = np.argmax(votes[ k - 1 ], axis=1)
+        return predicted
+
+    @profile('train')
+    def fit( self, X, Y, n_neighbors, weights=('uniform', 'distance'), p=(2,), patients=None ):
+        """
+        :param n_neighbors: values of k. The largest one sets the size of the neighbor tables
+        :param p: values of the Minkowski power, one neighbor table per value and fold
+        :param patients: patient of each row. If given, the folds are PatientKFold folds
+        :return: self, with best_estimator_ fitted on all the rows
+        """
+        X = np.asarray(X)
+        self.classes_, Y_index = np.unique(np.asarray(Y), return_inverse=True)
+        self.n_classes = len(self.classes_)
+        self.n_neighbors = sorted(int(k) for k in n_neighbors)
+        k_max = self.n_neighbors[ -1 ]
+        if patients is not None:
+            folds = PatientKFold(self.cv).folds(patients)
+        else:
+            folds = list(StratifiedKFold(self.cv).split(np.zeros(len(Y_index)), Y_index))
+        scores = dict()
+        for power in p:
+            for train, test in folds:
+                distances, indexes = self.kneighbors(X[ train ], X[ test ], k_max, power)
+                for (k, weight), predicted in self.predictions(distances, Y_index[ train ][ indexes ],
+                                                               self.n_neighbors, weights).items():
+                    score = self.score_func(self.classes_[ Y_index[ test ] ], self.classes_[ predicted ])
+                    scores.setdefault((k, weight, power), list()).append(score)
+        # in the order of GridSearchCV, so that ties pick the same candidate
+        self.results_ = [ {'params': {'n_neighbors': k, 'weights': weight, 'p': power},
+                           'score': np.mean(scores[ (k, weight, power) ])}
+                          for k in self.n_neighbors for power in p for weight in weights ]
+        best = max(self.results_, key=lambda result: result[ 'score' ])
+        self.best_params_ = best[ 'params' ]
+        self.best_score_ = best[ 'score' ]
+        if self.verbose:
+            print('{:d} candidates from {:d} neighbor searches, best {} {:f}'.format(
+                len(self.results_), len(p) * self.cv, self.best_params_, self.best_score_))
+        self.X_ = X
+        self.Y_index_ = Y_index
+        self.tables = dict()
+        self.best_estimator_ = KNeighborsClassifier(algorithm=self.algorithm, n_jobs=self.n_jobs,
+                                                    **self.best_params_).fit(X, self.classes_[ Y_index ])
+        return self
+
+    def table( self, X, p ):
+        """
+        :return: distances and labels of the nearest training rows of X, computed once per X and p
+        """
+        key = (id(X), p)
+        if key not in self.tables:
+            distances, indexes = self.kneighbors(self.X_, X, self.n_neighbors[ -1 ], p)
+            # X is kept alive with its table, so that its id is not reused by another array
+            self.tables[ key ] = (X, distances, self.Y_index_[ indexes ])
+        return self.tables[ key ][ 1: ]
+
+    @profile('predict')
+    def predict( self, X, params=None ):
+        """
+        :param params: dict with n_neighbors, weights and p. Defaults to best_params_
+        """
+        if params is None:
+            params = self.best_params_
+        distances, labels = self.table(X, params[ 'p' ])
+        predicted = self.predictions(distances, labels, [ params[ 'n_neighbors' ] ], [ params[ 'weights' ] ])
+        return self.classes_[ predicted[ (params[ 'n_neighbors' ], params[ 'weights' ]) ] ]
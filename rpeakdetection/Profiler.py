@@ -0,0 +1,246 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+# stages of the pipelines, in order
+stages = ('load', 'quality', 'filter', 'features', 'train', 'predict', 'postprocess', 'evaluate')
+
+
+class Span:
+    """
+    Timed region of a Profiler, entered with the with statement
+    """
+
+    def __init__( self, profiler, stage, name ):
+        self.profiler = profiler
+        self.stage = stage
+        self.name = name
+
+    def __enter__( self ):
+        self.children_wall = 0.
+        self.children_peak = 0
+        self.profiler.stack().append(self)
+        if self.profiler.memory:
+            self.start_memory = tracemalloc.get_traced_memory()[ 0 ]
+            tracemalloc.reset_peak()
+        self.start_cpu = time.thread_time()
+        self.start_wall = time.perf_counter()
+        return self
+
+    def __exit__( self, *exc ):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.thread_time() - self.start_cpu
+        stack = self.profiler.stack()
+        stack.pop()
+        peak = 0
+        if self.profiler.memory:
+            # the peak of the children is lost when they reset it
+            peak = max(tracemalloc.get_traced_memory()[ 1 ], self.children_peak)
+        if len(stack) > 0:
+            stack[ -1 ].children_wall += wall
+            stack[ -1 ].children_peak = max(stack[ -1 ].children_peak, peak)
+        self.profiler.add(self, wall, cpu, max(peak - self.start_memory, 0) if self.profiler.memory else 0)
+        return False
+
+
+class Profiler:
+    """
+    Per stage instrumentation of the pipelines. Regions are wrapped in spans, with profiler.span(stage, name) or the
+    @profile(stage) decorator, and aggregated by stage and by name: calls, wall time, CPU time of the calling thread,
+    self wall time(without the nested spans) and, if memory is enabled, the peak of the bytes allocated by the span
+    over the ones allocated when it started(tracemalloc, slow).
+    Disabled by default: a disabled span is a shared null context, so instrumented code runs at full speed. Enabled by
+    enable(), or at import by the RPEAK_PROFILE environment variable(RPEAK_PROFILE=memory traces the memory too).
+    The results are exported as a JSON summary and as a Chrome trace(chrome://tracing, Perfetto).
+    Spans of worker processes are recorded by the profiler of the worker: the functions submitted to a process pool
+    are wrapped by remote(), which returns the spans of each call along with its result, and their results are
+    passed to merged(), which adds the spans to the ones of the parent, on the rows of the worker pid in the trace.
+    """
+
+    def __init__( self ):
+        self.enabled = False
+        self.memory = False
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.null = contextlib.nullcontext()
+        self.reset()
+
+    def enable( self, memory=False ):
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable( self ):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+
+    def reset( self ):
+        self.events = list()
+        self.totals = defaultdict(lambda: defaultdict(float))
+        self.origin = time.perf_counter()
+
+    def stack( self ):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = list()
+        return self.local.stack
+
+    def span( self, stage, name=None ):
+        """
+        :param stage: one of stages
+        :param name: name of the region, stage if None
+        """
+        if not self.enabled:
+            return self.null
+        return Span(self, stage, stage if name is None else name)
+
+    def profile( self, stage, name=None ):
+        """decorator wrapping every call of the function in a span, named after the function if name is None
+        """
+
+        def decorator( function ):
+            span_name = function.__qualname__ if name is None else name
+
+            @functools.wraps(function)
+            def wrapper( *args, **kwargs ):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Span(self, stage, span_name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def add( self, span, wall, cpu, allocated ):
+        with self.lock:
+            self.events.append({'name': span.name, 'cat': span.stage, 'ph': 'X', 'pid': os.getpid(),
+                                'tid': threading.get_ident(), 'ts': (span.start_wall - self.origin) * 1e6,
+                                'dur': wall * 1e6, 'args': {'cpu_ms': cpu * 1e3, 'bytes': allocated}})
+            for key in ((span.stage,), (span.stage, span.name)):
+                total = self.totals[ key ]
+                total[ 'calls' ] += 1
+                total[ 'wall' ] += wall
+                total[ 'self_wall' ] += wall - span.children_wall
+                total[ 'cpu' ] += cpu
+                total[ 'peak_bytes' ] = max(total[ 'peak_bytes' ], allocated)
+
+    def snapshot( self ):
+        """
+        :return: picklable copy of the events and of the totals, see merge
+        """
+        with self.lock:
+            return {'origin': self.origin, 'events': list(self.events),
+                    'totals': {key: dict(total) for key, total in self.totals.items()}}
+
+    def merge( self, snapshot ):
+        """adds the spans of the snapshot of another profiler, e.g. the one of a worker process. perf_counter is
+        system wide, so the events of the worker are shifted to the origin of this profiler
+        """
+        shift = (snapshot[ 'origin' ] - self.origin) * 1e6
+        with self.lock:
+            self.events.extend(dict(event, ts=event[ 'ts' ] + shift) for event in snapshot[ 'events' ])
+            for key, other in snapshot[ 'totals' ].items():
+                total = self.totals[ key ]
+                for field, value in other.items():
+                    total[ field ] = max(total[ field ], value) if field == 'peak_bytes' else total[ field ] + value
+
+    def remote( self, function ):
+        """
+        :param function: picklable function run in a worker process
+        :return: function returning (result, spans of the call) if enabled, function itself otherwise. The results
+            are unpacked by merged
+        """
+        return Remote(function, self.memory) if self.enabled else function
+
+    def merged( self, output ):
+        """
+        :param output: result of a function wrapped by remote
+        :return: the result of the function, its spans merged in this profiler
+        """
+        if not self.enabled:
+            return output
+        result, snapshot = output
+        if snapshot is not None:
+            self.merge(snapshot)
+        return result
+
+    def summary( self ):
+        """
+        :return: dict with the totals of each stage and of each span name, slowest first
+        """
+
+        def table( keys ):
+            rows = {key[ -1 ]: dict(self.totals[ key ], calls=int(self.totals[ key ][ 'calls' ]),
+                                    peak_bytes=int(self.totals[ key ][ 'peak_bytes' ])) for key in keys}
+            return dict(sorted(rows.items(), key=lambda row: -row[ 1 ][ 'wall' ]))
+
+        return {'stages': table([ key for key in self.totals if len(key) == 1 ]),
+                'spans': table([ key for key in self.totals if len(key) == 2 ])}
+
+    def report( self ):
+        """prints the totals of each stage
+        """
+        print('{:12s} {:>8s} {:>10s} {:>10s} {:>10s} {:>12s}'.format('stage', 'calls', 'wall(s)', 'self(s)', 'cpu(s)',
+                                                                    'peak(MB)'))
+        for stage, total in self.summary()[ 'stages' ].items():
+            print('{:12s} {:8d} {:10.3f} {:10.3f} {:10.3f} {:12.1f}'.format(stage, total[ 'calls' ], total[ 'wall' ],
+                                                                          total[ 'self_wall' ], total[ 'cpu' ],
+                                                                          total[ 'peak_bytes' ] / 2 ** 20))
+
+    def write_summary( self, path ):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as fid:
+            json.dump(self.summary(), fid, indent=2)
+
+    def write_trace( self, path ):
+        """writes the spans in the Chrome trace event format
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as fid:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, fid)
+
+    def export( self, name, out_dir='out/profile' ):
+        """prints the report and writes out_dir/name.json and out_dir/name.trace.json, if enabled
+        """
+        if not self.enabled:
+            return
+        self.report()
+        self.write_summary(os.path.join(out_dir, name + '.json'))
+        self.write_trace(os.path.join(out_dir, name + '.trace.json'))
+
+
+class Remote:
+    """
+    Function of Profiler.remote: in a worker process it profiles the call with the profiler of the worker and returns
+    its spans with the result. Called in the parent itself, e.g. by a joblib Parallel with n_jobs=1, the spans are
+    already recorded and None is returned in their place
+    """
+
+    def __init__( self, function, memory ):
+        self.function = function
+        self.memory = memory
+        self.pid = os.getpid()
+
+    def __call__( self, *args, **kwargs ):
+        if os.getpid() == self.pid:
+            return self.function(*args, **kwargs), None
+        if not profiler.enabled:
+            profiler.enable(self.memory)
+        # the worker may be a fork of the parent, or run several calls
+        profiler.reset()
+        result = self.function(*args, **kwargs)
+        return result, profiler.snapshot()
+
+
+profiler = Profiler()
+profile = profiler.profile
+if os.environ.get('RPEAK_PROFILE'):
+    profiler.enable(memory=os.environ[ 'RPEAK_PROFILE' ] == 'memory')
@@ -0,0 +1,186 @@
+import os
+from fractions import Fraction
+import numpy as np
+import wfdb
+from wfdb.io._signal import _digi_nan
+from scipy import signal
+from rpeakdetection.Profiler import profile
+
+# native sampling frequency of the databases
+db_fs = {'mitdb': 360, 'incartdb': 257}
+
+
+def ms2samples( ms, fs ):
+    """
+    :return: number of samples spanning ms milliseconds at fs Hz
+    """
+    return int(round(ms * fs / 1000.))
+
+
+class Record:
+    """
+    Single entry point to read the ECG signals, with a dtype policy: the samples are read as the digital ADC values
+    of the record(11 bit for MIT-BIH) in storage_dtype, int16 by default, and converted to physical units with the
+    per lead gain and baseline only when needed, in compute_dtype, float32 by default. The conversion is the one of
+    wfdb.rdrecord, missing samples included, so compute_dtype=np.float64 gives back record.p_signal exactly.
+    Records can be read at a sampling frequency other than their own: the signal is resampled once with a polyphase
+    filter and stored in store_dir, later reads load the stored signal. Records too long to be held in memory, e.g.
+    Holter records, are stored chunk by chunk and memory mapped by memmap. The stored signals, resampled or not, are
+    physical values in compute_dtype: only the reads from the record files keep the samples in storage_dtype.
+    """
+
+    def __init__( self, storage_dtype=np.int16, compute_dtype=np.float32, store_dir='data/resampled/' ):
+        self.storage_dtype = np.dtype(storage_dtype)
+        self.compute_dtype = np.dtype(compute_dtype)
+        self.store_dir = store_dir
+        self.frequencies = dict()
+
+    def fs( self, path ):
+        """
+        :return: sampling frequency of the record, read from its header once
+        """
+        if path not in self.frequencies:
+            self.frequencies[ path ] = wfdb.rdheader(path).fs
+        return self.frequencies[ path ]
+
+    def rescale( self, samples, fs_from, fs_to ):
+        """
+        :param samples: sample indexes, e.g. annotated peaks, at fs_from
+        :return: the same instants as sample indexes at fs_to
+        """
+        samples = np.asarray(samples, dtype=np.int64)
+        if fs_from == fs_to:
+            return samples
+        return np.round(samples * (fs_to / fs_from)).astype(np.int64)
+
+    def ratio( self, fs_from, fs_to ):
+        """
+        :return: up / down factors of the polyphase resampling from fs_from to fs_to
+        """
+        return Fraction(fs_to / fs_from).limit_denominator(1000)
+
+    def resampled_length( self, sig_len, fs_from, fs_to ):
+        """
+        :return: number of samples of a signal of sig_len samples resampled from fs_from to fs_to
+        """
+        if fs_from == fs_to:
+            return sig_len
+        ratio = self.ratio(fs_from, fs_to)
+        return -(-sig_len * ratio.numerator // ratio.denominator)
+
+    def read_digital( self, path, channels=None, sampfrom=0, sampto=None ):
+        """
+        :param path: path of the record without extension, e.g. data/ecg/mitdb/100
+        :param channels: list of channel indexes, all of them if None
+        :return: digital signal of shape (n_channels, sig_len) in storage_dtype, gain, baseline and digital value of
+            the missing samples of each channel, which depends on its storage format(-2048 for the 212 of MIT-BIH)
+        """
+        record = wfdb.rdrecord(path, channels=channels, sampfrom=sampfrom, sampto=sampto, physical=False,
+                               return_res=8 * self.storage_dtype.itemsize)
+        digital = np.ascontiguousarray(np.transpose(record.d_signal), dtype=self.storage_dtype)
+        return digital, np.asarray(record.adc_gain, dtype=np.float64), np.asarray(record.baseline, dtype=np.float64), \
+               np.asarray(_digi_nan(record.fmt), dtype=np.int64)
+
+    def to_physical( self, digital, gain, baseline, invalid, dtype=None ):
+        """
+        :param digital: digital signal of shape (n_channels, n_samples), or (n_samples,) with scalar gain, baseline
+            and invalid
+        :param invalid: digital value of the missing samples of each channel
+        :return: (digital - baseline) / gain in dtype, compute_dtype by default. Missing samples are NaN
+        """
+        dtype = self.compute_dtype if dtype is None else np.dtype(dtype)
+        if digital.ndim > 1:
+            gain = np.asarray(gain)[ :, np.newaxis ]
+            baseline = np.asarray(baseline)[ :, np.newaxis ]
+            invalid = np.asarray(invalid)[ :, np.newaxis ]
+        physical = np.subtract(digital, np.asarray(baseline, dtype=dtype), dtype=dtype)
+        physical /= np.asarray(gain, dtype=dtype)
+        physical[ digital == invalid ] = np.nan
+        return physical
+
+    @profile('load')
+    def read( self, path, channels=None, sampfrom=0, sampto=None, dtype=None, fs=None ):
+        """
+        :param fs: sampling frequency of the returned signal. If None or equal to the one of the record, the signal is
+            not resampled. Otherwise sampfrom and sampto are samples at fs
+        :return: physical signal of shape (n_channels, sig_len) in dtype, compute_dtype by default
+        """
+        if fs is not None and fs != self.fs(path):
+            resampled = self.resampled(path, channels, fs)[ :, sampfrom:sampto ]
+            # a writable copy, like the signals read from the record
+            return np.array(resampled, dtype=self.compute_dtype if dtype is None else dtype)
+        digital, gain, baseline, invalid = self.read_digital(path, channels=channels, sampfrom=sampfrom, sampto=sampto)
+        return self.to_physical(digital, gain, baseline, invalid, dtype=dtype)
+
+    def read_channel( self, path, channel, dtype=None, fs=None ):
+        """
+        :return: physical signal of a single channel, of shape (sig_len,)
+        """
+        return self.read(path, channels=[ channel ], dtype=dtype, fs=fs)[ 0 ]
+
+    def store_path( self, path, channels, fs ):
+        """
+        :return: path of the stored signal of the record at fs
+        """
+        db, name = os.path.split(os.path.normpath(path))
+        channels_name = 'all' if channels is None else '_'.join(str(channel) for channel in channels)
+        return os.path.join(self.store_dir, str(fs), os.path.basename(db), name + '_' + channels_name + '.npy')
+
+    @profile('load')
+    def memmap( self, path, channels=None, fs=None, chunk_size=2 ** 20 ):
+        """stores the physical signal of the record reading chunk_size samples at a time, the first time only, so
+        that memory is bounded by chunk_size
+        :param fs: sampling frequency of the returned signal, see read
+        :return: memory mapped signal of shape (n_channels, sig_len) in compute_dtype
+        """
+        if fs is not None and fs != self.fs(path):
+            return self.resampled(path, channels, fs, chunk_size=chunk_size)
+        store_path = self.store_path(path, channels, self.fs(path))
+        if not os.path.isfile(store_path):
+            header = wfdb.rdheader(path)
+            n_channels = header.n_sig if channels is None else len(channels)
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            tmp_path = store_path[ :-len('.npy') ] + '.tmp.npy'
+            stored = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.compute_dtype,
+                                               shape=(n_channels, header.sig_len))
+            for start in range(0, header.sig_len, chunk_size):
+                end = min(start + chunk_size, header.sig_len)
+                stored[ :, start:end ] = self.read(path, channels=channels, sampfrom=start, sampto=end)
+            stored.flush()
+            del stored
+            os.replace(tmp_path, store_path)
+        return np.load(store_path, mmap_mode='r')
+
+    def resampled( self, path, channels, fs, chunk_size=2 ** 20 ):
+        """resamples the record to fs with scipy.signal.resample_poly, the first time only, chunk_size output samples
+        at a time. Each chunk reads the input samples the polyphase filter reaches on both sides, starting at a
+        multiple of the down factor so that its outputs fall on the ones of the whole record, and matches
+        resample_poly of the whole record up to rounding
+        :return: memory mapped signal of shape (n_channels, samples at fs) in compute_dtype
+        """
+        store_path = self.store_path(path, channels, fs)
+        if not os.path.isfile(store_path):
+            ratio = self.ratio(self.fs(path), fs)
+            up, down = ratio.numerator, ratio.denominator
+            header = wfdb.rdheader(path)
+            n_channels = header.n_sig if channels is None else len(channels)
+            length = self.resampled_length(header.sig_len, self.fs(path), fs)
+            # half length of the filter of resample_poly, in input samples
+            halo = 10 * max(up, down) // up + 2
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            # written aside and renamed, so that an interrupted run never leaves a truncated signal in the store
+            tmp_path = store_path[ :-len('.npy') ] + '.tmp.npy'
+            stored = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.compute_dtype,
+                                               shape=(n_channels, length))
+            for start in range(0, length, chunk_size):
+                end = min(start + chunk_size, length)
+                low = max((start * down // up - halo) // down, 0) * down
+                high = min(-(-end * down // up) + halo, header.sig_len)
+                physical = self.read(path, channels=channels, sampfrom=low, sampto=high, dtype=np.float64)
+                resampled = signal.resample_poly(physical, up, down, axis=-1)
+                offset = low * up // down
+                stored[ :, start:end ] = resampled[ :, start - offset:end - offset ]
+            stored.flush()
+            del stored
+            os.replace(tmp_path, store_path)
+        return np.load(store_path, mmap_mode='r')
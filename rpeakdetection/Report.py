@@ -0,0 +1,176 @@
+import html
+import itertools
+import os
+import pickle
+import re
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+
+class Report:
+    """
+    Figures and tables of a run, collected as data while the run computes and rendered once at the end.
+    Nothing is drawn in the compute path: confusion(), curve(), signal(), lines() and table() only store the arrays.
+    render() pickles the figures and draws them to PNG with the Agg backend in a worker process, which writes an HTML
+    page with all of them, so that batch runs never block on a window and never import matplotlib.
+    """
+
+    def __init__( self ):
+        self.reset()
+
+    def reset( self ):
+        self.figures = list()
+
+    def confusion( self, cm, classes, title='Confusion matrix' ):
+        """
+        :param cm: confusion matrix, true labels on the rows. Rendered as counts and normalized by row
+        """
+        self.figures.append({'kind': 'confusion', 'title': title, 'cm': np.asarray(cm), 'classes': list(classes)})
+
+    def curve( self, title, x, ys, xlabel=None, ylabel=None, vlines=() ):
+        """
+        :param ys: dict[label, values at x]
+        :param vlines: x coordinates of vertical markers, e.g. the best parameter
+        """
+        self.figures.append({'kind': 'curve', 'title': title, 'x': np.asarray(x),
+                             'ys': {label: np.asarray(y) for label, y in ys.items()}, 'xlabel': xlabel,
+                             'ylabel': ylabel, 'vlines': list(vlines)})
+
+    def signal( self, title, x, y, points=None, vlines=None, hlines=None ):
+        """
+        :param points: dict[label, (indexes, values)] scattered over the signal
+        :param vlines: dict[label, x] of dashed vertical lines
+        :param hlines: dict[label, y] of horizontal lines
+        """
+        self.figures.append({'kind': 'signal', 'title': title, 'x': np.asarray(x), 'y': np.asarray(y),
+                             'points': dict(points or {}), 'vlines': dict(vlines or {}),
+                             'hlines': dict(hlines or {})})
+
+    def lines( self, title, lines ):
+        """
+        :param lines: list of arrays overlaid in the same axes, e.g. beats
+        """
+        self.figures.append({'kind': 'lines', 'title': title, 'lines': [ np.asarray(line) for line in lines ]})
+
+    def table( self, title, rows, columns=None ):
+        """
+        :param rows: dict[row name, values], e.g. the per class scores of a model
+        """
+        self.figures.append({'kind': 'table', 'title': title, 'columns': list(columns or []),
+                             'rows': {name: np.atleast_1d(values).tolist() for name, values in rows.items()}})
+
+    def render( self, name, out_dir='out/report', wait=False ):
+        """renders the collected figures to out_dir/name/ in a worker process, then resets the report
+        :param wait: whether to wait for the worker. Otherwise it keeps running after the caller exits
+        :return: the worker process, None if there is nothing to render
+        """
+        if len(self.figures) == 0:
+            return None
+        out_dir = os.path.join(out_dir, name)
+        os.makedirs(out_dir, exist_ok=True)
+        # a file per render, a worker still reading the figures of the previous one is not overwritten
+        fid, figures_path = tempfile.mkstemp(suffix='.pkl', dir=out_dir)
+        with os.fdopen(fid, 'wb') as fid:
+            pickle.dump(self.figures, fid)
+        self.reset()
+        # a new interpreter running this file: a forked child would inherit the state of TensorFlow and of the BLAS
+        # threads, and a spawned one would run again the main module of the scripts
+        worker = subprocess.Popen([ sys.executable, os.path.abspath(__file__), figures_path, out_dir, name ])
+        if wait:
+            worker.wait()
+        return worker
+
+
+def slug( title, index ):
+    return '{:02d}_'.format(index) + re.sub(r'[^0-9a-zA-Z]+', '_', title).strip('_')
+
+
+def draw_confusion( plt, cm, classes, title, normalize ):
+    if normalize:
+        cm = cm.astype('float') / np.maximum(cm.sum(axis=1)[ :, np.newaxis ], 1)
+    plt.imshow(cm, interpolation='nearest', cmap=plt.cm.Blues)
+    plt.title(title)
+    plt.colorbar()
+    tick_marks = np.arange(len(classes))
+    plt.xticks(tick_marks, classes)
+    plt.yticks(tick_marks, classes)
+    fmt = '.2f' if normalize else 'd'
+    thresh = cm.max() / 2.
+    for i, j in itertools.product(range(cm.shape[ 0 ]), range(cm.shape[ 1 ])):
+        plt.text(j, i, format(cm[ i, j ], fmt), horizontalalignment="center",
+                 color="white" if cm[ i, j ] > thresh else "black")
+    plt.ylabel('True label')
+    plt.xlabel('Predicted label')
+    plt.tight_layout()
+
+
+def draw( plt, figure ):
+    """draws figure in the current axes
+    """
+    if figure[ 'kind' ] == 'curve':
+        for label, y in figure[ 'ys' ].items():
+            plt.plot(figure[ 'x' ], y, label=label)
+        for x in figure[ 'vlines' ]:
+            plt.axvline(x, color='gray', linestyle='--')
+        plt.xlabel(figure[ 'xlabel' ] or '')
+        plt.ylabel(figure[ 'ylabel' ] or '')
+        plt.legend()
+    elif figure[ 'kind' ] == 'signal':
+        plt.plot(figure[ 'x' ], figure[ 'y' ])
+        for label, x in figure[ 'vlines' ].items():
+            plt.axvline(x, linestyle='--', label=label)
+        for label, y in figure[ 'hlines' ].items():
+            plt.axhline(y, label=label)
+        for label, (x, y) in figure[ 'points' ].items():
+            plt.scatter(x, y, label=label)
+        plt.legend()
+    elif figure[ 'kind' ] == 'lines':
+        for line in figure[ 'lines' ]:
+            plt.plot(line)
+    plt.title(figure[ 'title' ])
+
+
+def render( figures, out_dir, name ):
+    """draws figures to out_dir/*.png and writes out_dir/index.html, run by the worker of Report.render
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    os.makedirs(out_dir, exist_ok=True)
+    body = list()
+    for index, figure in enumerate(figures):
+        title = html.escape(figure[ 'title' ])
+        body.append('<h2>' + title + '</h2>')
+        if figure[ 'kind' ] == 'table':
+            header = ''.join('<th>' + html.escape(str(column)) + '</th>' for column in [ '' ] + figure[ 'columns' ])
+            rows = ''.join('<tr><th>' + html.escape(str(row)) + '</th>' +
+                           ''.join('<td>{:.4g}</td>'.format(value) for value in values) + '</tr>'
+                           for row, values in figure[ 'rows' ].items())
+            body.append('<table><tr>' + header + '</tr>' + rows + '</table>')
+            continue
+        variants = [ (False, ''), (True, '_normalized') ] if figure[ 'kind' ] == 'confusion' else [ (None, '') ]
+        for normalize, suffix in variants:
+            file_name = slug(figure[ 'title' ], index) + suffix + '.png'
+            plt.figure()
+            if figure[ 'kind' ] == 'confusion':
+                draw_confusion(plt, figure[ 'cm' ], figure[ 'classes' ],
+                               ('normalized ' if normalize else '') + figure[ 'title' ], normalize)
+            else:
+                draw(plt, figure)
+            plt.savefig(os.path.join(out_dir, file_name))
+            plt.close()
+            body.append('<img src="' + file_name + '" alt="' + title + '">')
+    with open(os.path.join(out_dir, 'index.html'), 'w') as fid:
+        fid.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>' + html.escape(name) +
+                  '</title><style>td, th {padding: 2px 8px; text-align: right}</style></head>\n<body><h1>' +
+                  html.escape(name) + '</h1>\n' + '\n'.join(body) + '\n</body></html>\n')
+
+
+report = Report()
+
+if __name__ == '__main__':
+    with open(sys.argv[ 1 ], 'rb') as fid:
+        render(pickle.load(fid), sys.argv[ 2 ], sys.argv[ 3 ])
+    os.remove(sys.argv[ 1 ])
@@ -0,0 +1,117 @@
+import numpy as np
+from scipy import stats
+from rpeakdetection.Record import ms2samples
+from rpeakdetection.Profiler import profile
+
+
+class SignalQuality:
+    """
+    Signal quality index of fixed windows of a record, computed on all the leads and windows at once.
+    A window of a lead is unusable if it is:
+    - flat: peak to peak amplitude below flat_amplitude(mV), e.g. lead off
+    - clipped: more than clip_fraction of its samples at the window maximum or minimum, e.g. ADC saturation
+    - not peaked: kurtosis below min_kurtosis, ECG is strongly peaked while noise is close to gaussian(3)
+    - out of band: power in 5-15 Hz(QRS) over power in 5-40 Hz outside power_ratio, e.g. muscle noise
+    A window of the record is usable if at least min_leads of its leads are. Detectors and classifiers take the
+    resulting mask to skip unusable windows instead of processing them.
+    """
+
+    def __init__( self, window_ms=2000, flat_amplitude=0.05, clip_fraction=0.02, min_kurtosis=5.,
+                  power_ratio=(0.4, 0.9), min_leads=1 ):
+        self.window_ms = window_ms
+        self.flat_amplitude = flat_amplitude
+        self.clip_fraction = clip_fraction
+        self.min_kurtosis = min_kurtosis
+        self.power_ratio = power_ratio
+        self.min_leads = min_leads
+
+    def window_size( self, fs ):
+        return ms2samples(self.window_ms, fs)
+
+    def windows( self, record, fs ):
+        """
+        :param record: signal of shape (leads, samples) or (samples,)
+        :return: view of shape (leads, n_windows, window_size). A last partial window is not included
+        """
+        record = np.atleast_2d(record)
+        window = self.window_size(fs)
+        n_windows = record.shape[ 1 ] // window
+        return record[ :, :n_windows * window ].reshape(len(record), n_windows, window)
+
+    def indexes( self, record, fs ):
+        """
+        :return: dict[index name, numpy array of shape (leads, n_windows)]
+        """
+        windows = self.windows(record, fs)
+        maximum = windows.max(axis=-1)
+        minimum = windows.min(axis=-1)
+        at_limits = (windows == maximum[ ..., np.newaxis ]) | (windows == minimum[ ..., np.newaxis ])
+        spectrum = np.abs(np.fft.rfft(windows - windows.mean(axis=-1, keepdims=True), axis=-1)) ** 2
+        frequencies = np.fft.rfftfreq(windows.shape[ -1 ], 1. / fs)
+        qrs_band = spectrum[ ..., (frequencies >= 5) & (frequencies <= 15) ].sum(axis=-1)
+        wide_band = spectrum[ ..., (frequencies >= 5) & (frequencies <= 40) ].sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            power_ratio = np.where(wide_band > 0, qrs_band / wide_band, 0)
+        return {'amplitude': maximum - minimum,
+                'clipped': at_limits.mean(axis=-1),
+                'kurtosis': np.nan_to_num(stats.kurtosis(windows, axis=-1, fisher=False)),
+                'power_ratio': power_ratio}
+
+    @profile('quality')
+    def lead_mask( self, record, fs ):
+        """
+        :return: boolean numpy array of shape (leads, n_windows), True where the window of the lead is usable
+        """
+        indexes = self.indexes(record, fs)
+        return (indexes[ 'amplitude' ] >= self.flat_amplitude) & (indexes[ 'clipped' ] <= self.clip_fraction) & \
+               (indexes[ 'kurtosis' ] >= self.min_kurtosis) & (indexes[ 'power_ratio' ] >= self.power_ratio[ 0 ]) & \
+               (indexes[ 'power_ratio' ] <= self.power_ratio[ 1 ])
+
+    def mask( self, record, fs ):
+        """
+        :return: boolean numpy array of shape (n_windows,), True where at least min_leads leads are usable
+        """
+        return self.combine(self.lead_mask(record, fs))
+
+    def combine( self, lead_mask ):
+        """
+        :param lead_mask: boolean numpy array of shape (leads, n_windows)
+        :return: window mask of shape (n_windows,)
+        """
+        return np.count_nonzero(lead_mask, axis=0) >= min(self.min_leads, len(lead_mask))
+
+    def sample_mask( self, mask, fs, sig_len ):
+        """
+        :param mask: window mask of shape (n_windows,), or lead mask of shape (leads, n_windows)
+        :return: boolean numpy array of shape (sig_len,), or (leads, sig_len). The samples after the last whole
+            window take the value of the last window
+        """
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape[ -1 ] == 0:
+            return np.ones(mask.shape[ :-1 ] + (sig_len,), dtype=bool)
+        sample_mask = np.repeat(mask, self.window_size(fs), axis=-1)[ ..., :sig_len ]
+        padding = [ (0, 0) ] * (mask.ndim - 1) + [ (0, sig_len - sample_mask.shape[ -1 ]) ]
+        return np.pad(sample_mask, padding, mode='edge')
+
+    def region_mask( self, mask, fs, region_size, n_regions, start=0 ):
+        """
+        :return: boolean numpy array of shape (n_regions,), True if all the samples of the region of region_size
+            samples, starting at start + i * region_size, are usable
+        """
+        sample_mask = self.sample_mask(mask, fs, start + n_regions * region_size)
+        return sample_mask[ start: ].reshape(n_regions, region_size).all(axis=1)
+
+    def report( self, mask, fs, name='' ):
+        """prints the unusable windows of a record
+        :return: fraction of unusable windows and list of unusable (start, end) sample spans
+        """
+        window = self.window_size(fs)
+        # edges of the runs of unusable windows
+        edges = np.diff(np.concatenate(([ 0 ], (~mask).astype(np.int8), [ 0 ])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        spans = [ (int(start * window), int(end * window)) for start, end in zip(starts, ends) ]
+        skipped = 1 - np.mean(mask) if len(mask) > 0 else 0.
+        print('{:s} skipped {:d}/{:d} windows({:.1%}) in {:d} spans'.format(name, int(np.count_nonzero(~mask)),
+                                                                          len(mask), skipped, len(spans)))
+        return skipped, spans
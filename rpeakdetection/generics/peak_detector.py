@@ -1,20 +1,25 @@
 import wfdb
 import peakutils
 from rpeakdetection.Utility import Utility
+from rpeakdetection.Record import Record, ms2samples
 import numpy as np
 from rpeakdetection.Evaluation import Evaluation
-import matplotlib.pyplot as plt
+from rpeakdetection.Profiler import profiler
+from rpeakdetection.Report import report
 from collections import defaultdict
-from beatclassification.LabelsExtraction import LabelsExtraction
 from rpeakdetection.KNN.FeatureExtraction import FeatureExtraction
 import time
-import sys
 
 PATH = 'data/ecg/mitdb/'
 util = Utility()
 rpeak = Evaluation()
-eval_width = 36
+# sampling frequency the records are read at, resampling them if needed
+FS = 360
+# 100 ms evaluation window and 200 ms refractory period, 36 and 72 samples at 360 Hz
+eval_width = ms2samples(100, FS)
+min_dist = ms2samples(200, FS)
 fe = FeatureExtraction()
+rd = Record()
 class PeakDetector():
 
     def choose_tresholds(self, thresholds):
@@ -24,71 +29,71 @@ class PeakDetector():
             print(name)
             for thresh in thresholds:
                 record, indices = self.detect_peaks(name, thresh)
-                recall, precision = rpeak.evaluate(indices, PATH + name, eval_width, rule_based=False)
+                recall, precision = rpeak.evaluate(indices, PATH + name, eval_width, rule_based=False, fs=FS)
                 precisions[thresh].append(precision)
                 recalls[thresh].append(recall)
         average_prec = [np.mean(precisions[t]) for t in thresholds]
         average_rec = [np.mean(recalls[t]) for t in thresholds]
         thresh_index = np.argmax([(average_prec[j] + average_rec[j])/2 for j in range(len(average_rec))])
         best_threshold = thresholds[thresh_index]
-        plt.plot([best_threshold]*2, [0, 1], label='best_threshold')
-        plt.plot(thresholds, average_prec, label = 'precision')
-        plt.plot(thresholds, average_rec, label = 'recall')
-        plt.xlabel('threshold')
-        plt.ylabel('precision/recall')
-        plt.legend()
+        report.curve('prec-rec-threshold-generic', thresholds, {'precision': average_prec, 'recall': average_rec},
+                     xlabel='threshold', ylabel='precision/recall', vlines=[best_threshold])
         print(average_rec)
         print(average_prec)
-        plt.savefig('prec-rec-threshold-generic.png')
         return best_threshold
 
-    def detect_peaks(self, name, thresh, filtered, channel, comb):
-        record = self.preprocess(name, filtered, channel, comb)
-        peaks = peakutils.indexes(record, thresh, min_dist=72)
+    def detect_peaks(self, name, thresh, filtered, channel, comb, quality=None):
+        record = self.preprocess(name, filtered, channel, comb, quality)
+        with profiler.span('predict', 'PeakDetector.detect_peaks'):
+            peaks = peakutils.indexes(record, thresh, min_dist=min_dist)
         return peaks
 
-    def preprocess(self, name, filtered, channels, comb):
+    def preprocess(self, name, filtered, channels, comb, quality=None):
+        '''
+        :param quality: SignalQuality. If given, the unusable windows are zeroed, so that no peak is detected there
+        '''
         filtered = filtered == 'FS'
         channel = [int(channels) - 1]
-        record = wfdb.rdrecord(PATH + name, channels=channel)
-        record = record.p_signal.flatten()
+        record = rd.read(PATH + name, channels=channel, fs=FS)[0]
+        if quality is not None:
+            mask = quality.mask(record, FS)
+            quality.report(mask, FS, name)
+            sample_mask = quality.sample_mask(mask, FS, len(record))
         record = np.abs(record)
         record = np.divide(record, np.max(record))
         if filtered:
-            record = fe.filter(record, comb)
+            record = fe.filter(record, comb, FS)
+        if quality is not None:
+            record = record * sample_mask
         return record
 
     def plot_criticism(self, signal, name, peaks,  threshold=None):
-        real_peaks = util.remove_non_beat('data/ecg/mitdb/' + name, False)[0]
+        '''
+        adds to the report the signal around the first detection outside of the evaluation window of every real peak
+        :return: the wrong detection and the closest real peak, None if all the detections are correct
+        '''
+        real_peaks = rd.rescale(util.remove_non_beat(PATH + name, False)[0], rd.fs(PATH + name), FS)
         # compute the first wrong detection
-        critics = list(filter(lambda x :min(np.abs([x - real_peaks[q] for q in range(len(real_peaks))])) > 18, peaks))
+        critics = list(filter(lambda x :min(np.abs([x - real_peaks[q] for q in range(len(real_peaks))])) > eval_width // 2, peaks))
         if len(critics) == 0:
             print("no crticisms")
-            sys.exit()
+            return None
         else:
             critic = critics[0]
             real_index = np.argmin(np.abs([critic - real_peaks[q] for q in range(len(real_peaks))]))
             real_plot = real_peaks[real_index]
             plot_from = max(0,min(real_plot, critic) -30)
             plot_to = max(real_plot, critic) + 30
-            fig, ax = plt.subplots()
-            signal_plot = signal[plot_from:plot_to]
-            min_y = min(signal_plot)
-            max_y = max(signal_plot)
-            plt.plot([real_plot - 18, real_plot - 18], [min_y, max_y], '--', label='start evaluation window')
-            plt.plot([real_plot + 18, real_plot + 18], [min_y, max_y], '--', label='end evaluation window')
-            ax.scatter([real_plot], [signal[real_plot]], color ='blue', label = 'real_peaks')
-            ax.scatter([critic], [signal[critic]], color ='red', label = 'detected_peak')
-            plt.plot(np.arange(plot_from, plot_to), signal_plot)
-            if threshold is not None:
-                plt.plot([0, plot_to], [threshold]*2, label = 'threshold')
-            ax.legend()
-            plt.legend()
-            plt.savefig("criticism.png")
-            plt.close()
+            half_width = eval_width // 2
+            report.signal('criticism ' + name, np.arange(plot_from, plot_to), signal[plot_from:plot_to],
+                          points={'real_peaks': ([real_plot], [signal[real_plot]]),
+                                  'detected_peak': ([critic], [signal[critic]])},
+                          vlines={'start evaluation window': real_plot - half_width,
+                                  'end evaluation window': real_plot + half_width},
+                          hlines={} if threshold is None else {'threshold': threshold})
             return critic, real_plot
 
-    def signals_evaluation(self, threshold):
+    def signals_evaluation(self, threshold, quality=None):
         combs = [['FS', '1'], ['FS', '2'], ['RS','1'], ['RS', '2']]
         results = defaultdict(list)
         for comb in combs:
@@ -99,10 +104,10 @@ class PeakDetector():
             times = list()
             for name in wfdb.get_record_list('mitdb'):
                 start_time = time.time()
-                peaks = self.detect_peaks(name, threshold, comb[0], comb[1], comb)
+                peaks = self.detect_peaks(name, threshold, comb[0], comb[1], comb, quality)
                 elapsed = time.time() - start_time
                 elapsed = elapsed/650000
-                precision, recall = rpeak.evaluate(peaks, PATH +name, eval_width, False)
+                precision, recall = rpeak.evaluate(peaks, PATH +name, eval_width, False, fs=FS)
                 precisions.append(precision)
                 recalls.append(recall)
                 times.append(elapsed)
@@ -114,4 +119,6 @@ class PeakDetector():
 if __name__ == '__main__':
     pd = PeakDetector()
     pd.signals_evaluation(0.3)
+    profiler.export('peak_detector')
+    report.render('peak_detector')
 
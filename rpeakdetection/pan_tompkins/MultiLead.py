@@ -0,0 +1,139 @@
+import time
+import numpy as np
+import wfdb
+from rpeakdetection.Evaluation import Evaluation
+from rpeakdetection.Record import Record, ms2samples
+from rpeakdetection.SignalQuality import SignalQuality
+from rpeakdetection.pan_tompkins.pan import Pan
+from rpeakdetection.Profiler import profile, profiler
+
+pan = Pan()
+rd = Record()
+rpeak = Evaluation()
+
+
+class MultiLead:
+    """
+    Pan-Tompkins R peak detection on all the leads of a record, e.g. the 12 leads of INCART.
+    The filter stages run once on the (leads, samples) array, then the leads are fused in a single peak stream:
+    - 'energy': the moving average envelopes of the leads are averaged, weighted by how peaked each envelope is, so
+      that flat, noisy leads count less. The adaptive thresholds run once, on the fused envelope.
+    - 'vote': the adaptive thresholds run on every lead and a peak is kept where at least min_votes leads detect
+      one within tolerance seconds. The fused position is the median of the lead positions.
+    """
+
+    def __init__( self, fusion='energy', min_votes=None, tolerance=0.075, quality=None ):
+        """
+        :param min_votes: leads needed to accept a peak in 'vote' fusion. Defaults to half of the leads
+        :param tolerance: seconds within which the detections of different leads refer to the same beat
+        :param quality: SignalQuality. If given, the unusable windows of each lead are gated out before the fusion, and
+            the windows with no usable lead are skipped and reported
+        """
+        self.fusion = fusion
+        self.min_votes = min_votes
+        self.tolerance = tolerance
+        self.quality = quality
+
+    def lead_weights( self, ecg_m ):
+        """
+        :param ecg_m: moving average envelopes of shape (leads, samples)
+        :return: weight of each lead, the ratio between the 99th percentile and the median of its envelope
+        """
+        peak = np.percentile(ecg_m, 99, axis=-1)
+        floor = np.median(ecg_m, axis=-1)
+        weights = peak / np.maximum(floor, np.finfo(ecg_m.dtype).eps)
+        return weights / np.sum(weights)
+
+    def detect( self, record, fs ):
+        """
+        :param record: signal of shape (leads, samples)
+        :param fs: sampling frequency
+        :return: sorted indexes of the R peaks
+        """
+        record = np.atleast_2d(record)
+        ecg_h, ecg_m, _ = pan.filter_stages(record, fs)
+        # computed before the gating, the zeroed windows would lower the median of the envelope
+        weights = self.lead_weights(ecg_m)
+        if self.quality is not None:
+            lead_mask = self.quality.lead_mask(record, fs)
+            mask = self.quality.combine(lead_mask)
+            self.quality.report(mask, fs)
+            # a lead has no energy and no vote in its unusable windows and in the skipped ones
+            ecg_m = pan.gate(ecg_m, self.quality.sample_mask(lead_mask & mask, fs, record.shape[ 1 ]))
+        if self.fusion == 'energy':
+            fused_m = np.tensordot(weights, ecg_m, axes=1)
+            # the bandpass peaks are searched on the weighted magnitude, the sign of the R wave differs among leads
+            fused_h = np.tensordot(weights, np.abs(ecg_h), axes=1)
+            _, peaks = pan.decision_rule(fused_h, fused_m, fs)
+            return np.unique(peaks.astype(np.int64))
+        elif self.fusion == 'vote':
+            detections = [ pan.decision_rule(ecg_h[ lead ], ecg_m[ lead ], fs)[ 1 ] for lead in range(len(record)) ]
+            return self.vote(detections, fs, len(record))
+        raise ValueError('unknown fusion ' + self.fusion)
+
+    @profile('postprocess')
+    def vote( self, detections, fs, n_leads ):
+        """
+        :param detections: list with the peak indexes of each lead
+        :return: median position of each group of detections, closer than tolerance, found by at least min_votes
+            distinct leads. Several detections of the same lead in a group count as a single vote
+        """
+        min_votes = self.min_votes if self.min_votes is not None else max(n_leads // 2, 1)
+        peaks = np.concatenate([ np.asarray(lead_peaks) for lead_peaks in detections ]).astype(np.int64)
+        if len(peaks) == 0:
+            return peaks
+        leads = np.repeat(np.arange(len(detections)), [ len(lead_peaks) for lead_peaks in detections ])
+        order = np.argsort(peaks, kind='stable')
+        peaks = peaks[ order ]
+        leads = leads[ order ]
+        # a new group starts where two consecutive detections are further than tolerance
+        starts = np.flatnonzero(np.diff(peaks) > int(round(self.tolerance * fs))) + 1
+        return np.array([ int(np.median(group)) for group, group_leads in zip(np.split(peaks, starts),
+                                                                             np.split(leads, starts))
+                          if len(np.unique(group_leads)) >= min_votes ], dtype=np.int64)
+
+    def benchmark( self, record, fs, lead_counts=(1, 2, 4, 8, 12), repeats=3 ):
+        """measures the detection time on the first n leads of record, for each n in lead_counts
+        :return: dict[n leads, dict] with the median time(s), the throughput in samples per second per lead and the
+            time relative to a single lead
+        """
+        results = dict()
+        for n_leads in lead_counts:
+            if n_leads > len(record):
+                continue
+            times = list()
+            for i in range(repeats):
+                start = time.perf_counter()
+                self.detect(record[ :n_leads ], fs)
+                times.append(time.perf_counter() - start)
+            elapsed = np.median(times)
+            results[ n_leads ] = {'seconds': elapsed, 'samples_per_second': n_leads * record.shape[ 1 ] / elapsed}
+        single = results[ min(results) ][ 'seconds' ]
+        for n_leads in results:
+            results[ n_leads ][ 'relative_time' ] = results[ n_leads ][ 'seconds' ] / single
+            print(n_leads, results[ n_leads ])
+        return results
+
+
+if __name__ == '__main__':
+    ecg_path = 'data/ecg/incartdb/'
+    fs = 257
+    evaluation_width = ms2samples(100, fs)
+    detectors = {'lead I': None, 'energy': MultiLead('energy'), 'vote': MultiLead('vote'),
+                 'gated energy': MultiLead('energy', quality=SignalQuality())}
+    scores = {name: list() for name in detectors}
+    for name in wfdb.get_record_list('incartdb'):
+        print(name)
+        record = rd.read(ecg_path + name)
+        for detector_name, detector in detectors.items():
+            if detector is None:
+                peaks = pan.pan_tompkin(record[ 0 ], fs)[ 1 ].astype(int)
+            else:
+                peaks = detector.detect(record, fs)
+            scores[ detector_name ].append(rpeak.evaluate(peaks, ecg_path + name, evaluation_width, rule_based=False))
+    for detector_name in detectors:
+        recall, precision = np.mean(scores[ detector_name ], axis=0)
+        print(detector_name + ': recall {:f}, precision {:f}'.format(recall, precision))
+    MultiLead('energy').benchmark(record, fs)
+    MultiLead('vote').benchmark(record, fs)
+    profiler.export('multilead')
@@ -5,6 +5,11 @@ import peakutils
 from scipy import signal
 import itertools
 import wfdb
+from rpeakdetection.Record import Record
+from rpeakdetection.ChunkedFilter import ChunkedFilter
+from rpeakdetection.Profiler import profile, profiler
+
+rd = Record()
 
 class Pan:
 
@@ -22,22 +27,57 @@ class Pan:
             delay : number of samples which the signal is delayed due to the filtering
 
         """
-    def pan_tompkin(self, ecg, fs):
+    def __init__(self, engine=None):
+        '''
+        :param engine: ChunkedFilter running the filter stages, e.g. chunk by chunk on a memory mapped Holter record.
+            By default the whole record is filtered at once
+        '''
+        self.engine = engine if engine is not None else ChunkedFilter()
+
+    def pan_tompkin(self, ecg, fs, mask=None):
+        '''
+        :param mask: boolean mask of the usable samples of ecg, e.g. SignalQuality.sample_mask. No peak is searched
+            where it is False
+        '''
+        ecg_h, ecg_m, delay = self.filter_stages(ecg, fs)
+        if mask is not None:
+            ecg_m = self.gate(ecg_m, mask)
+        qrs_amp_raw, qrs_i_raw = self.decision_rule(ecg_h, ecg_m, fs)
+        self.engine.release(ecg_h, ecg_m)
+        return qrs_amp_raw, qrs_i_raw, delay
 
-        ''' Initialize '''
+    def gate(self, ecg_m, mask):
+        '''
+        :param mask: boolean mask of the usable samples, of shape (..., samples)
+        :return: the moving average zeroed in place where mask is False, so that the decision rule finds no peak
+            there. The tail of the full convolution takes the value of the last sample
+        '''
+        mask = np.asarray(mask, dtype=bool)
+        padding = [(0, 0)] * (mask.ndim - 1) + [(0, ecg_m.shape[-1] - mask.shape[-1])]
+        mask = np.pad(mask, padding, mode='edge')
+        # chunk by chunk, so that a memory mapped envelope is never loaded whole
+        for start, end in self.engine.chunks(ecg_m.shape[-1]):
+            ecg_m[..., start:end] *= mask[..., start:end]
+        if isinstance(ecg_m, np.memmap):
+            ecg_m.flush()
+        return ecg_m
+
+    @profile('filter')
+    def filter_stages(self, ecg, fs):
+        '''
+        bandpass, derivative, squaring and moving average along the last axis, so that an array of shape
+        (leads, samples) is processed in one pass. Every lead is normalized independently
+        :return: bandpassed signal, moving average of the squared derivative and the delay of the moving average
+        '''
 
         delay = 0
-        skip = 0                    # Becomes one when a T wave is detected
-        m_selected_RR = 0
-        mean_RR = 0
-        ser_back = 0
 
 
         ''' Noise Cancelation (Filtering) (5-15 Hz) '''
 
         if fs == 200:
             ''' Remove the mean of Signal '''
-            ecg = ecg - np.mean(ecg)
+            ecg = ecg - np.mean(ecg, axis=-1, keepdims=True)
 
 
             ''' Low Pass Filter H(z) = (( 1 - z^(-6))^2) / (1-z^(-1))^2 '''
@@ -50,8 +90,8 @@ class Pan:
             Wn = 12*2/fs
             N = 3
             a, b = signal.butter(N, Wn, btype='lowpass')
-            ecg_l = signal.filtfilt(a, b, ecg)
-            ecg_l = ecg_l/np.max(np.abs(ecg_l))
+            ecg_l = self.engine.filtfilt(a, b, ecg)
+            ecg_l = self.engine.normalize(ecg_l, absolute=True)
 
             ''' High Pass Filter H(z) = (-1 + 32z^(-16) + z^(-32)) / (1+z^(-1))'''
             ''' It has come to my attention the original filter does not achieve 5 Hz
@@ -67,8 +107,9 @@ class Pan:
             Wn = 5*2/fs
             N = 3                                           # Order of 3 less processing
             a, b = signal.butter(N, Wn, btype='highpass')             # Bandpass filtering
-            ecg_h = signal.filtfilt(a, b, ecg_l, padlen=3*(max(len(a), len(b))-1))
-            ecg_h = ecg_h/np.max(np.abs(ecg_h))
+            ecg_h = self.engine.filtfilt(a, b, ecg_l, padlen=3*(max(len(a), len(b))-1))
+            self.engine.release(ecg_l)
+            ecg_h = self.engine.normalize(ecg_h, absolute=True)
 
         else:
             ''' Band Pass Filter for noise cancelation of other sampling frequencies (Filtering)'''
@@ -77,9 +118,9 @@ class Pan:
             Wn = [f1*2/fs, f2*2/fs]                         # cutoff based on fs
             N = 3                                           # order of 3 less processing
             a, b = signal.butter(N=N, Wn=Wn, btype='bandpass')   # Bandpass filtering
-            ecg_h = signal.filtfilt(a, b, ecg, padlen=3*(max(len(a), len(b)) - 1))
+            ecg_h = self.engine.filtfilt(a, b, ecg, padlen=3*(max(len(a), len(b)) - 1))
 
-            ecg_h = ecg_h/np.max(np.abs(ecg_h))
+            ecg_h = self.engine.normalize(ecg_h, absolute=True)
         ''' Derivative Filter '''
         ''' H(z) = (1/8T)(-z^(-2) - 2z^(-1) + 2z + z^(2)) '''
 
@@ -90,13 +131,14 @@ class Pan:
         else:
             b = [i*fs/8 for i in vector]
 
-        ecg_d = signal.filtfilt(b, 1, ecg_h, padlen=3*(max(len(a), len(b)) - 1))
+        ecg_d = self.engine.filtfilt(b, 1, ecg_h, padlen=3*(max(len(a), len(b)) - 1))
 
-        ecg_d = ecg_d/np.max(ecg_d)
+        ecg_d = self.engine.normalize(ecg_d)
 
         ''' Squaring nonlinearly enhance the dominant peaks '''
 
-        ecg_s = ecg_d**2
+        # in place, the derivative is not needed anymore
+        ecg_s = self.engine.map(np.square, ecg_d, out=ecg_d)
 
 
         ''' Moving Average '''
@@ -104,9 +146,24 @@ class Pan:
 
         temp_vector = np.ones((1, round(0.150*fs)))/round(0.150*fs)
         temp_vector = temp_vector.flatten()
-        ecg_m = np.convolve(ecg_s, temp_vector)
+        # full convolution, like np.convolve, of every lead
+        ecg_m = self.engine.convolve(ecg_s, temp_vector)
+        self.engine.release(ecg_s)
 
         delay = delay + round(0.150*fs)/2
+        return ecg_h, ecg_m, delay
+
+    @profile('predict')
+    def decision_rule(self, ecg_h, ecg_m, fs):
+        '''
+        adaptive thresholds on the peaks of a single lead
+        :return: amplitudes and indexes of the R peaks in the bandpassed signal
+        '''
+
+        skip = 0                    # Becomes one when a T wave is detected
+        m_selected_RR = 0
+        mean_RR = 0
+        ser_back = 0
 
 
         ''' Fiducial Marks '''
@@ -201,7 +258,9 @@ class Pan:
                 test_m = 0
 
             if bool(test_m):
-                if locs[i] - qrs_i[Beat_C-1] >= round(1.66*test_m):     # it shows a QRS is missed
+                # it shows a QRS is missed. The search back interval is empty if the peaks are closer than 400 ms
+                if locs[i] - qrs_i[Beat_C-1] >= round(1.66*test_m) and \
+                        locs[i] - qrs_i[Beat_C-1] >= 2*round(0.2*fs):
 
                     temp_vec = ecg_m[int(qrs_i[Beat_C-1] + round(0.2*fs)):int(locs[i] - round(0.2*fs))+1]
                     pks_temp = np.max(temp_vec) #search back and locate the max in the interval
@@ -339,7 +398,7 @@ class Pan:
         qrs_i = qrs_i[:Beat_C+1]
 
 
-        return qrs_amp_raw, qrs_i_raw, delay
+        return qrs_amp_raw, qrs_i_raw
 
 
     def rpeak_detection(self):
@@ -354,9 +413,7 @@ class Pan:
             channels = [int(comb[0]) - 1]
             for name in wfdb.get_record_list('mitdb'):
                 print(name)
-                record = wfdb.rdrecord(ecg_path+name, channels = channels)
-                record = np.transpose(record.p_signal)
-                record = record[0]
+                record = rd.read(ecg_path+name, channels = channels)[0]
                 start = time.time()
                 self.pan_tompkin(record, fs)
                 elapsed = time.time() - start
@@ -366,6 +423,7 @@ class Pan:
 if __name__ == '__main__':
     pan = Pan()
     pan.rpeak_detection()
+    profiler.export('pan_tompkins')
 
 
 